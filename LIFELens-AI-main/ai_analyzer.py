@@ -1,31 +1,129 @@
 import os
 import base64
+import hashlib
 import json
-from openai import OpenAI
+import time
 
 # the newest OpenAI model is "gpt-5" which was released August 7, 2025.
 # do not change this unless explicitly requested by the user
+# Calls go through the model cascade: gpt-5 is the large (escalation) tier,
+# see model_cascade.py for the fast tier and escalation rules
+
+# Retries are done here rather than inside the SDK so each one is counted in ai_calls
+MAX_RETRIES = int(os.getenv("LIFELENS_AI_MAX_RETRIES", "2"))
+RETRY_BACKOFF_SECONDS = 1.0
+
+# Bump when the scan prompt changes; stored with each analysis so older
+# results can be found and re-run (see batch_reanalysis.py)
+SCAN_PROMPT_VERSION = "scan_v1"
+SCAN_MAX_TOKENS = 2048
+
+# Study analysis: several views of one exam in a single request
+STUDY_PROMPT_VERSION = "study_v1"
+STUDY_IMAGE_SIZE = int(os.getenv("LIFELENS_STUDY_IMAGE_SIZE", "768"))
+MAX_STUDY_IMAGES = 12
 
 def get_openai_client():
     """Get OpenAI client instance"""
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
         return None
-    return OpenAI(api_key=api_key)
+    # Imported lazily; the SDK is slow to import and unused without a key
+    from openai import OpenAI
+    return OpenAI(api_key=api_key, max_retries=0)
+
+def _chat_json(client, model, messages, max_tokens, cap_fast_tokens=True):
+    """
+    Run one JSON-mode chat completion, retrying rate limits, timeouts and
+    server errors; returns (parsed JSON, token usage and retry count)
+    Non-large models are capped at FAST_MAX_TOKENS unless cap_fast_tokens is false
+    """
+    from openai import RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
+    from model_cascade import SchemaError, LARGE_MODEL, FAST_MAX_TOKENS
+    
+    retries = 0
+    while True:
+        try:
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                response_format={"type": "json_object"},
+                max_tokens=max_tokens if model == LARGE_MODEL or not cap_fast_tokens else min(max_tokens, FAST_MAX_TOKENS)
+            )
+            break
+        except (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError) as e:
+            if retries >= MAX_RETRIES:
+                e.retries = retries
+                raise
+            time.sleep(RETRY_BACKOFF_SECONDS * 2 ** retries)
+            retries += 1
+    
+    usage = {'prompt_tokens': 0, 'completion_tokens': 0, 'retries': retries}
+    if getattr(response, 'usage', None):
+        usage['prompt_tokens'] = response.usage.prompt_tokens or 0
+        usage['completion_tokens'] = response.usage.completion_tokens or 0
+    
+    try:
+        return json.loads(response.choices[0].message.content), usage
+    except (TypeError, ValueError) as e:
+        error = SchemaError(f"invalid JSON: {str(e)}")
+        error.retries = retries
+        raise error
+
+def _record_cache_hit(key, seconds):
+    """Record a caller served by another caller's in-flight or recent result"""
+    import ai_usage
+    ai_usage.record_call(key.split(':', 1)[0], None, 1000 * seconds, cache='hit')
 
 def encode_image_to_base64(image_path):
     """Encode image file to base64 string"""
     try:
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        from upload_crypto import read_upload
+        return base64.b64encode(read_upload(image_path)).decode('utf-8')
     except Exception as e:
         print(f"Error encoding image: {str(e)}")
         return None
 
-def analyze_kidney_scan(image_path, demographics=None):
+def encode_scan_images(image_path, max_size=None):
+    """
+    Base64 images to send for a scan: the file itself, or the representative
+    windowed frames of a DICOM file. With max_size, images are downscaled and
+    re-encoded as JPEG first. Returns None if the scan can't be read
+    """
+    import dicom_ingest
+    
+    if dicom_ingest.is_dicom(image_path):
+        try:
+            frames = dicom_ingest.model_frames(image_path, size=max_size or dicom_ingest.MODEL_SIZE)
+            return [base64.b64encode(frame).decode('utf-8') for frame in frames] or None
+        except Exception as e:
+            print(f"Error reading DICOM frames: {str(e)}")
+            return None
+    
+    if not max_size:
+        base64_image = encode_image_to_base64(image_path)
+        return [base64_image] if base64_image else None
+    
+    try:
+        from PIL import Image
+        import io
+        from upload_crypto import open_upload
+        
+        with open_upload(image_path) as f, Image.open(f) as img:
+            img.draft("RGB", (max_size, max_size))
+            img.thumbnail((max_size, max_size))
+            buffer = io.BytesIO()
+            img.convert("RGB").save(buffer, format="JPEG", quality=90)
+        return [base64.b64encode(buffer.getvalue()).decode('utf-8')]
+    except Exception as e:
+        print(f"Error encoding image: {str(e)}")
+        return None
+
+def analyze_kidney_scan(image_path, demographics=None, models=None):
     """
     Analyze kidney-related medical scan using OpenAI Vision API
-    Returns AI-generated analysis and recommendations
+    Returns AI-generated analysis and recommendations as a validated ScanAnalysis,
+    plus the model that produced it. models overrides the cascade tiers.
     """
     client = get_openai_client()
     
@@ -37,20 +135,64 @@ def analyze_kidney_scan(image_path, demographics=None):
         }
     
     try:
-        # Encode image to base64
-        base64_image = encode_image_to_base64(image_path)
+        # Encode image (or DICOM frames) to base64
+        base64_images = encode_scan_images(image_path)
         
-        if not base64_image:
+        if not base64_images:
             return {
                 'success': False,
                 'error': 'Failed to encode image',
                 'analysis': None
             }
         
-        # Build context from demographics if available
-        context = ""
-        if demographics:
-            context = f"""
+        from singleflight import run_once, flight_key
+        from model_cascade import model_tiers
+        
+        # Identical requests (double clicks, several tabs) share one model call
+        key = flight_key('scan_analysis', hashlib.sha256('\n'.join(base64_images).encode('utf-8')).hexdigest(),
+                         demographics, models or model_tiers())
+        return run_once(
+            key,
+            lambda: _analyze_encoded_scan(client, base64_images, demographics, models),
+            encode=_encode_scan_result,
+            decode=_decode_scan_result,
+            share=lambda result: result['success'],
+            on_join=_record_cache_hit
+        )
+        
+    except Exception as e:
+        return {
+            'success': False,
+            'error': f'Analysis failed: {str(e)}',
+            'analysis': None
+        }
+
+def _encode_scan_result(result):
+    stored = dict(result)
+    if stored.get('analysis') is not None:
+        stored['analysis'] = stored['analysis'].to_dict()
+    return json.dumps(stored)
+
+def _decode_scan_result(text):
+    from analysis_records import ScanAnalysis
+    
+    result = json.loads(text)
+    if result.get('analysis') is not None:
+        result['analysis'] = ScanAnalysis.from_stored(result['analysis'])
+    return result
+
+def build_scan_messages(base64_images, demographics=None):
+    """
+    Chat messages for a scan analysis (prompt version SCAN_PROMPT_VERSION)
+    base64_images is one base64 image or a list of frames from the same scan
+    """
+    if isinstance(base64_images, str):
+        base64_images = [base64_images]
+    
+    # Build context from demographics if available
+    context = ""
+    if demographics:
+        context = f"""
 Patient Context:
 - Age: {demographics.get('age', 'Unknown')}
 - Gender: {demographics.get('gender', 'Unknown')}
@@ -58,9 +200,9 @@ Patient Context:
 - Height: {demographics.get('height', 'Unknown')} cm
 - Medical History: {demographics.get('medical_history', 'None provided')}
 """
-        
-        # Create analysis prompt
-        prompt = f"""You are a medical imaging AI assistant specializing in kidney health analysis. 
+    
+    # Create analysis prompt
+    prompt = f"""You are a medical imaging AI assistant specializing in kidney health analysis. 
 Analyze this medical scan and provide a structured assessment.
 
 {context}
@@ -83,46 +225,259 @@ Please provide a detailed analysis in JSON format with the following structure:
 }}
 
 Important: This is for educational and monitoring purposes. Always emphasize the need for professional medical review."""
-        
-        # Call OpenAI Vision API
-        response = client.chat.completions.create(
-            model="gpt-5",
-            messages=[
+    
+    messages = [
+        {
+            "role": "user",
+            "content": [
                 {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-                    ]
+                    "type": "text",
+                    "text": prompt
                 }
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=2048
-        )
-        
-        # Parse response
-        analysis_result = json.loads(response.choices[0].message.content)
-        
-        return {
-            'success': True,
-            'error': None,
-            'analysis': analysis_result
+            ] + [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{base64_image}"
+                    }
+                }
+                for base64_image in base64_images
+            ]
         }
-        
-    except Exception as e:
+    ]
+    return messages
+
+def parse_scan_analysis(data):
+    """Validate a model's JSON scan analysis; raises SchemaError when unusable"""
+    from analysis_records import ScanAnalysis, AnalysisValidationError
+    from model_cascade import SchemaError
+    
+    try:
+        analysis = ScanAnalysis.from_dict(data)
+    except AnalysisValidationError as e:
+        raise SchemaError(str(e))
+    if analysis.risk_level is None or analysis.confidence_score is None:
+        raise SchemaError("missing risk_level or confidence_score")
+    return analysis
+
+def _analyze_encoded_scan(client, base64_images, demographics, models):
+    """Run the scan analysis cascade for already encoded images"""
+    messages = build_scan_messages(base64_images, demographics)
+    
+    from model_cascade import run_cascade, model_tiers, check_risk_result
+    
+    def call(model):
+        data, usage = _chat_json(client, model, messages, SCAN_MAX_TOKENS)
+        return parse_scan_analysis(data), usage
+    
+    # Parse and validate on a fast model first; escalate on low confidence or high risk
+    analysis_result, model, reasons = run_cascade(
+        'scan_analysis',
+        [(model, lambda model=model: call(model)) for model in (models or model_tiers())],
+        lambda analysis: check_risk_result({'risk_level': analysis.risk_level}, analysis.confidence_score)
+    )
+    
+    if analysis_result is None:
         return {
             'success': False,
-            'error': f'Analysis failed: {str(e)}',
+            'error': f"Analysis failed: {'; '.join(reasons)}",
             'analysis': None
         }
+    
+    return {
+        'success': True,
+        'error': None,
+        'analysis': analysis_result,
+        'model': model,
+        'prompt_version': SCAN_PROMPT_VERSION
+    }
+
+def analyze_upload(upload_id, user_email, file_path, demographics=None):
+    """
+    Analyze an upload and save the result, once even when requested concurrently
+    Returns {'analysis_id', 'error', 'existing'}; an upload that already has an
+    analysis is not analyzed again
+    """
+    from database import get_ai_analysis, save_ai_analysis
+    from singleflight import run_once, flight_key
+    
+    def run():
+        existing = get_ai_analysis(upload_id)
+        if existing:
+            return {'analysis_id': existing.id, 'error': None, 'existing': True}
+        
+        result = analyze_kidney_scan(file_path, demographics)
+        if not result['success']:
+            return {'analysis_id': None, 'error': result['error'], 'existing': False}
+        
+        analysis_id = save_ai_analysis(upload_id, user_email, result['analysis'], model=result.get('model'),
+                                       prompt_version=result.get('prompt_version'))
+        if not analysis_id:
+            return {'analysis_id': None, 'error': 'Failed to save analysis results', 'existing': False}
+        return {'analysis_id': analysis_id, 'error': None, 'existing': False}
+    
+    return run_once(flight_key('analyze_upload', upload_id), run,
+                    share=lambda outcome: outcome['analysis_id'] is not None,
+                    on_join=_record_cache_hit)
+
+def build_study_messages(views, demographics=None):
+    """
+    Chat messages for a study analysis (prompt version STUDY_PROMPT_VERSION)
+    views is a list of (label, [base64 images]) with one entry per upload
+    """
+    context = ""
+    if demographics:
+        context = f"""
+Patient Context:
+- Age: {demographics.get('age', 'Unknown')}
+- Gender: {demographics.get('gender', 'Unknown')}
+- Weight: {demographics.get('weight', 'Unknown')} kg
+- Height: {demographics.get('height', 'Unknown')} cm
+- Medical History: {demographics.get('medical_history', 'None provided')}
+"""
+    
+    prompt = f"""You are a medical imaging AI assistant specializing in kidney health analysis. 
+The following {len(views)} images are views from the same examination. Analyze each image,
+then give a combined assessment of the whole study.
+
+{context}
+
+Please provide a detailed analysis in JSON format with the following structure:
+{{
+    "images": [
+        {{
+            "image": "image number, starting at 1",
+            "scan_type": "type of medical scan (ultrasound/X-ray/CT/etc)",
+            "image_quality": "assessment of image quality (excellent/good/fair/poor)",
+            "key_findings": ["list of key observations"],
+            "potential_concerns": ["list of any concerning findings or areas requiring attention"],
+            "kidney_indicators": {{
+                "size": "assessment of kidney size",
+                "structure": "assessment of kidney structure",
+                "abnormalities": "any visible abnormalities"
+            }},
+            "recommendations": ["list of recommended actions or follow-ups"],
+            "risk_level": "risk assessment for this image (low/moderate/high)",
+            "confidence_score": "AI confidence in this image's analysis (0-100)"
+        }}
+    ],
+    "combined": {{
+        "scan_type": "type of examination",
+        "image_quality": "overall image quality (excellent/good/fair/poor)",
+        "key_findings": ["observations across all views"],
+        "potential_concerns": ["concerns across all views"],
+        "kidney_indicators": {{
+            "size": "assessment of kidney size",
+            "structure": "assessment of kidney structure",
+            "abnormalities": "any visible abnormalities"
+        }},
+        "recommendations": ["list of recommended actions or follow-ups"],
+        "risk_level": "overall risk assessment (low/moderate/high)",
+        "confidence_score": "AI confidence in the combined analysis (0-100)",
+        "disclaimer": "important medical disclaimer"
+    }}
+}}
+
+Important: This is for educational and monitoring purposes. Always emphasize the need for professional medical review."""
+    
+    content = [{"type": "text", "text": prompt}]
+    for number, (label, base64_images) in enumerate(views, start=1):
+        content.append({"type": "text", "text": f"Image {number}: {label}"})
+        content.extend({
+            "type": "image_url",
+            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
+        } for base64_image in base64_images)
+    
+    return [{"role": "user", "content": content}]
+
+def parse_study_analysis(data, image_count):
+    """Validate a study analysis; returns (per-image analyses in order, combined analysis)"""
+    from model_cascade import SchemaError
+    
+    images = data.get('images') if isinstance(data, dict) else None
+    if not isinstance(images, list) or len(images) != image_count:
+        raise SchemaError(f"expected {image_count} image analyses")
+    if not isinstance(data.get('combined'), dict):
+        raise SchemaError("missing combined analysis")
+    
+    # Each entry's "image" number is ignored; results are matched by position
+    return [parse_scan_analysis(image) for image in images], parse_scan_analysis(data['combined'])
+
+def analyze_study(study_id, user_email, demographics=None, models=None):
+    """
+    Analyze all uploads of a study in one model request with shared context
+    Saves a per-image analysis for each upload and the combined assessment;
+    returns {'study_analysis_id', 'error'}
+    """
+    from database import get_study_uploads, save_study_analysis
+    from model_cascade import run_cascade, model_tiers, check_risk_result
+    from singleflight import run_once, flight_key
+    
+    client = get_openai_client()
+    if not client:
+        return {'study_analysis_id': None, 'error': 'OpenAI API key not configured'}
+    
+    uploads = [upload for upload in get_study_uploads(study_id, user_email)
+               if upload['file_type'] in ('image', 'dicom') and upload['quality_verdict'] != 'reject']
+    if not uploads:
+        return {'study_analysis_id': None, 'error': 'The study has no images that can be analyzed'}
+    
+    views = []
+    for upload in uploads:
+        base64_images = encode_scan_images(upload['file_path'], STUDY_IMAGE_SIZE)
+        if not base64_images:
+            return {'study_analysis_id': None, 'error': f"Failed to read {upload['filename']}"}
+        views.append((upload['filename'], base64_images))
+    if sum(len(images) for _, images in views) > MAX_STUDY_IMAGES:
+        return {'study_analysis_id': None,
+                'error': f"A study can be analyzed with at most {MAX_STUDY_IMAGES} images"}
+    
+    messages = build_study_messages(views, demographics)
+    # Room for one analysis per image plus the combined one
+    max_tokens = SCAN_MAX_TOKENS + 1024 * len(views)
+    
+    def call(model):
+        data, usage = _chat_json(client, model, messages, max_tokens, cap_fast_tokens=False)
+        return parse_study_analysis(data, len(views)), usage
+    
+    def run():
+        result, model, reasons = run_cascade(
+            'study_analysis',
+            [(model, lambda model=model: call(model)) for model in (models or model_tiers())],
+            lambda result: check_risk_result({'risk_level': result[1].risk_level}, result[1].confidence_score)
+        )
+        if result is None:
+            return {'study_analysis_id': None, 'error': f"Analysis failed: {'; '.join(reasons)}"}
+        
+        per_image, combined = result
+        study_analysis_id = save_study_analysis(
+            study_id, user_email, combined,
+            {upload['id']: analysis for upload, analysis in zip(uploads, per_image)},
+            model=model, prompt_version=STUDY_PROMPT_VERSION
+        )
+        if not study_analysis_id:
+            return {'study_analysis_id': None, 'error': 'Failed to save analysis results'}
+        return {'study_analysis_id': study_analysis_id, 'error': None}
+    
+    images_digest = hashlib.sha256('\n'.join(image for _, images in views for image in images).encode('utf-8')).hexdigest()
+    return run_once(flight_key('study_analysis', study_id, images_digest, demographics, models or model_tiers()), run,
+                    share=lambda outcome: outcome['study_analysis_id'] is not None,
+                    on_join=_record_cache_hit)
+
+def build_analysis_summaries(analyses):
+    """Condense stored analyses into the summary list used for insights"""
+    analysis_summaries = []
+    for analysis in analyses:
+        analysis_summaries.append({
+            'date': analysis.analyzed_at,
+            'risk_level': analysis.risk_level,
+            'confidence': analysis.confidence_score,
+            'key_findings': list(analysis.analysis_data.key_findings),
+            'concerns': list(analysis.analysis_data.potential_concerns)
+        })
+    return analysis_summaries
+
+INSIGHTS_REQUIRED_KEYS = ('overall_health_status', 'lifestyle_recommendations', 'next_steps')
 
 def generate_health_insights(demographics, scan_analysis_list):
     """
@@ -165,19 +520,40 @@ Provide insights in this JSON structure:
     "next_steps": ["recommended next steps for care"]
 }}"""
         
-        response = client.chat.completions.create(
-            model="gpt-5",
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=2048
-        )
+        messages = [
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
         
-        return json.loads(response.choices[0].message.content)
+        from model_cascade import run_cascade, model_tiers, SchemaError
+        
+        def call(model):
+            insights, usage = _chat_json(client, model, messages, 2048)
+            missing = [key for key in INSIGHTS_REQUIRED_KEYS if not insights.get(key)]
+            if missing:
+                raise SchemaError(f"missing {', '.join(missing)}")
+            return insights, usage
+        
+        # Histories with a high-risk scan go straight to the large model
+        tiers = model_tiers()
+        if any(summary.get('risk_level') == 'high' for summary in scan_analysis_list):
+            tiers = tiers[-1:]
+        
+        def run():
+            insights, _, _ = run_cascade(
+                'health_insights',
+                [(model, lambda model=model: call(model)) for model in tiers],
+                lambda insights: None
+            )
+            return insights
+        
+        # Page reruns and other tabs asking for the same insights share one call
+        from singleflight import run_once, flight_key
+        return run_once(flight_key('health_insights', demographics, scan_analysis_list, tiers), run,
+                        share=lambda insights: insights is not None,
+                        on_join=_record_cache_hit)
         
     except Exception as e:
         print(f"Error generating insights: {str(e)}")
@@ -187,10 +563,19 @@ def assess_kidney_health_risk(demographics):
     """
     Assess kidney health risk based on demographics alone
     """
+    from risk_rules import assess_risk_with_rules
+    from model_cascade import CASCADE_ENABLED
+    
+    # The local rule engine is the first tier; the model is only needed to escalate
+    rules_assessment = assess_risk_with_rules(demographics)
+    
     client = get_openai_client()
     
     if not client:
-        return None
+        return rules_assessment if CASCADE_ENABLED else None
+    
+    if not CASCADE_ENABLED:
+        rules_assessment = None
     
     try:
         prompt = f"""Based on the following patient demographics, assess kidney health risk factors and provide recommendations:
@@ -212,19 +597,31 @@ Provide assessment in JSON format:
     "preventive_measures": ["preventive actions to take"]
 }}"""
         
-        response = client.chat.completions.create(
-            model="gpt-5",
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=1500
-        )
+        messages = [
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
         
-        return json.loads(response.choices[0].message.content)
+        from model_cascade import run_cascade, check_risk_result, SchemaError, LARGE_MODEL, RULES_TIER
+        
+        def call_model():
+            assessment, usage = _chat_json(client, LARGE_MODEL, messages, 1500)
+            if assessment.get('risk_level') not in ('low', 'moderate', 'high'):
+                raise SchemaError("missing risk_level")
+            return assessment, usage
+        
+        tiers = [(LARGE_MODEL, call_model)]
+        if rules_assessment:
+            tiers.insert(0, (RULES_TIER, lambda: (rules_assessment, None)))
+        
+        assessment, _, _ = run_cascade(
+            'risk_assessment',
+            tiers,
+            lambda assessment: check_risk_result(assessment, assessment.get('confidence', 100))
+        )
+        return assessment
         
     except Exception as e:
         print(f"Error assessing risk: {str(e)}")
@@ -0,0 +1,163 @@
+"""
+Token and latency accounting for AI calls.
+
+Every model call (and every request served from an in-flight or recent
+result) is recorded in the ai_calls table. Rows are queued in memory and
+written in batches by a background thread, so recording never adds a
+database write to the request path.
+
+Usage (report):
+    python ai_usage.py [--days 7] [--db lifelens_ai.db]
+"""
+import argparse
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import database
+
+FLUSH_INTERVAL_SECONDS = float(os.getenv("LIFELENS_AI_USAGE_FLUSH_SECONDS", "5"))
+FLUSH_BATCH_ROWS = 50
+# Rows kept when the database is unavailable, so memory stays bounded
+MAX_PENDING_ROWS = 10000
+
+_lock = threading.Lock()
+_pending = []
+_flusher = None
+
+def record_call(function, model, latency_ms, prompt_tokens=0, completion_tokens=0,
+                retries=0, cache='miss', outcome='ok', error=None):
+    """Queue one AI call record"""
+    row = (function, model, prompt_tokens or 0, completion_tokens or 0, int(latency_ms),
+           retries, cache, outcome, error[:500] if error else None,
+           datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+    with _lock:
+        _pending.append(row)
+        if len(_pending) > MAX_PENDING_ROWS:
+            del _pending[:len(_pending) - MAX_PENDING_ROWS]
+        should_flush = len(_pending) >= FLUSH_BATCH_ROWS
+
+    _ensure_flusher()
+    if should_flush:
+        flush()
+
+def flush():
+    """Write queued records now"""
+    with _lock:
+        if not _pending:
+            return 0
+        batch = _pending[:]
+        del _pending[:]
+
+    try:
+        conn = database.get_connection()
+        conn.executemany('''
+            INSERT INTO ai_calls (function, model, prompt_tokens, completion_tokens, latency_ms,
+                                  retries, cache, outcome, error, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', batch)
+        conn.commit()
+        conn.close()
+        return len(batch)
+    except Exception as e:
+        print(f"Error writing AI usage records: {str(e)}")
+        with _lock:
+            _pending[:0] = batch[-MAX_PENDING_ROWS:]
+        return 0
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL_SECONDS)
+        flush()
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="lifelens-ai-usage", daemon=True)
+            _flusher.start()
+            atexit.register(flush)
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def usage_report(days=7):
+    """
+    Per function and day: calls, errors, cache hits, retries, latency
+    percentiles, tokens and peak hourly throughput
+    """
+    since = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    groups = defaultdict(lambda: {'latencies': [], 'calls': 0, 'errors': 0, 'cache_hits': 0, 'retries': 0,
+                                  'prompt_tokens': 0, 'completion_tokens': 0, 'hours': defaultdict(int)})
+
+    for function, outcome, cache, retries, latency_ms, prompt_tokens, completion_tokens, created_at in database._iter_rows('''
+        SELECT function, outcome, cache, retries, latency_ms, prompt_tokens, completion_tokens, created_at
+        FROM ai_calls WHERE created_at >= ?
+        ORDER BY created_at
+    ''', (since,)):
+        group = groups[(created_at[:10], function)]
+        group['calls'] += 1
+        group['retries'] += retries
+        group['prompt_tokens'] += prompt_tokens
+        group['completion_tokens'] += completion_tokens
+        group['hours'][created_at[:13]] += 1
+        if outcome in ('error', 'schema_error'):
+            group['errors'] += 1
+        if cache == 'hit':
+            group['cache_hits'] += 1
+        else:
+            group['latencies'].append(latency_ms)
+
+    report = []
+    for (day, function), group in sorted(groups.items()):
+        latencies = sorted(group['latencies'])
+        report.append({
+            'day': day,
+            'function': function,
+            'calls': group['calls'],
+            'errors': group['errors'],
+            'cache_hits': group['cache_hits'],
+            'retries': group['retries'],
+            'p50_ms': _percentile(latencies, 0.50),
+            'p95_ms': _percentile(latencies, 0.95),
+            'p99_ms': _percentile(latencies, 0.99),
+            'prompt_tokens': group['prompt_tokens'],
+            'completion_tokens': group['completion_tokens'],
+            'peak_calls_per_hour': max(group['hours'].values())
+        })
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AI call usage per function and day")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--db", default=database.DB_PATH, help="Path to the database file")
+    args = parser.parse_args(argv)
+
+    database.DB_PATH = args.db
+    database.init_database()
+
+    report = usage_report(args.days)
+    if not report:
+        print(f"No AI calls recorded in the last {args.days} days")
+        return 0
+
+    print(f"{'day':<10} {'function':<26} {'calls':>6} {'err':>4} {'hits':>5} {'retry':>5} "
+          f"{'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'tok in':>8} {'tok out':>8} {'peak/h':>6}")
+    for row in report:
+        print(f"{row['day']:<10} {row['function']:<26} {row['calls']:>6} {row['errors']:>4} {row['cache_hits']:>5} "
+              f"{row['retries']:>5} {row['p50_ms']:>7} {row['p95_ms']:>7} {row['p99_ms']:>7} "
+              f"{row['prompt_tokens']:>8} {row['completion_tokens']:>8} {row['peak_calls_per_hour']:>6}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""
+Typed AI analysis records.
+
+Model output is validated and normalized once, when it is saved, into
+frozen slotted dataclasses. Readers get attributes with known types instead
+of dictionaries holding whatever JSON the model returned, and records can be
+shared through the data cache without being copied.
+"""
+import json
+from dataclasses import dataclass
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Stored with each analysis; rows at this version were normalized when saved
+SCHEMA_VERSION = 1
+
+RISK_LEVELS = ('low', 'moderate', 'high')
+RISK_UNKNOWN = 'unknown'
+_RISK_ALIASES = {'medium': 'moderate', 'elevated': 'moderate', 'minimal': 'low', 'severe': 'high'}
+
+class AnalysisValidationError(ValueError):
+    """Raised when model output can't be turned into a ScanAnalysis"""
+
+def dumps(value):
+    """Serialize to a JSON string, using orjson when it is installed"""
+    if orjson:
+        return orjson.dumps(value).decode('utf-8')
+    return json.dumps(value, separators=(',', ':'))
+
+def loads(text):
+    """Parse a JSON string, using orjson when it is installed"""
+    if orjson:
+        return orjson.loads(text)
+    return json.loads(text)
+
+def normalize_risk_level(value):
+    """Map model output such as 'Moderate' or 'medium risk' to low/moderate/high, or None"""
+    if not isinstance(value, str):
+        return None
+    text = value.strip().lower()
+    for word in text.replace('-', ' ').replace('/', ' ').split():
+        word = _RISK_ALIASES.get(word, word)
+        if word in RISK_LEVELS:
+            return word
+    return None
+
+def normalize_confidence(value):
+    """Coerce '85', '85%', 85.0 or 0.85 to an int percentage in 0-100, or None"""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip().rstrip('%').strip()
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if number != number:
+        return None
+    # Fractions are read as probabilities
+    if 0 < number <= 1 and not float(number).is_integer():
+        number *= 100
+    return int(round(min(max(number, 0), 100)))
+
+def _text(value, default=None):
+    if value is None:
+        return default
+    text = value.strip() if isinstance(value, str) else str(value)
+    return text or default
+
+def _text_list(value):
+    """Coerce a string, list or missing value to a tuple of non-empty strings"""
+    if value is None:
+        return ()
+    if isinstance(value, (str, dict)):
+        value = [value]
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    items = []
+    for item in value:
+        if isinstance(item, dict):
+            item = '; '.join(f"{key}: {val}" for key, val in item.items())
+        text = _text(item)
+        if text:
+            items.append(text)
+    return tuple(items)
+
+@dataclass(frozen=True, slots=True)
+class KidneyIndicators:
+    size: str = 'N/A'
+    structure: str = 'N/A'
+    abnormalities: str = 'None detected'
+
+    @classmethod
+    def from_dict(cls, data):
+        if isinstance(data, str):
+            return cls(abnormalities=_text(data, 'None detected'))
+        if not isinstance(data, dict) or not data:
+            return None
+        return cls(
+            size=_text(data.get('size'), 'N/A'),
+            structure=_text(data.get('structure'), 'N/A'),
+            abnormalities=_text(data.get('abnormalities'), 'None detected')
+        )
+
+    def to_dict(self):
+        return {'size': self.size, 'structure': self.structure, 'abnormalities': self.abnormalities}
+
+@dataclass(frozen=True, slots=True)
+class ScanAnalysis:
+    """One AI scan analysis, as returned by analyze_kidney_scan()"""
+    scan_type: str = 'Unknown'
+    image_quality: str = 'Unknown'
+    key_findings: tuple = ()
+    potential_concerns: tuple = ()
+    kidney_indicators: KidneyIndicators = None
+    recommendations: tuple = ()
+    risk_level: str = None
+    confidence_score: int = None
+    disclaimer: str = None
+
+    @classmethod
+    def from_dict(cls, data):
+        """Validate and normalize a model response"""
+        if isinstance(data, cls):
+            return data
+        if not isinstance(data, dict):
+            raise AnalysisValidationError(f"Expected a JSON object, got {type(data).__name__}")
+        return cls(
+            scan_type=_text(data.get('scan_type'), 'Unknown'),
+            image_quality=_text(data.get('image_quality'), 'Unknown'),
+            key_findings=_text_list(data.get('key_findings')),
+            potential_concerns=_text_list(data.get('potential_concerns')),
+            kidney_indicators=KidneyIndicators.from_dict(data.get('kidney_indicators')),
+            recommendations=_text_list(data.get('recommendations')),
+            risk_level=normalize_risk_level(data.get('risk_level')),
+            confidence_score=normalize_confidence(data.get('confidence_score')),
+            disclaimer=_text(data.get('disclaimer'))
+        )
+
+    @classmethod
+    def from_stored(cls, data):
+        """Load a stored analysis, skipping normalization for rows saved at SCHEMA_VERSION"""
+        if not isinstance(data, dict) or data.get('schema_version') != SCHEMA_VERSION:
+            return cls.from_dict(data)
+        indicators = data['kidney_indicators']
+        return cls(
+            data['scan_type'],
+            data['image_quality'],
+            tuple(data['key_findings']),
+            tuple(data['potential_concerns']),
+            KidneyIndicators(**indicators) if indicators else None,
+            tuple(data['recommendations']),
+            data['risk_level'],
+            data['confidence_score'],
+            data['disclaimer']
+        )
+
+    def to_dict(self):
+        """JSON-ready representation used for storage"""
+        return {
+            'schema_version': SCHEMA_VERSION,
+            'scan_type': self.scan_type,
+            'image_quality': self.image_quality,
+            'key_findings': list(self.key_findings),
+            'potential_concerns': list(self.potential_concerns),
+            'kidney_indicators': self.kidney_indicators.to_dict() if self.kidney_indicators else None,
+            'recommendations': list(self.recommendations),
+            'risk_level': self.risk_level,
+            'confidence_score': self.confidence_score,
+            'disclaimer': self.disclaimer
+        }
+
+@dataclass(frozen=True, slots=True)
+class AnalysisRecord:
+    """A stored analysis with its upload details"""
+    id: int
+    upload_id: int
+    analysis_data: ScanAnalysis
+    risk_level: str
+    confidence_score: int
+    analyzed_at: str
+    filename: str = None
+    file_path: str = None
+
+    @classmethod
+    def from_row(cls, analysis_id, upload_id, analysis_json, risk_level, confidence_score,
+                 analyzed_at, filename=None, file_path=None):
+        """
+        Build a record from database columns; rows saved before normalization are coerced too
+        Raises ValueError (AnalysisValidationError for JSON that isn't an object) for unreadable data
+        """
+        data = loads(analysis_json)
+        if not isinstance(data, dict):
+            raise AnalysisValidationError(f"Stored analysis is a JSON {type(data).__name__}, not an object")
+        analysis_data = ScanAnalysis.from_stored(data)
+        if data.get('schema_version') != SCHEMA_VERSION:
+            risk_level = normalize_risk_level(risk_level)
+            confidence_score = normalize_confidence(confidence_score)
+        risk_level = risk_level or analysis_data.risk_level or RISK_UNKNOWN
+        confidence = confidence_score
+        if confidence is None:
+            confidence = analysis_data.confidence_score or 0
+        return cls(analysis_id, upload_id, analysis_data, risk_level, confidence,
+                   analyzed_at, filename, file_path)
+
+def average_confidence(records):
+    """Mean confidence across records, 0 for an empty list"""
+    if not records:
+        return 0
+    return sum(record.confidence_score for record in records) / len(records)
@@ -1,18 +1,54 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import os
+import importlib
+import json
 from database import init_database, create_user, verify_user, get_user_demographics
-from auth import hash_password, verify_password, validate_email
-import pages.home as home
-import pages.demographics as demographics
-import pages.upload_analyze as upload_analyze
-import pages.diet_chart as diet_chart
-import pages.reports as reports
-import pages.ai_insights as ai_insights
-import pages.health_tracking as health_tracking
-
-# Initialize the database
+from auth import hash_password, verify_password, validate_email, start_background_calibration
+import session_store
+
+# Page modules are imported on first visit so the login screen doesn't pay
+# for plotly, pandas, reportlab and openai
+PAGE_MODULES = {
+    "Home": "pages.home",
+    "Demographics": "pages.demographics",
+    "Upload & Analyze": "pages.upload_analyze",
+    "AI Insights": "pages.ai_insights",
+    "Health Tracking": "pages.health_tracking",
+    "Diet Chart": "pages.diet_chart",
+    "Reports": "pages.reports",
+}
+
+def load_page(page_name):
+    """Import a page module on demand (cached by Python after the first run)"""
+    return importlib.import_module(PAGE_MODULES[page_name])
+
+# Initialize the database (only creates the schema once per process)
 init_database()
 
+def start_upload_encryption():
+    """
+    With a master key configured, encrypt plaintext uploads from before
+    encryption in place in the background (once per process). upload_crypto
+    loads cryptography, so it is only imported when there is work for it
+    """
+    if not os.getenv("LIFELENS_UPLOAD_KEY"):
+        return
+    from upload_crypto import start_background_migration
+    start_background_migration()
+
+start_upload_encryption()
+
+# Dashboard reads use periodic read-only snapshots of the database (see snapshot)
+from snapshot import start_background_refresh
+start_background_refresh()
+
+# Tune the password hashing cost to this machine before the first login (see auth)
+start_background_calibration()
+
+# Fail now, not at the first login, if session tokens can't be signed
+session_store.check_config()
+
 # Set page configuration
 st.set_page_config(
     page_title="LIFELens-AI: Kidney Health Monitoring",
@@ -28,6 +64,53 @@ if 'username' not in st.session_state:
     st.session_state.username = None
 if 'current_page' not in st.session_state:
     st.session_state.current_page = "Home"
+if 'session_token' not in st.session_state:
+    st.session_state.session_token = None
+if 'cookie_token' not in st.session_state:
+    # What the browser sent when it connected; st.context.cookies doesn't see later changes
+    st.session_state.cookie_token = st.context.cookies.get(session_store.COOKIE_NAME)
+
+def restore_session():
+    """
+    Log in from the session cookie, and out again once the session has ended.
+    Sessions live in a shared store (see session_store), so any replica can
+    serve any browser and a restart doesn't log anyone out.
+    """
+    if st.session_state.session_token:
+        user_email = session_store.resume_session(st.session_state.session_token)
+        if not user_email:
+            # Expired, or ended by a logout or password reset elsewhere
+            st.session_state.logged_in = False
+            st.session_state.username = None
+            st.session_state.session_token = None
+            st.session_state.current_page = "Home"
+        return
+
+    if not st.session_state.cookie_token:
+        return
+    # Cookie tokens are single-use; this tab keeps the one it gets back
+    user_email, token = session_store.exchange_session(st.session_state.cookie_token)
+    if user_email:
+        st.session_state.logged_in = True
+        st.session_state.username = user_email
+        st.session_state.session_token = token
+
+def sync_session_cookie():
+    """Set or clear the browser's session cookie to match this session's login"""
+    token = st.session_state.session_token if st.session_state.logged_in else None
+    if token == st.session_state.cookie_token:
+        return
+
+    # Streamlit can't set cookies itself; the component runs in a same-origin frame
+    cookie = f"{session_store.COOKIE_NAME}={token or ''}"
+    max_age = int(session_store.MAX_AGE_SECONDS) if token else 0
+    components.html(f"""
+        <script>
+        const secure = window.parent.location.protocol === "https:" ? "; Secure" : "";
+        window.parent.document.cookie = {json.dumps(cookie)} + "; Max-Age={max_age}; Path=/; SameSite=Strict" + secure;
+        </script>
+    """, height=0)
+    st.session_state.cookie_token = token
 
 def show_login_signup():
     """Display login and signup forms"""
@@ -51,8 +134,11 @@ def show_login_signup():
                         if user:
                             st.session_state.logged_in = True
                             st.session_state.username = email
+                            st.session_state.session_token = session_store.create_session(email)
                             st.success("Login successful!")
                             st.rerun()
+                        elif user is None:
+                            st.warning("Too many logins right now. Please try again in a moment.")
                         else:
                             st.error("Invalid email or password")
                     else:
@@ -128,7 +214,10 @@ def show_login_signup():
                         if all([security_answer_input, new_password_recovery, confirm_password_recovery]):
                             from database import verify_security_answer, reset_password
                             
-                            if verify_security_answer(recovery_email, security_answer_input):
+                            answer_ok = verify_security_answer(recovery_email, security_answer_input)
+                            if answer_ok is None:
+                                st.warning("Too many requests right now. Please try again in a moment.")
+                            elif answer_ok:
                                 if new_password_recovery == confirm_password_recovery:
                                     if len(new_password_recovery) >= 6:
                                         if reset_password(recovery_email, new_password_recovery):
@@ -157,9 +246,7 @@ def show_sidebar():
         st.write(f"Welcome, {st.session_state.username}")
         
         # Navigation menu
-        pages = ["Home", "Demographics", "Upload & Analyze", "AI Insights", "Health Tracking", "Diet Chart", "Reports"]
-        
-        for page in pages:
+        for page in PAGE_MODULES:
             if st.button(page, key=f"nav_{page}", use_container_width=True):
                 st.session_state.current_page = page
                 st.rerun()
@@ -168,6 +255,9 @@ def show_sidebar():
         
         # Logout button
         if st.button("Logout", use_container_width=True):
+            if st.session_state.session_token:
+                session_store.end_session(st.session_state.session_token)
+            st.session_state.session_token = None
             st.session_state.logged_in = False
             st.session_state.username = None
             st.session_state.current_page = "Home"
@@ -175,26 +265,15 @@ def show_sidebar():
 
 def main():
     """Main application logic"""
+    restore_session()
+    sync_session_cookie()
     if not st.session_state.logged_in:
         show_login_signup()
     else:
         show_sidebar()
         
         # Display the selected page
-        if st.session_state.current_page == "Home":
-            home.show_page()
-        elif st.session_state.current_page == "Demographics":
-            demographics.show_page()
-        elif st.session_state.current_page == "Upload & Analyze":
-            upload_analyze.show_page()
-        elif st.session_state.current_page == "AI Insights":
-            ai_insights.show_page()
-        elif st.session_state.current_page == "Health Tracking":
-            health_tracking.show_page()
-        elif st.session_state.current_page == "Diet Chart":
-            diet_chart.show_page()
-        elif st.session_state.current_page == "Reports":
-            reports.show_page()
+        load_page(st.session_state.current_page).show_page()
 
 if __name__ == "__main__":
     main()
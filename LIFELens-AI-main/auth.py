@@ -1,16 +1,165 @@
+"""
+Password and security answer hashing.
+
+Secrets are hashed with scrypt using a per-user random salt. The cost
+(N = 2**cost) is calibrated once per process so one hash takes about
+LIFELENS_PASSWORD_HASH_MS on this machine, or pinned with
+LIFELENS_PASSWORD_COST. Each stored hash records its own parameters, so
+hashes made at another cost, or on another replica, still verify.
+
+scrypt is slow and memory-hard by design, so every hash runs on a small
+shared pool of LIFELENS_KDF_WORKERS threads: concurrent logins wait their
+turn in arrival order instead of all hashing at once and starving the page
+renders of other users. A request that waits longer than
+LIFELENS_KDF_WAIT_SECONDS for a worker raises HashingBusy.
+
+Hashes from before scrypt (unsalted SHA-256) still verify and are replaced
+with scrypt hashes after the next successful login (see needs_rehash).
+"""
+import base64
 import hashlib
+import hmac
 import re
 import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 
-def hash_password(password):
-    """Hash a password using SHA-256"""
-    # Add a salt from environment or use a default
+HASH_TARGET_MS = float(os.getenv("LIFELENS_PASSWORD_HASH_MS", "100"))
+PINNED_COST = os.getenv("LIFELENS_PASSWORD_COST")
+KDF_WORKERS = int(os.getenv("LIFELENS_KDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+KDF_WAIT_SECONDS = float(os.getenv("LIFELENS_KDF_WAIT_SECONDS", "10"))
+
+# scrypt N = 2**cost; 2**14 is the usual interactive-login minimum, and
+# 2**17 already takes 128 MiB of memory per hash with r=8
+MIN_COST = 14
+MAX_COST = 17
+BLOCK_SIZE = 8
+PARALLELISM = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+_lock = threading.Lock()
+_cost_lock = threading.Lock()
+_cost = None
+_executor = None
+_calibrator = None
+_dummy_hash = None
+
+class HashingBusy(Exception):
+    """No hashing worker became free within KDF_WAIT_SECONDS"""
+
+def _scrypt(secret, salt, cost, block_size=BLOCK_SIZE, parallelism=PARALLELISM):
+    return hashlib.scrypt(secret.encode('utf-8'), salt=salt, n=2 ** cost, r=block_size, p=parallelism,
+                          maxmem=256 * block_size * 2 ** cost, dklen=KEY_BYTES)
+
+def calibrate(target_ms=None):
+    """The highest cost whose hash takes at most about target_ms here (at least MIN_COST)"""
+    target = (HASH_TARGET_MS if target_ms is None else target_ms) / 1000
+    cost = MIN_COST
+    salt = secrets.token_bytes(SALT_BYTES)
+    while cost < MAX_COST:
+        started = time.perf_counter()
+        _scrypt("calibration", salt, cost)
+        # Each step doubles the work
+        if (time.perf_counter() - started) * 2 > target:
+            break
+        cost += 1
+    return cost
+
+def get_cost():
+    """The cost new hashes are made with (calibrated on first use)"""
+    global _cost
+
+    with _cost_lock:
+        if _cost is None:
+            _cost = int(PINNED_COST) if PINNED_COST else calibrate()
+        return _cost
+
+def start_background_calibration():
+    """Calibrate the hashing cost from a daemon thread so the first login doesn't wait (once per process)"""
+    global _calibrator
+
+    with _lock:
+        if _cost is not None or _calibrator is not None:
+            return _calibrator
+        _calibrator = threading.Thread(target=get_cost, name="kdf-calibration", daemon=True)
+        _calibrator.start()
+        return _calibrator
+
+def _get_executor():
+    global _executor
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix="kdf")
+        return _executor
+
+def _run(func, *args):
+    """Run hashing work on the shared pool, waiting at most KDF_WAIT_SECONDS for a worker"""
+    future = _get_executor().submit(func, *args)
+    try:
+        return future.result(timeout=KDF_WAIT_SECONDS)
+    except FutureTimeout:
+        if future.cancel():
+            raise HashingBusy("Too many logins in progress")
+        # Already hashing; it finishes shortly
+        return future.result()
+
+def _legacy_hash(secret):
     salt = os.getenv("SESSION_SECRET", "lifelens_ai_salt")
-    return hashlib.sha256((password + salt).encode()).hexdigest()
+    return hashlib.sha256((secret + salt).encode()).hexdigest()
+
+def _hash(secret):
+    cost = get_cost()
+    salt = secrets.token_bytes(SALT_BYTES)
+    key = _scrypt(secret, salt, cost)
+    return "$".join(["scrypt", str(cost), str(BLOCK_SIZE), str(PARALLELISM),
+                     base64.b64encode(salt).decode('ascii'), base64.b64encode(key).decode('ascii')])
+
+def _verify(secret, stored_hash):
+    if not stored_hash.startswith("scrypt$"):
+        return hmac.compare_digest(_legacy_hash(secret), stored_hash)
+
+    _, cost, block_size, parallelism, salt, key = stored_hash.split("$")
+    candidate = _scrypt(secret, base64.b64decode(salt), int(cost), int(block_size), int(parallelism))
+    return hmac.compare_digest(candidate, base64.b64decode(key))
+
+def hash_password(password):
+    """Hash a password (or normalized security answer) with a fresh salt"""
+    return _run(_hash, password)
 
 def verify_password(password, password_hash):
-    """Verify a password against its hash"""
-    return hash_password(password) == password_hash
+    """Verify a password against its hash (scrypt or legacy SHA-256)"""
+    if not password_hash:
+        return False
+    return _run(_verify, password, password_hash)
+
+def needs_rehash(password_hash):
+    """True for legacy hashes and hashes weaker than the current cost"""
+    if not password_hash.startswith("scrypt$"):
+        return True
+    return int(password_hash.split("$")[1]) < get_cost()
+
+def rehash_in_background(password, password_hash, save):
+    """Hash a verified secret again on the pool and pass (old_hash, new_hash) to save; doesn't wait"""
+    def run():
+        try:
+            save(password_hash, _hash(password))
+        except Exception as e:
+            print(f"Error upgrading password hash: {str(e)}")
+
+    _get_executor().submit(run)
+
+def verify_unknown_account(password):
+    """Spend the same hashing time as a real check when the account doesn't exist; always False"""
+    global _dummy_hash
+
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_hex(16))
+    verify_password(password, _dummy_hash)
+    return False
 
 def validate_email(email):
     """Validate email format"""
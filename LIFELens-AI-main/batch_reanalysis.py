@@ -0,0 +1,406 @@
+"""
+Offline batch re-analysis of stored scans.
+
+When the scan prompt or model changes, historical uploads are re-run through a
+provider batch API instead of one synchronous call per click. A run builds
+JSONL request files from the selected uploads, submits them, polls until they
+finish and saves each result with save_ai_analysis() as the upload's new
+latest analysis. Progress is checkpointed to a state file after every step,
+so an interrupted run (or the next nightly job) resumes where it left off.
+
+Providers:
+    openai  OpenAI Batch API (half the price of synchronous calls, results within 24 hours)
+    local   file-based stand-in that answers each request with the upload's stored
+            analysis; exercises the whole pipeline without an API key (use a copy
+            of the database, results are saved like real ones)
+
+Usage:
+    python batch_reanalysis.py start [--all] [--user EMAIL] [--limit N] [--model gpt-5] [--provider local]
+    python batch_reanalysis.py resume [--wait]
+    python batch_reanalysis.py status
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+from itertools import islice
+
+import database
+
+WORK_DIR = os.getenv("LIFELENS_BATCH_DIR", "batch_reanalysis")
+BATCH_SIZE = 500
+# The OpenAI Batch API accepts input files up to 200 MB
+MAX_FILE_BYTES = 150 * 1024 * 1024
+POLL_SECONDS = 60
+
+class OpenAIBatchProvider:
+    """Submits request files to the OpenAI Batch API"""
+
+    def __init__(self):
+        from ai_analyzer import get_openai_client
+        self.client = get_openai_client()
+        if not self.client:
+            raise RuntimeError("OPENAI_API_KEY is not set")
+
+    def submit(self, input_path):
+        with open(input_path, 'rb') as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint="/v1/chat/completions",
+                                           completion_window="24h")
+        return batch.id
+
+    def poll(self, batch_id, output_path):
+        """Returns 'running', 'completed' (output written to output_path) or the failure status"""
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status in ('validating', 'in_progress', 'finalizing', 'cancelling'):
+            return 'running'
+
+        # Expired and cancelled batches keep the results they finished; the rest stay stale for the next run
+        if batch.output_file_id or batch.error_file_id:
+            with open(output_path, 'w') as f:
+                for file_id in (batch.output_file_id, batch.error_file_id):
+                    if file_id:
+                        f.write(self.client.files.content(file_id).text.rstrip('\n') + '\n')
+            return 'completed'
+        return batch.status
+
+class LocalBatchProvider:
+    """Stand-in that answers requests in-process from the stored analyses"""
+
+    def submit(self, input_path):
+        return f"local-{uuid.uuid4().hex[:12]}"
+
+    def poll(self, batch_id, output_path):
+        input_path = output_path.replace('.output.jsonl', '.jsonl')
+        with open(input_path) as source, open(output_path, 'w') as out:
+            for line in source:
+                request = json.loads(line)
+                out.write(json.dumps(self._respond(request)) + '\n')
+        return 'completed'
+
+    def _respond(self, request):
+        upload_id = _upload_id(request['custom_id'])
+        record = database.get_ai_analysis(upload_id)
+        if record is None:
+            return {'custom_id': request['custom_id'], 'response': None,
+                    'error': {'code': 'not_found', 'message': 'no stored analysis to replay'}}
+        return {
+            'custom_id': request['custom_id'],
+            'response': {
+                'status_code': 200,
+                'body': {
+                    'model': request['body']['model'],
+                    'choices': [{'message': {'role': 'assistant', 'content': json.dumps(record.analysis_data.to_dict())}}],
+                    'usage': {'prompt_tokens': 0, 'completion_tokens': 0}
+                }
+            },
+            'error': None
+        }
+
+PROVIDERS = {'openai': OpenAIBatchProvider, 'local': LocalBatchProvider}
+
+def _upload_id(custom_id):
+    return int(custom_id.split('-', 1)[1])
+
+def _state_path(work_dir):
+    return os.path.join(work_dir, "state.json")
+
+def load_state(work_dir=WORK_DIR):
+    path = _state_path(work_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(state, work_dir=WORK_DIR):
+    """Write the checkpoint atomically"""
+    path = _state_path(work_dir)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def select_uploads(include_current=False, user_email=None, limit=None):
+    """
+    Image uploads with an analysis that passed the quality gate; by default
+    only those analyzed with an older prompt version
+    """
+    from ai_analyzer import SCAN_PROMPT_VERSION
+
+    query = '''
+        SELECT u.id, u.user_email, u.file_path
+        FROM uploads u
+        JOIN ai_analysis a ON a.upload_id = u.id AND a.is_latest = 1
+        WHERE u.file_type IN ('image', 'dicom') AND (u.quality_verdict IS NULL OR u.quality_verdict != 'reject')
+    '''
+    params = []
+    if not include_current:
+        query += " AND a.prompt_version IS NOT ?"
+        params.append(SCAN_PROMPT_VERSION)
+    if user_email:
+        query += " AND u.user_email = ?"
+        params.append(user_email)
+    query += " ORDER BY u.id"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    return islice(database._iter_shard_rows(query, tuple(params)), limit)
+
+def build_request_files(uploads, model, work_dir, run_id, batch_size=BATCH_SIZE):
+    """
+    Write one JSONL chat-completion request per upload, split into files of at
+    most batch_size requests; returns (batch entries, skipped upload count)
+    """
+    from ai_analyzer import build_scan_messages, encode_scan_images, SCAN_MAX_TOKENS
+    from model_cascade import LARGE_MODEL, FAST_MAX_TOKENS
+
+    max_tokens = SCAN_MAX_TOKENS if model == LARGE_MODEL else min(SCAN_MAX_TOKENS, FAST_MAX_TOKENS)
+    demographics_cache = {}
+    batches = []
+    skipped = 0
+    out = None
+
+    try:
+        for upload_id, user_email, file_path in uploads:
+            base64_images = encode_scan_images(file_path) if os.path.exists(file_path) else None
+            if not base64_images:
+                skipped += 1
+                continue
+
+            if user_email not in demographics_cache:
+                demographics_cache[user_email] = database.get_user_demographics.__wrapped__(user_email)
+
+            line = json.dumps({
+                'custom_id': f"upload-{upload_id}",
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': {
+                    'model': model,
+                    'messages': build_scan_messages(base64_images, demographics_cache[user_email]),
+                    'response_format': {'type': 'json_object'},
+                    'max_tokens': max_tokens
+                }
+            }) + '\n'
+
+            if out is None or batches[-1]['requests'] >= batch_size or out.tell() + len(line) > MAX_FILE_BYTES:
+                if out:
+                    out.close()
+                input_file = os.path.join(work_dir, f"{run_id}-{len(batches):04d}.jsonl")
+                out = open(input_file, 'w')
+                batches.append({'input_file': input_file, 'requests': 0, 'status': 'pending',
+                                'provider_batch_id': None, 'ingested_lines': 0, 'saved': 0, 'failed': 0})
+            out.write(line)
+            batches[-1]['requests'] += 1
+    finally:
+        if out:
+            out.close()
+
+    return batches, skipped
+
+def start_run(provider, model, include_current=False, user_email=None, limit=None, work_dir=WORK_DIR,
+              batch_size=BATCH_SIZE):
+    """Select uploads and write the request files for a new run; returns the run state"""
+    from ai_analyzer import SCAN_PROMPT_VERSION
+
+    os.makedirs(work_dir, exist_ok=True)
+    previous = load_state(work_dir)
+    if previous and not previous.get('finished_at'):
+        raise RuntimeError(f"Run {previous['run_id']} is unfinished; resume it first")
+    if previous:
+        os.replace(_state_path(work_dir), os.path.join(work_dir, f"state-{previous['run_id']}.json"))
+
+    # IDs only increase within a database file, so the high-water mark is kept per shard
+    last_analysis_ids = {}
+    for db_path in database.shard_paths():
+        conn = database.get_connection(db_path)
+        last_analysis_ids[db_path] = conn.execute("SELECT COALESCE(MAX(id), 0) FROM ai_analysis").fetchone()[0]
+        conn.close()
+
+    run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+    batches, skipped = build_request_files(select_uploads(include_current, user_email, limit),
+                                           model, work_dir, run_id, batch_size)
+    state = {
+        'run_id': run_id,
+        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'finished_at': None,
+        'provider': provider,
+        'model': model,
+        'prompt_version': SCAN_PROMPT_VERSION,
+        'last_analysis_ids': last_analysis_ids,
+        'skipped_uploads': skipped,
+        'batches': batches
+    }
+    if not batches:
+        state['finished_at'] = state['created_at']
+    save_state(state, work_dir)
+    return state
+
+def _already_saved(upload_id, state):
+    """True if this run saved the upload's latest analysis before a crash lost the checkpoint"""
+    db_path = database._record_path('uploads', upload_id)
+    # Runs started before sharding recorded a single ID
+    last_analysis_id = state.get('last_analysis_ids', {}).get(db_path, state.get('last_analysis_id', 0))
+    conn = database.get_connection(db_path)
+    row = conn.execute('''
+        SELECT 1 FROM ai_analysis
+        WHERE upload_id = ? AND is_latest = 1 AND id > ? AND model = ? AND prompt_version = ?
+    ''', (upload_id, last_analysis_id, state['model'], state['prompt_version'])).fetchone()
+    conn.close()
+    return row is not None
+
+def _ingest_line(line, state):
+    """Save one batch result; returns True if an analysis was saved"""
+    import ai_usage
+    from ai_analyzer import parse_scan_analysis
+    from model_cascade import SchemaError
+
+    item = json.loads(line)
+    upload_id = _upload_id(item['custom_id'])
+    response = item.get('response') or {}
+    body = response.get('body') or {}
+    usage = body.get('usage') or {}
+
+    def record(outcome, error=None):
+        ai_usage.record_call('batch_reanalysis', state['model'], 0,
+                             prompt_tokens=usage.get('prompt_tokens', 0),
+                             completion_tokens=usage.get('completion_tokens', 0),
+                             outcome=outcome, error=error)
+
+    if item.get('error') or response.get('status_code') != 200:
+        error = (item.get('error') or {}).get('message') or f"status {response.get('status_code')}"
+        print(f"Error in batch result for upload {upload_id}: {error}")
+        record('error', error)
+        return False
+
+    if _already_saved(upload_id, state):
+        return True
+
+    try:
+        analysis = parse_scan_analysis(json.loads(body['choices'][0]['message']['content']))
+    except (SchemaError, TypeError, ValueError, KeyError, IndexError) as e:
+        print(f"Error in batch result for upload {upload_id}: {str(e)}")
+        record('schema_error', str(e))
+        return False
+
+    conn = database._record_connection('uploads', upload_id)
+    owner = conn.execute("SELECT user_email FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+    conn.close()
+    if not owner:
+        record('error', 'upload no longer exists')
+        return False
+
+    analysis_id = database.save_ai_analysis(upload_id, owner[0], analysis, model=state['model'],
+                                            prompt_version=state['prompt_version'])
+    record('ok' if analysis_id else 'error')
+    return bool(analysis_id)
+
+def ingest_batch(batch, state, work_dir=WORK_DIR):
+    """Save the results of a completed batch, continuing after the last checkpointed line"""
+    with open(batch['output_file']) as f:
+        for index, line in enumerate(f):
+            if index < batch['ingested_lines'] or not line.strip():
+                continue
+            if _ingest_line(line, state):
+                batch['saved'] += 1
+            else:
+                batch['failed'] += 1
+            batch['ingested_lines'] = index + 1
+            save_state(state, work_dir)
+
+    batch['status'] = 'ingested'
+    save_state(state, work_dir)
+
+def advance_run(state, provider, work_dir=WORK_DIR):
+    """Submit pending files, poll submitted batches and ingest finished ones; returns True when done"""
+    for batch in state['batches']:
+        if batch['status'] == 'pending':
+            batch['provider_batch_id'] = provider.submit(batch['input_file'])
+            batch['status'] = 'submitted'
+            save_state(state, work_dir)
+
+    for batch in state['batches']:
+        if batch['status'] == 'submitted':
+            output_file = batch['input_file'].replace('.jsonl', '.output.jsonl')
+            status = provider.poll(batch['provider_batch_id'], output_file)
+            if status == 'completed':
+                batch['status'] = 'completed'
+                batch['output_file'] = output_file
+            elif status != 'running':
+                batch['status'] = 'failed'
+                batch['error'] = status
+            save_state(state, work_dir)
+
+        if batch['status'] == 'completed':
+            ingest_batch(batch, state, work_dir)
+
+    if all(batch['status'] in ('ingested', 'failed') for batch in state['batches']):
+        state['finished_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        save_state(state, work_dir)
+        return True
+    return False
+
+def print_status(state):
+    print(f"Run {state['run_id']} ({state['provider']}, {state['model']}, prompt {state['prompt_version']}) "
+          f"started {state['created_at']}" + (f", finished {state['finished_at']}" if state['finished_at'] else ""))
+    if state['skipped_uploads']:
+        print(f"Skipped uploads (missing scan files): {state['skipped_uploads']}")
+    for batch in state['batches']:
+        print(f"  {os.path.basename(batch['input_file'])}: {batch['status']}, {batch['requests']} requests, "
+              f"{batch['saved']} saved, {batch['failed']} failed" + (f" ({batch['error']})" if batch.get('error') else ""))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-analyze stored scans through a batch API")
+    parser.add_argument("--db", default=database.DB_PATH, help="Path to the database file")
+    parser.add_argument("--work-dir", default=WORK_DIR, help="Directory for request files and the checkpoint")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    start = subparsers.add_parser("start", help="Build request files for a new run")
+    start.add_argument("--all", action="store_true", help="Include uploads already analyzed with the current prompt")
+    start.add_argument("--user", help="Only this user's uploads")
+    start.add_argument("--limit", type=int)
+    start.add_argument("--model", help="Model to run (default: the large model)")
+    start.add_argument("--provider", choices=sorted(PROVIDERS), default="openai")
+    start.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    resume = subparsers.add_parser("resume", help="Submit, poll and ingest the current run")
+    resume.add_argument("--wait", action="store_true", help="Keep polling until the run has finished")
+    resume.add_argument("--poll-seconds", type=float, default=POLL_SECONDS)
+
+    subparsers.add_parser("status", help="Show the current run")
+    args = parser.parse_args(argv)
+
+    database.DB_PATH = args.db
+    database.init_database()
+
+    if args.command == "start":
+        from model_cascade import LARGE_MODEL
+        try:
+            state = start_run(args.provider, args.model or LARGE_MODEL, args.all, args.user, args.limit,
+                              args.work_dir, args.batch_size)
+        except RuntimeError as e:
+            print(str(e))
+            return 1
+        print_status(state)
+        return 0
+
+    state = load_state(args.work_dir)
+    if state is None:
+        print(f"No run in {args.work_dir}")
+        return 1
+
+    if args.command == "resume" and not state['finished_at']:
+        try:
+            provider = PROVIDERS[state['provider']]()
+        except RuntimeError as e:
+            print(str(e))
+            return 1
+        while not advance_run(state, provider, args.work_dir) and args.wait:
+            time.sleep(args.poll_seconds)
+
+    print_status(state)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
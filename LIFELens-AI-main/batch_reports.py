@@ -0,0 +1,189 @@
+"""
+Batch generation of comprehensive health reports for every user.
+
+Streams users from the database and builds their PDF reports in a process
+pool. Finished reports are skipped on the next run, so an interrupted batch
+can simply be started again.
+
+Usage:
+    python batch_reports.py --output-dir monthly_reports --workers 4 --insights cached
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+import database
+
+INSIGHTS_MODES = ("skip", "cached", "live")
+
+class DirectoryReportStore:
+    """Report store backed by a local (or mounted) directory"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, key):
+        return os.path.join(self.root, key)
+
+    def exists(self, key):
+        return os.path.exists(self.path_for(key))
+
+    @contextmanager
+    def open_write(self, key):
+        """
+        Open a binary stream for a report. The file only appears under its
+        final name once the stream closes cleanly, so a partial file never
+        counts as finished.
+        """
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.part"
+        try:
+            with open(tmp_path, "wb") as f:
+                yield f
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def size(self, key):
+        return os.path.getsize(self.path_for(key))
+
+def get_report_store(target):
+    """Get a report store for an output target"""
+    if target.startswith("file://"):
+        target = target[len("file://"):]
+    if "://" in target:
+        raise ValueError(f"Unsupported report store: {target}")
+    return DirectoryReportStore(target)
+
+def report_key(period, user_email):
+    """Storage key for a user's report in a given period"""
+    safe_email = user_email.replace('@', '_at_').replace('.', '_')
+    return f"{period}/lifelens_health_report_{safe_email}.pdf"
+
+def _init_worker(db_path):
+    """Point each worker process at the same database"""
+    database.DB_PATH = db_path
+
+def _resolve_insights(user_email, demographics, analyses, insights_mode):
+    """Get insights for a report according to the selected mode"""
+    if insights_mode == "skip":
+        return None
+
+    if insights_mode == "cached":
+        return database.get_cached_health_insights(user_email)
+
+    if not demographics or not analyses:
+        return None
+
+    from ai_analyzer import generate_health_insights, build_analysis_summaries
+    insights = generate_health_insights(demographics, build_analysis_summaries(analyses))
+    if insights:
+        database.save_health_insights(user_email, insights)
+    return insights
+
+def build_user_report(user_email, target, key, insights_mode):
+    """Build and store one user's report (runs in a worker process)"""
+    try:
+        from pdf_generator import generate_comprehensive_health_report
+
+        demographics = database.get_user_demographics(user_email)
+        analyses = database.get_all_user_analyses(user_email)
+        insights = _resolve_insights(user_email, demographics, analyses, insights_mode)
+
+        # Stream the PDF straight into the store instead of buffering it
+        store = get_report_store(target)
+        with store.open_write(key) as pdf_out:
+            generate_comprehensive_health_report(user_email, demographics, analyses, insights, output=pdf_out)
+
+        return user_email, store.size(key), None
+
+    except Exception as e:
+        return user_email, 0, str(e)
+
+def peak_memory_mb():
+    """Peak resident memory of this process and its finished workers"""
+    parent = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return parent / scale, children / scale
+
+def run_batch(target, period, workers=4, insights_mode="cached", limit=None):
+    """Generate reports for all users, skipping those already written"""
+    store = get_report_store(target)
+    stats = {'generated': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+    max_in_flight = workers * 2
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(database.DB_PATH,)) as executor:
+        in_flight = set()
+
+        def collect(done):
+            for future in done:
+                user_email, size, error = future.result()
+                if error:
+                    stats['failed'] += 1
+                    print(f"Error generating report for {user_email}: {error}")
+                else:
+                    stats['generated'] += 1
+                    stats['bytes'] += size
+
+        for i, user_email in enumerate(database.iter_user_emails()):
+            if limit is not None and i >= limit:
+                break
+
+            key = report_key(period, user_email)
+            if store.exists(key):
+                stats['skipped'] += 1
+                continue
+
+            # Bound the queue so users are streamed rather than all submitted at once
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+
+            in_flight.add(executor.submit(build_user_report, user_email, target, key, insights_mode))
+
+        done, _ = wait(in_flight)
+        collect(done)
+
+    elapsed = time.perf_counter() - started
+    stats['elapsed'] = elapsed
+    stats['reports_per_sec'] = stats['generated'] / elapsed if elapsed > 0 else 0.0
+    stats['peak_parent_mb'], stats['peak_worker_mb'] = peak_memory_mb()
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate comprehensive health reports for all users")
+    parser.add_argument("--output-dir", required=True, help="Directory (or file:// URL) to write reports to")
+    parser.add_argument("--period", default=datetime.now().strftime("%Y-%m"),
+                        help="Report period used to group output files (default: current month)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--insights", choices=INSIGHTS_MODES, default="cached",
+                        help="skip AI insights, reuse cached insights, or generate them live")
+    parser.add_argument("--limit", type=int, default=None, help="Only process the first N users")
+    parser.add_argument("--db", default=database.DB_PATH, help="Path to the database file")
+    args = parser.parse_args(argv)
+
+    database.DB_PATH = args.db
+    database.init_database()
+
+    stats = run_batch(args.output_dir, args.period, args.workers, args.insights, args.limit)
+
+    print(f"Generated: {stats['generated']}  Skipped: {stats['skipped']}  Failed: {stats['failed']}")
+    print(f"Elapsed: {stats['elapsed']:.1f}s  Throughput: {stats['reports_per_sec']:.2f} reports/sec")
+    print(f"Output size: {stats['bytes'] / (1024 * 1024):.1f} MB")
+    print(f"Peak memory: parent {stats['peak_parent_mb']:.1f} MB, worker {stats['peak_worker_mb']:.1f} MB")
+
+    return 1 if stats['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Memory per analysis and load time for large histories.
+
+Compares the dictionaries readers used to build from each row (json.loads
+plus a wrapper dict) with the typed AnalysisRecord objects.
+
+Usage:
+    python benchmarks/bench_analysis_records.py [--sizes 1000 10000]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import database
+import analysis_records
+from bench_storage_codec import sample_analysis
+
+USER = "bench@example.com"
+QUERY = '''
+    SELECT a.id, a.upload_id, a.analysis_data, a.risk_level, a.confidence_score, a.analyzed_at, u.filename, u.file_path
+    FROM ai_analysis a
+    JOIN uploads u ON a.upload_id = u.id
+    WHERE a.user_email = ?
+    ORDER BY a.analyzed_at DESC
+'''
+
+def seed_history(target_size):
+    rng = random.Random(target_size)
+    conn = database.get_connection()
+    existing = conn.execute("SELECT COUNT(*) FROM ai_analysis").fetchone()[0]
+    conn.close()
+    for i in range(existing, target_size):
+        database.save_upload(USER, f"scan_{i}.png", f"uploads/scan_{i}.png", "image")
+        analysis = sample_analysis(rng)
+        # Model output as it arrives: confidence as a string
+        analysis['confidence_score'] = f"{analysis['confidence_score']}"
+        database.save_ai_analysis(i + 1, USER, analysis)
+
+def fetch_rows():
+    conn = database.get_connection()
+    rows = conn.execute(QUERY, (USER,)).fetchall()
+    conn.close()
+    return [(row[0], row[1], database._decode_column(row[2])) + tuple(row[3:]) for row in rows]
+
+def legacy_load(rows):
+    return [{
+        'id': row[0],
+        'upload_id': row[1],
+        'analysis_data': json.loads(row[2]),
+        'risk_level': row[3],
+        'confidence_score': row[4],
+        'analyzed_at': row[5],
+        'filename': row[6],
+        'file_path': row[7]
+    } for row in rows]
+
+def typed_load(rows):
+    return [analysis_records.AnalysisRecord.from_row(*row) for row in rows]
+
+def bytes_per_record(load, rows):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    loaded = load(rows)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(loaded)
+
+def median_ms(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark typed analysis records")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    codec = "orjson" if analysis_records.orjson else "json"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_PATH = os.path.join(tmp_dir, "bench.db")
+        database.init_database()
+
+        print(f"JSON codec: {codec}")
+        print(f"{'analyses':>9} {'dict B/rec':>11} {'typed B/rec':>12} {'dict ms':>9} {'typed ms':>9} {'reader ms':>10}")
+        for size in sorted(args.sizes):
+            seed_history(size)
+            rows = fetch_rows()
+            legacy_bytes = bytes_per_record(legacy_load, rows)
+            typed_bytes = bytes_per_record(typed_load, rows)
+            legacy_ms = median_ms(lambda: legacy_load(rows), args.repeat)
+            typed_ms = median_ms(lambda: typed_load(rows), args.repeat)
+            reader_ms = median_ms(lambda: database.get_all_user_analyses.__wrapped__(USER), args.repeat)
+            print(f"{size:>9} {legacy_bytes:>11.0f} {typed_bytes:>12.0f} {legacy_ms:>9.1f} {typed_ms:>9.1f} {reader_ms:>10.1f}")
+
+if __name__ == "__main__":
+    main()
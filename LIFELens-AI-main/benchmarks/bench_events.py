@@ -0,0 +1,89 @@
+"""
+Activity timeline latency as history grows.
+
+Compares the old Reports-page timeline (load every upload and report, sort
+in Python, keep 10) with LIMIT/COUNT lookups on the events log.
+
+Usage:
+    python benchmarks/bench_events.py [--sizes 100 1000 10000 50000]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import database
+
+USER = "bench@example.com"
+
+def seed_history(target_size):
+    """Grow the benchmark user's history to target_size uploads (and reports)"""
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM uploads WHERE user_email = ?", (USER,))
+    existing = cursor.fetchone()[0]
+
+    for i in range(existing, target_size):
+        filename = f"scan_{i}.png"
+        cursor.execute(
+            "INSERT INTO uploads (user_email, filename, file_path, file_type) VALUES (?, ?, ?, ?)",
+            (USER, filename, f"uploads/{filename}", "image")
+        )
+        upload_id = cursor.lastrowid
+        database._record_event(cursor, USER, 'upload', upload_id, f"Uploaded {filename}")
+
+        cursor.execute(
+            "INSERT INTO reports (user_email, upload_id, report_type, report_content) VALUES (?, ?, ?, ?)",
+            (USER, upload_id, "Upload Report", "# Health Report\n" * 20)
+        )
+        database._record_event(cursor, USER, 'report', cursor.lastrowid, "Generated Upload Report")
+
+    conn.commit()
+    conn.close()
+
+def legacy_timeline():
+    uploads = database.get_user_uploads.__wrapped__(USER)
+    reports = database.get_user_reports.__wrapped__(USER)
+    items = [(u['upload_date'][:10], f"Uploaded {u['filename']}") for u in uploads]
+    items += [(r['generated_at'][:10], f"Generated {r['report_type']}") for r in reports]
+    items.sort(reverse=True)
+    return items[:10], len(uploads), uploads[0] if uploads else None
+
+def event_timeline():
+    events = database.get_recent_events.__wrapped__(USER, 10)
+    count = database.count_events.__wrapped__(USER, 'upload')
+    latest = database.get_latest_upload.__wrapped__(USER)
+    return events, count, latest
+
+def median_ms(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the activity event log")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_PATH = os.path.join(tmp_dir, "bench.db")
+        database.init_database()
+
+        print(f"{'uploads':>8} {'legacy ms':>10} {'events ms':>10}")
+        for size in sorted(args.sizes):
+            seed_history(size)
+            legacy = median_ms(legacy_timeline, args.repeat)
+            events = median_ms(event_timeline, args.repeat)
+            print(f"{size:>8} {legacy:>10.2f} {events:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Image quality gate latency and backlog throughput.
+
+Scores synthetic scans (a smooth gradient with noise and edges) at common
+resolutions, then scores a backlog of uploads with one worker and with all
+cores.
+
+Usage:
+    python benchmarks/bench_image_quality.py [--backlog 200] [--repeat 10]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import numpy as np
+from PIL import Image
+
+import database
+import image_quality
+
+USER = "bench@example.com"
+RESOLUTIONS = [("1080p", 1920, 1080), ("4K", 3840, 2160)]
+
+def synthetic_scan(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = 60 + 120 * (x / width) * (y / height) + rng.normal(0, 12, (height, width))
+    # A bright ellipse gives the image real edges
+    inside = ((x - width / 2) / (width / 4)) ** 2 + ((y - height / 2) / (height / 3)) ** 2 < 1
+    pixels[inside] += 50
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).convert('RGB')
+
+def median_ms(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the image quality gate")
+    parser.add_argument("--backlog", type=int, default=200, help="Uploads in the backlog run")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"{'image':<10} {'format':<6} {'verdict':<8} {'median ms':>10}")
+        paths = {}
+        for label, width, height in RESOLUTIONS:
+            image = synthetic_scan(width, height)
+            for fmt in ("JPEG", "PNG"):
+                path = os.path.join(tmp_dir, f"{label}.{fmt.lower()}")
+                image.save(path, fmt)
+                paths[(label, fmt)] = path
+                verdict = image_quality.assess_image(path)['verdict']
+                ms = median_ms(lambda: image_quality.assess_image(path), args.repeat)
+                print(f"{label:<10} {fmt:<6} {verdict:<8} {ms:>10.1f}")
+
+        database.DB_PATH = os.path.join(tmp_dir, "bench.db")
+        database.init_database()
+        for i in range(args.backlog):
+            database.save_upload(USER, f"scan_{i}.jpg", paths[("1080p", "JPEG")], "image")
+
+        print(f"\nBacklog of {args.backlog} 1080p uploads:")
+        for workers in (1, os.cpu_count()):
+            started = time.perf_counter()
+            image_quality.score_backlog(rescore=True, workers=workers)
+            elapsed = time.perf_counter() - started
+            print(f"  {workers} worker(s): {elapsed:.2f} s ({args.backlog / elapsed:.0f} images/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Login throughput and latency during a login storm.
+
+Client threads (like Streamlit script threads) log in as fast as they can
+through database.verify_user for a fixed time, while a probe thread stands
+in for another user's page render: a short burst of Python work every 10 ms,
+timed. Modes differ only in how many scrypt hashes may run at once: as many
+as there are clients ("unbounded"), or the bounded worker pool; KDF MB is
+the scrypt memory those hashes can take at once. Busy logins are ones that
+waited longer than the queue timeout for a worker.
+
+Usage:
+    python benchmarks/bench_logins.py [--clients 16] [--seconds 5] [--workers N] [--target-ms 100]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import auth
+import database
+
+USERS = 20
+
+def _render_probe(stop, latencies):
+    while not stop.is_set():
+        started = time.perf_counter()
+        sum(i * i for i in range(20000))
+        latencies.append((time.perf_counter() - started) * 1000)
+        time.sleep(0.01)
+
+def _client(seed, deadline, results):
+    i = seed
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        ok = database.verify_user(f"user{i % USERS}@example.com", "bench-password")
+        results.append((ok, (time.perf_counter() - started) * 1000))
+        i += 1
+
+def run(label, workers, args):
+    auth.KDF_WORKERS = workers
+    auth._executor = None
+
+    stop = threading.Event()
+    render = []
+    probe = threading.Thread(target=_render_probe, args=(stop, render))
+    probe.start()
+
+    results = []
+    deadline = time.perf_counter() + args.seconds
+    clients = [threading.Thread(target=_client, args=(seed, deadline, results)) for seed in range(args.clients)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    stop.set()
+    probe.join()
+
+    latencies = sorted(latency for ok, latency in results if ok)
+    busy = sum(1 for ok, _ in results if ok is None)
+    failed = sum(1 for ok, _ in results if ok is False)
+    render.sort()
+    # scrypt needs 128 * r * N bytes per hash in progress
+    kdf_mb = min(workers, args.clients) * 128 * auth.BLOCK_SIZE * 2 ** auth.get_cost() / 1024 / 1024
+    print(f"{label:>10} {workers:>8} {kdf_mb:>7.0f} {len(latencies) / args.seconds:>9.1f} "
+          f"{statistics.median(latencies):>8.0f} {latencies[int(len(latencies) * 0.95)]:>8.0f} {busy:>5} {failed:>7} "
+          f"{statistics.median(render):>10.1f} {render[int(len(render) * 0.95)]:>10.1f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark login throughput with bounded password hashing")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent login threads")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--workers", type=int, default=auth.KDF_WORKERS, help="Hashing workers in bounded mode")
+    parser.add_argument("--target-ms", type=float, default=auth.HASH_TARGET_MS, help="Calibration target per hash")
+    args = parser.parse_args(argv)
+
+    auth.HASH_TARGET_MS = args.target_ms
+    cost = auth.get_cost()
+    started = time.perf_counter()
+    auth._hash("bench-password")
+    hash_ms = (time.perf_counter() - started) * 1000
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_PATH = os.path.join(tmp_dir, "bench.db")
+        database.init_database()
+        for i in range(USERS):
+            database.create_user(f"user{i}@example.com", "bench-password", "Bench User")
+
+        print(f"{args.clients} clients, {args.seconds:.0f}s per mode, scrypt N=2**{cost} ({hash_ms:.0f} ms/hash), "
+              f"{os.cpu_count()} CPU(s)")
+        print(f"{'mode':>10} {'workers':>8} {'KDF MB':>7} {'logins/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'busy':>5} "
+              f"{'failed':>7} {'render p50':>10} {'render p95':>10}")
+        run("unbounded", args.clients, args)
+        run("bounded", args.workers, args)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
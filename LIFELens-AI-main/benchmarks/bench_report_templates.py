@@ -0,0 +1,92 @@
+"""
+Database size and read latency for template-based report storage.
+
+Seeds upload reports as full markdown (the old storage), migrates them to
+template references, and compares the database size and the time to read a
+user's reports before and after.
+
+Usage:
+    python benchmarks/bench_report_templates.py [--reports 5000] [--users 50]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import database
+import report_templates
+
+def seed_legacy_reports(total, users):
+    """Insert fully rendered upload reports, as the app used to store them"""
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    for i in range(total):
+        user = f"user{i % users}@example.com"
+        demographics = {'age': 30 + i % 40, 'gender': 'Female' if i % 2 else 'Male',
+                        'weight': 60.0 + i % 30, 'height': 160.0 + i % 25, 'daily_water_intake': 6 + i % 5}
+        upload_info = {'filename': f"scan_{i}.png", 'file_type': 'image', 'upload_date': 'Just now'}
+        params = report_templates.build_upload_report_params(demographics, upload_info)
+        content = report_templates._render_upload_report(params)
+        cursor.execute(
+            "INSERT INTO reports (user_email, upload_id, report_type, report_content) VALUES (?, ?, ?, ?)",
+            (user, i + 1, "Upload Report", content)
+        )
+    conn.commit()
+    conn.close()
+
+def db_size_kb():
+    report_templates.vacuum_database()
+    return os.path.getsize(database.DB_PATH) / 1024
+
+def median_ms(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark template-based report storage")
+    parser.add_argument("--reports", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    user = "user0@example.com"
+    read_reports = lambda: database.get_user_reports.__wrapped__(user)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_PATH = os.path.join(tmp_dir, "bench.db")
+        database.init_database()
+        seed_legacy_reports(args.reports, args.users)
+
+        size_before = db_size_kb()
+        text_ms = median_ms(read_reports, args.repeat)
+
+        stats = report_templates.migrate_report_rows()
+        size_after = db_size_kb()
+
+        def cold_read():
+            report_templates.render_report.cache_clear()
+            read_reports()
+
+        cold_ms = median_ms(cold_read, args.repeat)
+        read_reports()
+        warm_ms = median_ms(read_reports, args.repeat)
+
+        per_user = args.reports // args.users
+        print(f"Reports: {args.reports} ({stats['migrated']} migrated, {stats['skipped']} left as text)")
+        print(f"Report bodies: {stats['bytes_before'] / 1024:.1f} KB -> {stats['bytes_after'] / 1024:.1f} KB")
+        print(f"Database file: {size_before:.1f} KB -> {size_after:.1f} KB "
+              f"({100 * (1 - size_after / size_before):.0f}% smaller)")
+        print(f"Read {per_user} reports for one user (median ms):")
+        print(f"  stored text {text_ms:.2f}  template cold {cold_ms:.2f}  template memoized {warm_ms:.2f}")
+
+if __name__ == "__main__":
+    main()
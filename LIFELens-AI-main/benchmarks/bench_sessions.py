@@ -0,0 +1,108 @@
+"""
+Session resumption across app replicas behind a non-sticky load balancer.
+
+Each replica is a separate process with its own session store handle. Users
+log in on a random replica; every later page request goes to a replica
+picked at random, which must resume the session from the token alone. With
+the shared database store every request should resume; with the in-process
+store only requests that land on the replica that served the login do.
+Per-replica request counts show how evenly the balancer spread the load.
+
+Usage:
+    python benchmarks/bench_sessions.py [--replicas 4] [--users 200] [--requests 20]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from multiprocessing import Process, Queue
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import database
+import session_store
+
+def _replica(db_path, store, inbox, outbox):
+    database.DB_PATH = db_path
+    session_store.STORE = store
+    while True:
+        command, items = inbox.get()
+        if command == 'stop':
+            return
+        if command == 'login':
+            outbox.put([(user, session_store.create_session(user)) for user in items])
+        else:
+            resumed, latencies = 0, []
+            for user, token in items:
+                started = time.perf_counter()
+                if session_store.resume_session(token) == user:
+                    resumed += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+            outbox.put((resumed, latencies))
+
+def run(store, db_path, args):
+    os.environ["LIFELENS_SESSION_SECRET"] = "bench-session-secret"
+    replicas = []
+    for _ in range(args.replicas):
+        inbox, outbox = Queue(), Queue()
+        process = Process(target=_replica, args=(db_path, store, inbox, outbox))
+        process.start()
+        replicas.append((process, inbox, outbox))
+
+    rng = random.Random(1)
+    users = [f"user{i}@example.com" for i in range(args.users)]
+    logins = [[] for _ in replicas]
+    for user in users:
+        logins[rng.randrange(len(replicas))].append(user)
+    tokens = []
+    for (_, inbox, _), batch in zip(replicas, logins):
+        inbox.put(('login', batch))
+    for _, _, outbox in replicas:
+        tokens += outbox.get()
+
+    # Page requests in random order, each to a random replica
+    requests = [[] for _ in replicas]
+    for user, token in rng.sample(tokens * args.requests, len(tokens) * args.requests):
+        requests[rng.randrange(len(replicas))].append((user, token))
+
+    started = time.perf_counter()
+    for (_, inbox, _), batch in zip(replicas, requests):
+        inbox.put(('resume', batch))
+    results = [outbox.get() for _, _, outbox in replicas]
+    seconds = time.perf_counter() - started
+
+    for process, inbox, _ in replicas:
+        inbox.put(('stop', None))
+        process.join()
+
+    counts = [len(batch) for batch in requests]
+    resumed = sum(r[0] for r in results)
+    latencies = sorted(latency for r in results for latency in r[1])
+    spread = (max(counts) - min(counts)) / statistics.mean(counts)
+    print(f"{store:>9} {sum(counts) / seconds:>8.0f} {resumed / sum(counts):>8.1%} "
+          f"{statistics.median(latencies):>7.2f} {latencies[int(len(latencies) * 0.95)]:>7.2f} {spread:>7.1%}   "
+          f"{' '.join(str(count) for count in counts)}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark session resumption across app replicas")
+    parser.add_argument("--replicas", type=int, default=4, help="Replica processes")
+    parser.add_argument("--users", type=int, default=200, help="Logged-in users")
+    parser.add_argument("--requests", type=int, default=20, help="Page requests per user")
+    args = parser.parse_args(argv)
+
+    print(f"{args.replicas} replicas, {args.users} users x {args.requests} page requests, random routing")
+    print(f"{'store':>9} {'req/s':>8} {'resumed':>8} {'p50 ms':>7} {'p95 ms':>7} {'spread':>7}   requests per replica")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "bench.db")
+        database.DB_PATH = db_path
+        database.init_database()
+        run("database", db_path, args)
+        run("memory", db_path, args)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Write throughput with concurrent writers against the shard count.
+
+Each writer process saves uploads and their analyses for random users (two
+write transactions per iteration) through the normal database functions.
+With one file every commit takes the same SQLite write lock; with shards,
+writers for users on different shards commit in parallel. Failed writes are
+transactions that gave up waiting for the lock.
+
+Usage:
+    python benchmarks/bench_shards.py [--shards 1 2 4 8] [--writers 8] [--writes 200]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import database
+import reshard
+
+USERS = 200
+ANALYSIS = {'scan_type': 'Ultrasound', 'image_quality': 'Good', 'risk_level': 'low', 'confidence_score': 82,
+            'key_findings': ['Both kidneys appear normal in size and shape'],
+            'recommendations': ['Maintain adequate hydration']}
+
+def _init_writer(db_path):
+    database.DB_PATH = db_path
+
+def _write(args):
+    seed, writes = args
+    rng = random.Random(seed)
+    failed = 0
+    for i in range(writes):
+        user = f"user{rng.randrange(USERS)}@example.com"
+        upload_id = database.save_upload(user, f"scan_{seed}_{i}.jpg", f"uploads/scan_{seed}_{i}.jpg", "image")
+        if not upload_id or not database.save_ai_analysis(upload_id, user, ANALYSIS):
+            failed += 1
+    return failed
+
+def run(shard_count, writers, writes, tmp_dir):
+    db_path = os.path.join(tmp_dir, f"bench_{shard_count}.db")
+    database.DB_PATH = db_path
+    database.init_database()
+    for i in range(USERS):
+        database.create_user(f"user{i}@example.com", "bench-password", "Bench User")
+    if shard_count > 1:
+        reshard.reshard(shard_count)
+
+    started = time.perf_counter()
+    with Pool(writers, initializer=_init_writer, initargs=(db_path,)) as pool:
+        failed = sum(pool.map(_write, [(seed, writes) for seed in range(writers)]))
+    return time.perf_counter() - started, failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark concurrent writes against the shard count")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--writers", type=int, default=8, help="Writer processes")
+    parser.add_argument("--writes", type=int, default=200, help="Uploads (with analysis) per writer")
+    args = parser.parse_args(argv)
+
+    print(f"{args.writers} writers x {args.writes} uploads with analysis, {USERS} users, {os.cpu_count()} CPU(s)")
+    print(f"{'shards':>6} {'seconds':>8} {'tx/s':>8} {'failed':>7}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for shard_count in args.shards:
+            seconds, failed = run(shard_count, args.writers, args.writes, tmp_dir)
+            transactions = 2 * args.writers * args.writes
+            print(f"{shard_count:>6} {seconds:>8.2f} {transactions / seconds:>8.0f} {failed:>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Dashboard reads during heavy ingestion, with and without analytics snapshots.
+
+Writer processes save uploads with their analyses as fast as they can while
+reader processes load users' full analysis history (the Health Tracking /
+AI Insights query, uncached). Each mode runs for a fixed time on the same
+database; reads go either to the live file or to a snapshot refreshed in
+the background. Failed writes are transactions that gave up waiting for the
+lock.
+
+Usage:
+    python benchmarks/bench_snapshot.py [--seconds 5] [--writers 4] [--readers 4] [--max-age 5]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import database
+import snapshot
+
+USERS = 200
+HISTORY = 20
+ANALYSIS = {'scan_type': 'Ultrasound', 'image_quality': 'Good', 'risk_level': 'low', 'confidence_score': 82,
+            'key_findings': ['Both kidneys appear normal in size and shape'],
+            'recommendations': ['Maintain adequate hydration']}
+
+def _init_worker(db_path, max_age):
+    database.DB_PATH = db_path
+    snapshot.MAX_AGE_SECONDS = max_age
+
+def _write(args):
+    seed, seconds = args
+    rng = random.Random(seed)
+    done = failed = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        user = f"user{rng.randrange(USERS)}@example.com"
+        upload_id = database.save_upload(user, f"scan_{seed}.jpg", f"uploads/scan_{seed}.jpg", "image")
+        if upload_id and database.save_ai_analysis(upload_id, user, ANALYSIS):
+            done += 1
+        else:
+            failed += 1
+    return 'write', done, failed
+
+def _read(args):
+    seed, seconds = args
+    rng = random.Random(seed)
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        # Uncached, like the first dashboard view of each session
+        database.get_all_user_analyses.__wrapped__(f"user{rng.randrange(USERS)}@example.com")
+        latencies.append((time.perf_counter() - started) * 1000)
+    return 'read', latencies, snapshot.get_snapshot_stats()['snapshot_reads']
+
+def seed_database(db_path):
+    database.DB_PATH = db_path
+    database.init_database()
+    for i in range(USERS):
+        database.create_user(f"user{i}@example.com", "bench-password", "Bench User")
+    conn = database.get_connection()
+    for i in range(USERS):
+        user = f"user{i}@example.com"
+        for j in range(HISTORY):
+            upload_id = conn.execute('''
+                INSERT INTO uploads (user_email, filename, file_path, file_type) VALUES (?, ?, ?, 'image')
+            ''', (user, f"seed_{j}.jpg", f"uploads/seed_{j}.jpg")).lastrowid
+            database._insert_ai_analysis(conn.cursor(), upload_id, user, ANALYSIS)
+    conn.commit()
+    conn.close()
+
+def run(label, db_path, max_age, args):
+    _init_worker(db_path, max_age)
+    if max_age > 0:
+        snapshot.refresh(db_path)
+        snapshot.start_background_refresh()
+
+    jobs = [(_write, (seed, args.seconds)) for seed in range(args.writers)]
+    jobs += [(_read, (seed, args.seconds)) for seed in range(args.readers)]
+    with Pool(len(jobs), initializer=_init_worker, initargs=(db_path, max_age)) as pool:
+        results = [pool.apply_async(func, (job_args,)) for func, job_args in jobs]
+        results = [result.get() for result in results]
+
+    writes = sum(r[1] for r in results if r[0] == 'write')
+    failed = sum(r[2] for r in results if r[0] == 'write')
+    latencies = sorted(latency for r in results if r[0] == 'read' for latency in r[1])
+    from_snapshot = sum(r[2] for r in results if r[0] == 'read')
+    p95 = latencies[int(len(latencies) * 0.95)]
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f"{label:>9} {len(latencies) / args.seconds:>8.0f} {statistics.median(latencies):>7.1f} {p95:>7.1f} "
+          f"{p99:>7.1f} {from_snapshot / len(latencies):>9.0%} {writes / args.seconds:>9.0f} {failed:>7}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark dashboard reads from snapshots during ingestion")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--writers", type=int, default=4, help="Writer processes")
+    parser.add_argument("--readers", type=int, default=4, help="Dashboard reader processes")
+    parser.add_argument("--max-age", type=float, default=5, help="Snapshot staleness bound in seconds")
+    args = parser.parse_args(argv)
+
+    print(f"{args.writers} writers, {args.readers} readers, {args.seconds:.0f}s per mode, {USERS} users "
+          f"with {HISTORY}+ analyses, {os.cpu_count()} CPU(s)")
+    print(f"{'reads':>9} {'reads/s':>8} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'snapshot':>9} "
+          f"{'writes/s':>9} {'failed':>7}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "bench.db")
+        seed_database(db_path)
+        run("live", db_path, 0, args)
+        run("snapshot", db_path, args.max_age, args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+SQLite vs PostgreSQL storage backends.
+
+Runs the same workload through the normal database functions on a temporary
+SQLite file and, when a PostgreSQL URL is given, in a throwaway schema of
+that database (dropped afterwards):
+
+- concurrent writers saving uploads with their analyses (two transactions
+  per iteration), as separate processes like separate app nodes
+- a batched insert of AI call records (executemany)
+- streaming one user's long analysis history, with time to the first row
+  and peak Python memory
+
+The streamed histories from both backends are compared, so the run also
+checks that PostgreSQL returns what SQLite does.
+
+Usage:
+    python benchmarks/bench_sql_backend.py [--url postgresql://...] [--writers 4] [--writes 200] [--history 5000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from multiprocessing import Pool
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import database
+
+USERS = 50
+HISTORY_USER = "history@example.com"
+ANALYSIS = {'scan_type': 'Ultrasound', 'image_quality': 'Good', 'risk_level': 'low', 'confidence_score': 82,
+            'key_findings': ['Both kidneys appear normal in size and shape'],
+            'recommendations': ['Maintain adequate hydration']}
+
+def _use(db_path, url):
+    database.DB_PATH = db_path
+    database.DATABASE_URL = url
+
+def _write(args):
+    seed, writes = args
+    rng = random.Random(seed)
+    failed = 0
+    for i in range(writes):
+        user = f"user{rng.randrange(USERS)}@example.com"
+        upload_id = database.save_upload(user, f"scan_{seed}_{i}.jpg", f"uploads/scan_{seed}_{i}.jpg", "image")
+        if not upload_id or not database.save_ai_analysis(upload_id, user, ANALYSIS):
+            failed += 1
+    return failed
+
+def _seed_history(rows):
+    conn = database.get_user_connection(HISTORY_USER)
+    conn.executemany('''
+        INSERT INTO uploads (id, user_email, filename, file_path, file_type, analysis_status)
+        VALUES (?, ?, ?, ?, 'image', 'completed')
+    ''', [(10_000_000 + i, HISTORY_USER, f"history_{i}.jpg", f"uploads/history_{i}.jpg") for i in range(rows)])
+    conn.executemany('''
+        INSERT INTO ai_analysis (upload_id, user_email, analysis_data, risk_level, confidence_score, is_latest,
+                                 analyzed_at)
+        VALUES (?, ?, ?, ?, ?, 1, ?)
+    ''', [(10_000_000 + i, HISTORY_USER, database.dump_json(dict(ANALYSIS, key_findings=[f"Finding {i}"])),
+           'low', 82, f"2025-01-01 {i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}") for i in range(rows)])
+    conn.commit()
+    conn.close()
+
+def run(label, db_path, url, args):
+    _use(db_path, url)
+    database.init_database()
+    for i in range(USERS):
+        database.create_user(f"user{i}@example.com", "bench-password", "Bench User")
+    database.create_user(HISTORY_USER, "bench-password", "Bench User")
+
+    started = time.perf_counter()
+    with Pool(args.writers, initializer=_use, initargs=(db_path, url)) as pool:
+        failed = sum(pool.map(_write, [(seed, args.writes) for seed in range(args.writers)]))
+    write_seconds = time.perf_counter() - started
+
+    rows = [("analyze_scan", "gpt-5-mini", 10, 5, 120, 0, "miss", "ok", None, "2025-01-01 00:00:00")] * 10_000
+    started = time.perf_counter()
+    conn = database.get_connection()
+    conn.executemany('''
+        INSERT INTO ai_calls (function, model, prompt_tokens, completion_tokens, latency_ms,
+                              retries, cache, outcome, error, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+    batch_seconds = time.perf_counter() - started
+
+    _seed_history(args.history)
+    tracemalloc.start()
+    started = time.perf_counter()
+    history = database.iter_user_analyses(HISTORY_USER)
+    first = next(history)
+    first_ms = (time.perf_counter() - started) * 1000
+    records = [first] + list(history)
+    stream_seconds = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    transactions = 2 * args.writers * args.writes
+    print(f"{label:>10} {transactions / write_seconds:>8.0f} {failed:>7} {len(rows) / batch_seconds:>11.0f} "
+          f"{first_ms:>9.1f} {len(records) / stream_seconds:>10.0f} {peak / 1024 / 1024:>8.1f}")
+    return [(record.upload_id, record.analysis_data, record.risk_level) for record in records]
+
+def _scratch_schema(url, schema, create):
+    import psycopg2
+
+    conn = psycopg2.connect(url)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA {schema}" if create else f"DROP SCHEMA {schema} CASCADE")
+    conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the SQLite and PostgreSQL storage backends")
+    parser.add_argument("--url", default=os.getenv("LIFELENS_DATABASE_URL"),
+                        help="PostgreSQL URL to compare against (default: LIFELENS_DATABASE_URL)")
+    parser.add_argument("--writers", type=int, default=4, help="Writer processes")
+    parser.add_argument("--writes", type=int, default=200, help="Uploads (with analysis) per writer")
+    parser.add_argument("--history", type=int, default=5000, help="Analyses in the streamed history")
+    args = parser.parse_args(argv)
+
+    print(f"{args.writers} writers x {args.writes} uploads with analysis, 10000-row batch insert, "
+          f"{args.history}-row history")
+    print(f"{'backend':>10} {'tx/s':>8} {'failed':>7} {'batch rows/s':>11} {'first ms':>9} "
+          f"{'history/s':>10} {'peak MB':>8}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sqlite_history = run("sqlite", os.path.join(tmp_dir, "bench.db"), None, args)
+
+    if not args.url:
+        print("Pass --url (or set LIFELENS_DATABASE_URL) to compare with PostgreSQL")
+        return 0
+
+    schema = f"lifelens_bench_{os.getpid()}"
+    _scratch_schema(args.url, schema, create=True)
+    try:
+        separator = "&" if "?" in args.url else "?"
+        url = f"{args.url}{separator}options=-csearch_path%3D{schema}"
+        pg_history = run("postgresql", None, url, args)
+    finally:
+        _scratch_schema(args.url, schema, create=False)
+
+    if sorted(map(repr, pg_history)) == sorted(map(repr, sqlite_history)):
+        print("Streamed histories match")
+        return 0
+    print("Streamed histories differ between backends")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
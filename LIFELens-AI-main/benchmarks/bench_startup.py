@@ -0,0 +1,123 @@
+"""
+Import-time profile of app startup.
+
+Cold start: each scenario runs in a fresh interpreter with `-X importtime`.
+Warm rerun: a Streamlit rerun re-executes app.py in the same process, so
+page modules come from sys.modules and init_database() is already guarded.
+
+Usage:
+    python benchmarks/bench_startup.py [--top 10]
+"""
+import argparse
+import importlib
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+PAGE_MODULES = [
+    "pages.home",
+    "pages.demographics",
+    "pages.upload_analyze",
+    "pages.ai_insights",
+    "pages.health_tracking",
+    "pages.diet_chart",
+    "pages.reports",
+]
+
+# What app.py imports before the login screen is drawn
+LOGIN_MODULES = ["streamlit", "database", "auth"]
+
+SCENARIOS = [
+    ("login screen (lazy pages)", LOGIN_MODULES),
+    *[(f"first visit: {name}", LOGIN_MODULES + [name]) for name in PAGE_MODULES],
+    ("eager (all pages at startup)", LOGIN_MODULES + PAGE_MODULES),
+]
+
+def profile_imports(modules):
+    """Import modules in a fresh interpreter; return (total_us, [(cumulative_us, name)])"""
+    code = "; ".join(f"import {name}" for name in modules)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=PROJECT_ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    entries = []
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative_us, raw_name = line[len("import time:"):].split("|")
+        # Top-level imports have a single space of nesting; their cumulative times add up to the total
+        if not raw_name.startswith("  "):
+            total += int(cumulative_us)
+        entries.append((int(cumulative_us), raw_name.strip()))
+
+    entries.sort(reverse=True)
+    return total, entries
+
+def time_warm_rerun(iterations=200):
+    """Time the per-rerun cost of page loading and schema initialization"""
+    import database
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_PATH = os.path.join(tmp_dir, "bench.db")
+
+        for name in PAGE_MODULES:
+            importlib.import_module(name)
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            for name in PAGE_MODULES:
+                importlib.import_module(name)
+        page_us = (time.perf_counter() - started) / iterations * 1e6
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            database.init_database(force=True)
+        schema_unguarded_us = (time.perf_counter() - started) / iterations * 1e6
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            database.init_database()
+        schema_guarded_us = (time.perf_counter() - started) / iterations * 1e6
+
+    return page_us, schema_unguarded_us, schema_guarded_us
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile app import time")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list per scenario")
+    args = parser.parse_args(argv)
+
+    print("Cold start (fresh interpreter)")
+    print(f"{'scenario':<36} {'total ms':>10}")
+    slowest = {}
+    for label, modules in SCENARIOS:
+        try:
+            total, entries = profile_imports(modules)
+        except RuntimeError as e:
+            print(f"{label:<36} {'failed':>10}  ({e})")
+            continue
+        print(f"{label:<36} {total / 1000:>10.1f}")
+        slowest[label] = entries[:args.top]
+
+    for label in ("login screen (lazy pages)", "eager (all pages at startup)"):
+        if label in slowest:
+            print(f"\nSlowest imports, {label}:")
+            for cumulative_us, name in slowest[label]:
+                print(f"  {cumulative_us / 1000:>8.1f} ms  {name}")
+
+    page_us, schema_unguarded_us, schema_guarded_us = time_warm_rerun()
+    print("\nWarm rerun (same process)")
+    print(f"  page module lookups:          {page_us:>8.1f} us")
+    print(f"  init_database() every rerun:  {schema_unguarded_us:>8.1f} us")
+    print(f"  init_database() guarded:      {schema_guarded_us:>8.1f} us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Database size and read latency for compressed column storage.
+
+Seeds analyses and full-text reports in the plain format, then trains
+dictionaries and recompresses them, measuring both formats.
+
+sqlite3 in the standard library doesn't expose SQLite's page-cache
+counters, so cache behaviour is reported as the page count and the share of
+the database that fits in SQLite's default 2 MB page cache.
+
+Usage:
+    python benchmarks/bench_storage_codec.py [--analyses 5000] [--users 50]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import database
+import report_templates
+import storage_codec
+
+PAGE_CACHE_BYTES = 2 * 1024 * 1024
+
+FINDINGS = [
+    "Both kidneys appear normal in size and shape",
+    "Corticomedullary differentiation is preserved",
+    "No evidence of hydronephrosis",
+    "Small simple cyst noted in the upper pole of the left kidney",
+    "Mild increase in cortical echogenicity",
+    "No calculi identified",
+    "Renal outline is smooth and regular",
+]
+CONCERNS = [
+    "Possible early changes of chronic kidney disease",
+    "Cyst should be monitored on follow-up imaging",
+    "Image resolution limits assessment of small lesions",
+]
+RECOMMENDATIONS = [
+    "Follow up with a nephrologist for confirmation",
+    "Repeat ultrasound in 6-12 months",
+    "Check serum creatinine and eGFR",
+    "Maintain adequate hydration",
+]
+
+def sample_analysis(rng):
+    return {
+        'scan_type': rng.choice(["ultrasound", "CT", "X-ray"]),
+        'image_quality': rng.choice(["excellent", "good", "fair"]),
+        'key_findings': rng.sample(FINDINGS, 3),
+        'potential_concerns': rng.sample(CONCERNS, rng.randint(0, 2)),
+        'kidney_indicators': {
+            'size': f"Right {rng.uniform(9, 12):.1f} cm, left {rng.uniform(9, 12):.1f} cm",
+            'structure': "Normal corticomedullary differentiation",
+            'abnormalities': rng.choice(["None detected", "Simple cyst, left upper pole"])
+        },
+        'recommendations': rng.sample(RECOMMENDATIONS, 2),
+        'risk_level': rng.choice(["low", "moderate", "high"]),
+        'confidence_score': rng.randint(60, 95),
+        'disclaimer': "This AI analysis is for educational purposes only and must be reviewed by a qualified medical professional."
+    }
+
+def seed(total, users):
+    """Insert analyses and full-text reports in the plain format"""
+    rng = random.Random(42)
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    for i in range(total):
+        user = f"user{i % users}@example.com"
+        cursor.execute(
+            "INSERT INTO uploads (user_email, filename, file_path, file_type) VALUES (?, ?, ?, ?)",
+            (user, f"scan_{i}.png", f"uploads/scan_{i}.png", "image")
+        )
+        upload_id = cursor.lastrowid
+        analysis = sample_analysis(rng)
+        cursor.execute(
+            "INSERT INTO ai_analysis (upload_id, user_email, analysis_data, risk_level, confidence_score) VALUES (?, ?, ?, ?, ?)",
+            (upload_id, user, json.dumps(analysis), analysis['risk_level'], analysis['confidence_score'])
+        )
+        params = report_templates.build_upload_report_params(
+            {'age': 30 + i % 40, 'gender': 'Male', 'weight': 70.0, 'height': 175.0, 'daily_water_intake': 8},
+            {'filename': f"scan_{i}.png", 'file_type': 'image', 'upload_date': 'Just now'}
+        )
+        cursor.execute(
+            "INSERT INTO reports (user_email, upload_id, report_type, report_content) VALUES (?, ?, ?, ?)",
+            (user, upload_id, "Upload Report", report_templates._render_upload_report(params))
+        )
+    conn.commit()
+    conn.close()
+
+def measure(user, repeat):
+    report_templates.vacuum_database()
+    conn = database.get_connection()
+    page_count, page_size = conn.execute("PRAGMA page_count").fetchone()[0], conn.execute("PRAGMA page_size").fetchone()[0]
+    conn.close()
+
+    def read_user():
+        database.get_all_user_analyses.__wrapped__(user)
+        database.get_user_reports.__wrapped__(user)
+
+    read_user()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        read_user()
+        samples.append((time.perf_counter() - started) * 1000)
+
+    size = page_count * page_size
+    return {
+        'size_kb': size / 1024,
+        'pages': page_count,
+        'cache_fit': min(1.0, PAGE_CACHE_BYTES / size),
+        'read_ms': statistics.median(samples)
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark compressed column storage")
+    parser.add_argument("--analyses", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    user = "user0@example.com"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_PATH = os.path.join(tmp_dir, "bench.db")
+        database.init_database()
+        seed(args.analyses, args.users)
+
+        plain = measure(user, args.repeat)
+        storage_codec.train_dictionaries(database.DB_PATH)
+        storage_codec.recompress(database.DB_PATH)
+        compressed = measure(user, args.repeat)
+
+        codec = storage_codec.CODEC_NAMES[storage_codec._codec_id()]
+        print(f"Rows: {args.analyses} analyses + {args.analyses} reports, codec {codec} with dictionary")
+        print(f"{'format':>12} {'size KB':>10} {'pages':>8} {'fits cache':>11} {'read ms':>8}")
+        for name, result in (("plain", plain), ("compressed", compressed)):
+            print(f"{name:>12} {result['size_kb']:>10.1f} {result['pages']:>8} "
+                  f"{result['cache_fit']:>10.0%} {result['read_ms']:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Study analysis (one request for all views) against per-image calls.
+
+Without --live, estimates input tokens per mode from the built messages:
+prompt text at ~4 characters per token and images with OpenAI's high-detail
+tile formula, plus output tokens from sample analyses. With --live (needs
+OPENAI_API_KEY) both modes run against the API on synthetic scans and report
+measured latency and token usage.
+
+Usage:
+    python benchmarks/bench_study_analysis.py [--views 2 4 8] [--width 1920 --height 1080]
+    python benchmarks/bench_study_analysis.py --live --views 4
+"""
+import argparse
+import base64
+import io
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from PIL import Image
+
+import database
+import model_cascade
+import ai_analyzer
+from bench_image_quality import synthetic_scan
+from bench_storage_codec import sample_analysis
+
+USER = "bench@example.com"
+DEMOGRAPHICS = {'age': 52, 'gender': 'Female', 'weight': 70, 'height': 165,
+                'medical_history': 'Hypertension, family history of kidney stones'}
+
+def image_tokens(base64_image):
+    """High-detail image cost: fit in 2048x2048, shortest side to 768, 170 per 512px tile plus 85"""
+    with Image.open(io.BytesIO(base64.b64decode(base64_image))) as img:
+        width, height = img.size
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+def message_tokens(messages):
+    text = 0
+    images = 0
+    for part in messages[0]['content']:
+        if part['type'] == 'text':
+            text += len(part['text'])
+        else:
+            images += image_tokens(part['image_url']['url'].split(',', 1)[1])
+    return text // 4, images
+
+def output_tokens(views, rng):
+    per_image = [sample_analysis(rng) for _ in range(views)]
+    separate = sum(len(json.dumps(analysis)) for analysis in per_image) // 4
+    combined = len(json.dumps({'images': [dict(analysis, image=i + 1, disclaimer=None)
+                                          for i, analysis in enumerate(per_image)],
+                               'combined': sample_analysis(rng)})) // 4
+    return separate, combined
+
+def write_scans(tmp_dir, views, width, height):
+    paths = []
+    for i in range(views):
+        path = os.path.join(tmp_dir, f"view_{i}.jpg")
+        synthetic_scan(width, height, seed=i).save(path, "JPEG", quality=90)
+        paths.append(path)
+    return paths
+
+def estimate(paths):
+    separate_text = separate_images = 0
+    for path in paths:
+        text, images = message_tokens(ai_analyzer.build_scan_messages(ai_analyzer.encode_scan_images(path),
+                                                                      DEMOGRAPHICS))
+        separate_text += text
+        separate_images += images
+
+    views = [(os.path.basename(path), ai_analyzer.encode_scan_images(path, ai_analyzer.STUDY_IMAGE_SIZE))
+             for path in paths]
+    study_text, study_images = message_tokens(ai_analyzer.build_study_messages(views, DEMOGRAPHICS))
+    separate_out, study_out = output_tokens(len(paths), random.Random(len(paths)))
+    return (separate_text, separate_images, separate_out), (study_text, study_images, study_out)
+
+def run_live(paths):
+    database.init_database()
+    upload_ids = [database.save_upload(USER, os.path.basename(path), path, "image") for path in paths]
+
+    model_cascade.reset_cascade_stats()
+    started = time.perf_counter()
+    for path in paths:
+        ai_analyzer.analyze_kidney_scan(path, DEMOGRAPHICS)
+    separate_seconds = time.perf_counter() - started
+
+    study_id = database.create_study(USER, "bench", upload_ids)
+    started = time.perf_counter()
+    outcome = ai_analyzer.analyze_study(study_id, USER, DEMOGRAPHICS)
+    study_seconds = time.perf_counter() - started
+    if outcome['error']:
+        print(f"Study analysis failed: {outcome['error']}")
+
+    stats = model_cascade.get_cascade_stats()
+    totals = {}
+    for task in ('scan_analysis', 'study_analysis'):
+        tiers = stats.get(task, {}).values()
+        totals[task] = (sum(tier['prompt_tokens'] for tier in tiers), sum(tier['completion_tokens'] for tier in tiers))
+    return (separate_seconds, *totals['scan_analysis']), (study_seconds, *totals['study_analysis'])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark study analysis against per-image calls")
+    parser.add_argument("--views", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--live", action="store_true", help="Call the API and measure")
+    args = parser.parse_args(argv)
+
+    if args.live and not os.environ.get("OPENAI_API_KEY"):
+        print("OPENAI_API_KEY is not set")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_PATH = os.path.join(tmp_dir, "bench.db")
+        print(f"Scans: {args.width}x{args.height} JPEG, study images at most {ai_analyzer.STUDY_IMAGE_SIZE}px")
+
+        if args.live:
+            print(f"{'views':>5} {'mode':<10} {'seconds':>8} {'prompt tok':>11} {'output tok':>11}")
+        else:
+            print(f"{'views':>5} {'mode':<10} {'requests':>8} {'text tok':>9} {'image tok':>10} {'output tok':>11} {'total':>8}")
+
+        for views in args.views:
+            paths = write_scans(tmp_dir, views, args.width, args.height)
+            if args.live:
+                separate, study = run_live(paths)
+                for mode, row in (("per-image", separate), ("study", study)):
+                    print(f"{views:>5} {mode:<10} {row[0]:>8.1f} {row[1]:>11} {row[2]:>11}")
+            else:
+                separate, study = estimate(paths)
+                for mode, requests, row in (("per-image", views, separate), ("study", 1, study)):
+                    print(f"{views:>5} {mode:<10} {requests:>8} {row[0]:>9} {row[1]:>10} {row[2]:>11} {sum(row):>8}")
+
+if __name__ == "__main__":
+    main()
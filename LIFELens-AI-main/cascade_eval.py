@@ -0,0 +1,149 @@
+"""
+Offline evaluation of the model cascade against stored analyses.
+
+Replays stored scans through the fast tier and compares its output with the
+stored result, which came from the large model (or from the single-model
+pipeline for rows saved before the cascade existed). Reports risk-level
+agreement, confidence drift, the escalation rate the cascade would see, and
+per-tier latency and token counts.
+
+--policy-only makes no API calls. It applies the escalation rules to the
+stored results and runs the local risk rule engine over stored demographics.
+
+Usage:
+    python cascade_eval.py [--limit 50] [--db lifelens_ai.db]
+    python cascade_eval.py --policy-only
+"""
+import argparse
+import os
+import sys
+from collections import Counter
+from itertools import islice
+
+import database
+import model_cascade
+
+def iter_stored_analyses(limit=None):
+    """Stored analyses with the producing model and user, newest first"""
+    query = '''
+        SELECT a.id, a.upload_id, a.analysis_data, a.risk_level, a.confidence_score, a.analyzed_at,
+               u.filename, u.file_path, a.model, a.user_email
+        FROM ai_analysis a
+        JOIN uploads u ON a.upload_id = u.id
+        ORDER BY a.id DESC
+    '''
+    params = ()
+    if limit:
+        query += " LIMIT ?"
+        params = (limit,)
+
+    # With shards, each shard's newest rows come in turn
+    for row in islice(database._iter_shard_rows(query, params), limit):
+        record = database._analysis_record(row[:8])
+        if record is None:
+            continue
+        yield record, row[8] or model_cascade.LARGE_MODEL, row[9]
+
+def evaluate_policy(limit=None):
+    """Escalation decisions the cascade would make on stored results, without API calls"""
+    reasons = Counter()
+    total = 0
+    for record, _, _ in iter_stored_analyses(limit):
+        total += 1
+        reason = model_cascade.check_risk_result({'risk_level': record.risk_level}, record.confidence_score)
+        reasons[reason.split(' (')[0] if reason else "accepted"] += 1
+
+    from risk_rules import assess_risk_with_rules
+
+    rules = Counter()
+    for row in database._iter_shard_rows('''
+        SELECT age, gender, weight, height, daily_water_intake, medical_history FROM demographics
+    '''):
+        demographics = dict(zip(('age', 'gender', 'weight', 'height', 'daily_water_intake', 'medical_history'), row))
+        assessment = assess_risk_with_rules(demographics)
+        reason = model_cascade.check_risk_result(assessment, assessment['confidence'])
+        rules[reason.split(' (')[0] if reason else "accepted"] += 1
+
+    return {'scan_total': total, 'scan_outcomes': reasons, 'risk_total': sum(rules.values()), 'risk_outcomes': rules}
+
+def replay_fast_tier(limit, demographics_cache=None):
+    """Re-run stored scans on the fast model and compare with the stored results"""
+    from ai_analyzer import analyze_kidney_scan
+
+    demographics_cache = {} if demographics_cache is None else demographics_cache
+    results = {'replayed': 0, 'failed': 0, 'missing_file': 0, 'risk_agree': 0, 'would_escalate': 0,
+               'confidence_delta': 0, 'confusion': Counter()}
+
+    model_cascade.reset_cascade_stats()
+    for record, stored_model, user_email in iter_stored_analyses(limit):
+        # Only large-model results are a reference for the fast tier
+        if stored_model != model_cascade.LARGE_MODEL:
+            continue
+        if not record.file_path or not os.path.exists(record.file_path):
+            results['missing_file'] += 1
+            continue
+
+        if user_email not in demographics_cache:
+            demographics_cache[user_email] = database.get_user_demographics.__wrapped__(user_email)
+
+        outcome = analyze_kidney_scan(record.file_path, demographics_cache[user_email],
+                                      models=[model_cascade.FAST_MODEL])
+        if not outcome['success']:
+            results['failed'] += 1
+            continue
+
+        fast = outcome['analysis']
+        results['replayed'] += 1
+        results['confusion'][(record.risk_level, fast.risk_level)] += 1
+        if fast.risk_level == record.risk_level:
+            results['risk_agree'] += 1
+        results['confidence_delta'] += abs((fast.confidence_score or 0) - record.confidence_score)
+        if model_cascade.check_risk_result({'risk_level': fast.risk_level}, fast.confidence_score):
+            results['would_escalate'] += 1
+
+    results['tiers'] = model_cascade.get_cascade_stats().get('scan_analysis', {})
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate the model cascade on stored analyses")
+    parser.add_argument("--limit", type=int, default=50, help="Number of stored analyses to replay")
+    parser.add_argument("--policy-only", action="store_true", help="Apply escalation rules only, no API calls")
+    parser.add_argument("--db", default=database.DB_PATH, help="Path to the database file")
+    args = parser.parse_args(argv)
+
+    database.DB_PATH = args.db
+    database.init_database()
+
+    print(f"Fast tier: {model_cascade.FAST_MODEL}  Large tier: {model_cascade.LARGE_MODEL}  "
+          f"Escalation confidence: {model_cascade.ESCALATION_CONFIDENCE}")
+
+    if args.policy_only:
+        policy = evaluate_policy(args.limit)
+        for label, total, outcomes in (("Scan analyses", policy['scan_total'], policy['scan_outcomes']),
+                                       ("Risk assessments (rules)", policy['risk_total'], policy['risk_outcomes'])):
+            print(f"{label}: {total}")
+            for outcome, count in outcomes.most_common():
+                print(f"  {outcome}: {count} ({count / total:.0%})")
+        return 0
+
+    if not os.environ.get("OPENAI_API_KEY"):
+        print("OPENAI_API_KEY is not set; use --policy-only to evaluate without API calls")
+        return 1
+
+    results = replay_fast_tier(args.limit)
+    replayed = results['replayed']
+    print(f"Replayed: {replayed}  Failed: {results['failed']}  Missing scan files: {results['missing_file']}")
+    if replayed:
+        print(f"Risk level agreement: {results['risk_agree'] / replayed:.0%}")
+        print(f"Mean confidence difference: {results['confidence_delta'] / replayed:.1f} points")
+        print(f"Would escalate: {results['would_escalate'] / replayed:.0%}")
+        print("Stored -> fast risk level:")
+        for (stored, fast), count in sorted(results['confusion'].items(), key=lambda item: str(item[0])):
+            print(f"  {stored} -> {fast}: {count}")
+    for tier, stats in results['tiers'].items():
+        print(f"{tier}: {stats['calls']} calls, {stats['mean_latency_ms']:.0f} ms mean, "
+              f"{stats['prompt_tokens']} prompt / {stats['completion_tokens']} completion tokens")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
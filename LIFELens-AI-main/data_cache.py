@@ -0,0 +1,128 @@
+import os
+import time
+import threading
+import functools
+import itertools
+from collections import OrderedDict
+
+# Entries are shared by every session in this server process. Writes go
+# through invalidate_user(); the TTL bounds staleness from other processes.
+CACHE_TTL_SECONDS = float(os.getenv("LIFELENS_DATA_CACHE_TTL", "300"))
+# Users with cached entries; the least recently used are evicted beyond this
+MAX_USERS = int(os.getenv("LIFELENS_DATA_CACHE_USERS", "1000"))
+
+_lock = threading.Lock()
+# user_email -> {key: (expires_at, value)}, least recently used first
+_entries = OrderedDict()
+# user_email -> sequence number of the user's last invalidation, oldest first.
+# Users missing from it count as _floor: the newest number ever forgotten,
+# so forgetting a user still fails any read that was in flight
+_generations = {}
+_floor = 0
+_sequence = itertools.count(1)
+# Set by skip_cache() during the read running on this thread
+_local = threading.local()
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+
+def _generation(user_email):
+    return _generations.get(user_email, _floor)
+
+def _store(user_email, key, expires_at, value, now):
+    entries = _entries.get(user_email)
+    if entries is None:
+        entries = _entries[user_email] = {}
+        while len(_entries) > MAX_USERS:
+            _entries.popitem(last=False)
+            _stats['evictions'] += 1
+    else:
+        _entries.move_to_end(user_email)
+        # Expired entries of this user go before a new one is added
+        for stale in [stale for stale, entry in entries.items() if entry[0] <= now]:
+            del entries[stale]
+    entries[key] = (expires_at, value)
+
+def _forget_old_generations():
+    global _floor
+
+    # Enough are kept to cover every cached user plus as many recent writers
+    while len(_generations) > 2 * MAX_USERS:
+        user_email = next(iter(_generations))
+        _floor = max(_floor, _generations.pop(user_email))
+
+def user_cached(func):
+    """
+    Cache a per-user database read whose first argument is the user's email
+    Cached values are shared between sessions and must be treated as read-only
+    """
+    @functools.wraps(func)
+    def wrapper(user_email, *args, **kwargs):
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+
+        with _lock:
+            entries = _entries.get(user_email)
+            entry = entries.get(key) if entries else None
+            if entry and entry[0] > now:
+                _stats['hits'] += 1
+                _entries.move_to_end(user_email)
+                return entry[1]
+            _stats['misses'] += 1
+            generation = _generation(user_email)
+
+        outer_skip = getattr(_local, 'skip', False)
+        _local.skip = False
+        try:
+            value = func(user_email, *args, **kwargs)
+            skipped = _local.skip
+        finally:
+            _local.skip = outer_skip
+
+        with _lock:
+            # Skip storing if the read failed or the user's data changed meanwhile
+            if not skipped and _generation(user_email) == generation:
+                _store(user_email, key, now + CACHE_TTL_SECONDS, value, now)
+
+        return value
+
+    return wrapper
+
+def skip_cache():
+    """
+    Keep the result of the current user_cached read out of the cache.
+    Readers call this on their error path, so the empty value they return
+    for a failed read isn't served until the TTL runs out
+    """
+    _local.skip = True
+
+def invalidate_user(user_email):
+    """Drop all cached entries for a user"""
+    with _lock:
+        _entries.pop(user_email, None)
+        # Re-inserted, so the dict stays ordered oldest write first
+        _generations.pop(user_email, None)
+        _generations[user_email] = next(_sequence)
+        _forget_old_generations()
+        _stats['invalidations'] += 1
+
+def clear_cache():
+    """Drop all cached entries for every user"""
+    global _floor
+
+    with _lock:
+        # Every read in flight started before this number
+        _floor = next(_sequence)
+        _generations.clear()
+        _entries.clear()
+        _stats['invalidations'] += 1
+
+def get_cache_stats(user_email=None):
+    """Get hit/miss metrics, plus the entry count for one user if given"""
+    with _lock:
+        stats = dict(_stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['users'] = len(_entries)
+        stats['entries'] = sum(len(entries) for entries in _entries.values())
+        if user_email is not None:
+            stats['user_entries'] = len(_entries.get(user_email, {}))
+        return stats
@@ -0,0 +1,271 @@
+"""
+On-demand data export in CSV, NDJSON and Parquet.
+
+Rows are streamed from the database and written incrementally, so memory
+stays bounded regardless of history size. Large exports run as background
+jobs that write to EXPORT_DIR.
+"""
+import csv
+import importlib.util
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+import database
+
+EXPORT_DIR = os.getenv("LIFELENS_EXPORT_DIR", "exports")
+# Exports with more rows than this run in the background
+BACKGROUND_EXPORT_ROWS = int(os.getenv("LIFELENS_EXPORT_BACKGROUND_ROWS", "5000"))
+EXPORT_MAX_AGE_SECONDS = 24 * 60 * 60
+PARQUET_BATCH_ROWS = 1000
+
+EXPORT_FORMATS = {
+    'csv': {'label': 'CSV', 'extension': 'csv', 'mime': 'text/csv'},
+    'ndjson': {'label': 'NDJSON', 'extension': 'ndjson', 'mime': 'application/x-ndjson'},
+    'parquet': {'label': 'Parquet', 'extension': 'parquet', 'mime': 'application/vnd.apache.parquet'},
+}
+
+def parquet_supported():
+    """True when pyarrow, which Parquet export needs (the 'parquet' extra), is installed"""
+    return importlib.util.find_spec("pyarrow") is not None
+
+def available_formats():
+    """Export formats this installation can write"""
+    return [fmt for fmt in EXPORT_FORMATS if fmt != 'parquet' or parquet_supported()]
+
+def _analysis_row(analysis):
+    analysis_data = analysis.analysis_data
+    return {
+        'Date': analysis.analyzed_at[:19],
+        'Filename': analysis.filename or 'Unknown',
+        'Risk Level': analysis.risk_level,
+        'Confidence': analysis.confidence_score,
+        'Scan Type': analysis_data.scan_type,
+        'Image Quality': analysis_data.image_quality,
+        'Key Findings': '; '.join(analysis_data.key_findings),
+        'Concerns': '; '.join(analysis_data.potential_concerns)
+    }
+
+def _upload_row(upload):
+    return {
+        'Upload ID': upload['id'],
+        'Filename': upload['filename'],
+        'Type': upload['file_type'],
+        'Date': upload['upload_date'],
+        'Status': upload['analysis_status']
+    }
+
+def _report_row(report):
+    return {
+        'Report ID': report['id'],
+        'Type': report['report_type'],
+        'Generated': report['generated_at'],
+        'Related File': report['filename'],
+        'Content': report['report_content']
+    }
+
+# Column types are declared up front so Parquet batches share one schema
+EXPORT_DATASETS = {
+    'analyses': {
+        'label': 'AI Analyses',
+        'table': 'ai_analysis',
+        'rows': lambda user_email: map(_analysis_row, database.iter_user_analyses(user_email)),
+        'columns': [('Date', 'str'), ('Filename', 'str'), ('Risk Level', 'str'), ('Confidence', 'int'),
+                    ('Scan Type', 'str'), ('Image Quality', 'str'), ('Key Findings', 'str'), ('Concerns', 'str')],
+    },
+    'uploads': {
+        'label': 'Uploads',
+        'table': 'uploads',
+        'rows': lambda user_email: map(_upload_row, database.iter_user_uploads(user_email)),
+        'columns': [('Upload ID', 'int'), ('Filename', 'str'), ('Type', 'str'), ('Date', 'str'), ('Status', 'str')],
+    },
+    'reports': {
+        'label': 'Reports',
+        'table': 'reports',
+        'rows': lambda user_email: map(_report_row, database.iter_user_reports(user_email)),
+        'columns': [('Report ID', 'int'), ('Type', 'str'), ('Generated', 'str'),
+                    ('Related File', 'str'), ('Content', 'str')],
+    },
+}
+
+def count_export_rows(user_email, dataset):
+    """Number of rows an export would contain"""
+    return database.count_user_records(user_email, EXPORT_DATASETS[dataset]['table'])
+
+def export_filename(user_email, dataset, fmt):
+    """Download file name for an export"""
+    user = user_email.split('@')[0]
+    extension = EXPORT_FORMATS[fmt]['extension']
+    return f"lifelens_{dataset}_{user}_{datetime.now().strftime('%Y%m%d')}.{extension}"
+
+def _write_csv(rows, columns, output):
+    text_output = io.TextIOWrapper(output, encoding='utf-8', newline='')
+    writer = csv.DictWriter(text_output, fieldnames=[name for name, _ in columns])
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    text_output.flush()
+    # Leave the caller's stream open
+    text_output.detach()
+    return count
+
+def _write_ndjson(rows, columns, output):
+    count = 0
+    for row in rows:
+        output.write(json.dumps(row, default=str).encode('utf-8'))
+        output.write(b"\n")
+        count += 1
+    return count
+
+def _to_int(value):
+    try:
+        return int(float(str(value).strip().rstrip('%')))
+    except (TypeError, ValueError):
+        return None
+
+def _write_parquet(rows, columns, output):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires the pyarrow package")
+
+    types = {'int': pa.int64(), 'str': pa.string()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    converters = {name: (_to_int if kind == 'int' else lambda v: None if v is None else str(v))
+                  for name, kind in columns}
+
+    count = 0
+    with pq.ParquetWriter(output, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append({name: converters[name](row.get(name)) for name, _ in columns})
+            if len(batch) >= PARQUET_BATCH_ROWS:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            count += len(batch)
+    return count
+
+_WRITERS = {
+    'csv': _write_csv,
+    'ndjson': _write_ndjson,
+    'parquet': _write_parquet,
+}
+
+def write_export(user_email, dataset, fmt, output):
+    """Stream a dataset into a binary output stream; returns the row count"""
+    spec = EXPORT_DATASETS[dataset]
+    return _WRITERS[fmt](spec['rows'](user_email), spec['columns'], output)
+
+def export_to_file(user_email, dataset, fmt, path):
+    """Write an export to a file; the file only appears once complete"""
+    tmp_path = f"{path}.part"
+    try:
+        with open(tmp_path, "wb") as output:
+            count = write_export(user_email, dataset, fmt, output)
+        os.replace(tmp_path, path)
+        return count
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+@contextmanager
+def spooled_export(user_email, dataset, fmt):
+    """Build an export into a temporary file and yield it opened for reading"""
+    fd, path = tempfile.mkstemp(prefix="lifelens_export_")
+    os.close(fd)
+    try:
+        export_to_file(user_email, dataset, fmt, path)
+        with open(path, "rb") as export_file:
+            yield export_file
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+# Background export jobs
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="lifelens-export")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+def _cleanup_old_exports():
+    """Forget jobs that finished more than EXPORT_MAX_AGE_SECONDS ago and remove their files"""
+    cutoff = time.time() - EXPORT_MAX_AGE_SECONDS
+    with _jobs_lock:
+        expired = [job for job in _jobs.values() if job['finished_at'] is not None and job['finished_at'] < cutoff]
+        for job in expired:
+            del _jobs[job['id']]
+    for job in expired:
+        try:
+            os.remove(job['path'])
+        except OSError:
+            pass
+
+    # Files left by jobs of earlier processes
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def _run_job(job_id):
+    with _jobs_lock:
+        job = _jobs[job_id]
+        job['status'] = 'running'
+
+    try:
+        count = export_to_file(job['user_email'], job['dataset'], job['format'], job['path'])
+        with _jobs_lock:
+            job['rows'] = count
+            job['status'] = 'completed'
+            job['finished_at'] = time.time()
+    except Exception as e:
+        print(f"Error running export job {job_id}: {str(e)}")
+        with _jobs_lock:
+            job['error'] = str(e)
+            job['status'] = 'failed'
+            job['finished_at'] = time.time()
+
+def start_export_job(user_email, dataset, fmt):
+    """Queue a background export and return its job ID"""
+    _cleanup_old_exports()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        _jobs[job_id] = {
+            'id': job_id,
+            'user_email': user_email,
+            'dataset': dataset,
+            'format': fmt,
+            'path': os.path.join(EXPORT_DIR, f"{job_id}.{EXPORT_FORMATS[fmt]['extension']}"),
+            'file_name': export_filename(user_email, dataset, fmt),
+            'status': 'queued',
+            'rows': None,
+            'error': None,
+            'finished_at': None,
+        }
+
+    _executor.submit(_run_job, job_id)
+    return job_id
+
+def get_export_job(job_id):
+    """Get a snapshot of a background export job's state"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
@@ -1,19 +1,240 @@
 import sqlite3
+import hashlib
+import json
 import os
+import threading
 from datetime import datetime
-from auth import hash_password, verify_password
+from auth import hash_password, verify_password, needs_rehash, rehash_in_background, verify_unknown_account, HashingBusy
+from data_cache import user_cached, invalidate_user, skip_cache
+import storage_codec
+import snapshot
+from analysis_records import AnalysisRecord, ScanAnalysis, dumps as dump_json, loads as loads_json, normalize_confidence, normalize_risk_level
 
 DB_PATH = "lifelens_ai.db"
+# A postgresql:// URL keeps everything in one shared PostgreSQL database
+# (see pg_backend) so several app nodes can run against it; otherwise data
+# lives in SQLite files next to DB_PATH
+DATABASE_URL = os.getenv("LIFELENS_DATABASE_URL")
 
-def get_connection():
-    """Get database connection"""
-    return sqlite3.connect(DB_PATH)
+# Tables whose rows belong to one user; in sharded mode they live in the
+# user's shard, everything else (users, AI call accounting, compression
+# dictionaries) stays in DB_PATH
+USER_TABLES = ('demographics', 'uploads', 'reports', 'ai_analysis', 'health_insights',
+               'events', 'event_counts', 'studies', 'study_analyses')
+# Each shard allocates record IDs from its own range, so IDs stay unique
+# across shards and rows keep their IDs when resharding moves them
+SHARD_ID_RANGE = 1 << 40
 
-def init_database():
-    """Initialize the database with required tables"""
-    conn = get_connection()
+def get_connection(db_path=None):
+    """Get database connection (the main database unless a shard path is given)"""
+    return get_backend().connect(db_path)
+
+def shard_index(user_email, shard_count):
+    """Shard number of a user: a stable hash of the email"""
+    digest = hashlib.sha256(user_email.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+def shard_map_path(db_path=None):
+    """The shard map that switches a database to sharded mode"""
+    return f"{db_path or DB_PATH}.shards.json"
+
+class SQLiteBackend:
+    """
+    Storage interface: where a user's or a record's rows live, and how to
+    connect there. database.py issues SQLite-dialect SQL through sqlite3-style
+    connections; other backends translate it
+    """
+
+    sharded = False
+    # Large text columns are compressed by storage_codec
+    compresses_columns = True
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def connect(self, db_path=None):
+        return sqlite3.connect(db_path or self.db_path)
+
+    def stream_cursor(self, conn, batch_size):
+        """Cursor for reading a large result in batches"""
+        return conn.cursor()
+
+    def database_files(self):
+        return list(dict.fromkeys([self.db_path] + self.shard_paths()))
+
+    def storage_size(self):
+        """Bytes used by the database files"""
+        return sum(os.path.getsize(path) for path in self.database_files())
+
+class SingleFileBackend(SQLiteBackend):
+    """Every table in one database file"""
+
+    def shard_paths(self):
+        return [self.db_path]
+
+    def path_for_user(self, user_email):
+        return self.db_path
+
+    def paths_for_id(self, record_id):
+        return [self.db_path]
+
+class ShardedBackend(SQLiteBackend):
+    """
+    Per-user tables in N shard files chosen by a hash of user_email, as
+    listed in the shard map with the ID range base of the current generation
+    """
+
+    sharded = True
+
+    def __init__(self, db_path, shard_map):
+        super().__init__(db_path)
+        directory = os.path.dirname(os.path.abspath(db_path))
+        self.generation = shard_map['generation']
+        self.id_base = shard_map['id_base']
+        self.shards = [os.path.join(directory, name) for name in shard_map['shards']]
+
+    def shard_paths(self):
+        return list(self.shards)
+
+    def path_for_user(self, user_email):
+        return self.shards[shard_index(user_email, len(self.shards))]
+
+    def paths_for_id(self, record_id):
+        """The shard that allocated an ID, or every shard for IDs from before the last resharding"""
+        index = (int(record_id) - 1 - self.id_base) // SHARD_ID_RANGE
+        if 0 <= index < len(self.shards):
+            return [self.shards[index]]
+        return list(self.shards)
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """The storage backend for DATABASE_URL or DB_PATH, reloaded when the shard map changes"""
+    global _backend
+
+    if DATABASE_URL:
+        backend = _backend
+        if backend is None or backend.key != DATABASE_URL:
+            with _backend_lock:
+                from pg_backend import PostgresBackend
+                backend = PostgresBackend(DATABASE_URL)
+                backend.key = DATABASE_URL
+                _backend = backend
+        return backend
+
+    map_path = shard_map_path()
+    try:
+        map_mtime = os.stat(map_path).st_mtime_ns
+    except FileNotFoundError:
+        map_mtime = None
+
+    key = (DB_PATH, map_mtime)
+    backend = _backend
+    if backend is None or backend.key != key:
+        with _backend_lock:
+            if map_mtime is None:
+                backend = SingleFileBackend(DB_PATH)
+            else:
+                with open(map_path) as f:
+                    backend = ShardedBackend(DB_PATH, json.load(f))
+            backend.key = key
+            _backend = backend
+    return backend
+
+def shard_paths():
+    """Database files holding per-user tables (just DB_PATH unless sharded)"""
+    return get_backend().shard_paths()
+
+def database_files():
+    """Every database file in use"""
+    return get_backend().database_files()
+
+def get_user_connection(user_email):
+    """Get a connection to the database holding a user's per-user rows"""
+    backend = get_backend()
+    return backend.connect(backend.path_for_user(user_email))
+
+def get_dashboard_connection(user_email, fresh=False):
+    """
+    Get a connection for dashboard reads of a user's per-user rows: the
+    analytics snapshot while it's recent enough (see snapshot), else the live
+    database. fresh=True always reads the live database
+    """
+    backend = get_backend()
+    path = backend.path_for_user(user_email)
+    if not isinstance(backend, SQLiteBackend):
+        return backend.connect(path)
+    return snapshot.connect(path, user_email, fresh)
+
+def _record_path(table, record_id):
+    """Database file holding a per-user row, found by its ID"""
+    backend = get_backend()
+    paths = backend.paths_for_id(record_id)
+    if len(paths) == 1:
+        return paths[0]
+
+    for path in paths:
+        conn = backend.connect(path)
+        found = conn.execute(f"SELECT 1 FROM {table} WHERE id = ?", (record_id,)).fetchone()
+        conn.close()
+        if found:
+            return path
+    return paths[0]
+
+def _record_connection(table, record_id):
+    """Get a connection to the database holding a per-user row"""
+    return get_backend().connect(_record_path(table, record_id))
+
+_initialized_databases = set()
+_init_lock = threading.Lock()
+
+def init_database(force=False):
+    """Initialize the database (and any shards) with required tables (once per file per process)"""
+    with _init_lock:
+        backend = get_backend()
+        shard_files = backend.shard_paths()
+        for db_path in database_files():
+            if db_path in _initialized_databases and not force:
+                continue
+            # Shards get only the per-user tables; a sharded main file only the shared ones
+            _create_schema(db_path, shared=not backend.sharded or db_path == backend.db_path,
+                           per_user=db_path in shard_files)
+            _initialized_databases.add(db_path)
+
+def seed_id_range(db_path, start):
+    """Make a new shard allocate IDs after start in every per-user AUTOINCREMENT table"""
+    conn = sqlite3.connect(db_path)
+    tables = [row[0] for row in conn.execute('''
+        SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE '%AUTOINCREMENT%'
+    ''') if row[0] in USER_TABLES]
+    for table in tables:
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, start))
+    conn.commit()
+    conn.close()
+
+def _create_schema(db_path=None, shared=True, per_user=True):
+    """
+    Create tables and indexes that don't exist yet: the shared tables, the
+    per-user tables (see USER_TABLES), or both
+    """
+    conn = get_connection(db_path)
     cursor = conn.cursor()
-    
+    if isinstance(get_backend(), SQLiteBackend):
+        # Readers, snapshot copies included, then don't block writers (persists in the file)
+        cursor.execute("PRAGMA journal_mode=WAL")
+    # Under the write lock, so processes starting together don't race to migrate
+    cursor.execute("BEGIN IMMEDIATE")
+    if shared:
+        _create_shared_tables(cursor)
+    if per_user:
+        _create_user_tables(cursor)
+    conn.commit()
+    conn.close()
+
+def _create_shared_tables(cursor):
+    """Tables kept in the main database only: accounts, sessions and AI call bookkeeping"""
     # Users table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -27,6 +248,62 @@ def init_database():
         )
     ''')
     
+    # Leases and short-lived results for coalesced AI calls (see singleflight)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_flights (
+            key TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            status TEXT NOT NULL,
+            lease_expires_at REAL NOT NULL,
+            result TEXT,
+            completed_at REAL
+        )
+    ''')
+
+    # Server-side login sessions shared by all app replicas (see session_store)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            token_hash TEXT PRIMARY KEY,
+            user_email TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_seen REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sessions_user
+        ON sessions (user_email)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sessions_expires
+        ON sessions (expires_at)
+    ''')
+
+    # One row per model call or shared result (see ai_usage)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ai_calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            function TEXT NOT NULL,
+            model TEXT,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            latency_ms INTEGER NOT NULL,
+            retries INTEGER NOT NULL DEFAULT 0,
+            cache TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            error TEXT,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ai_calls_created
+        ON ai_calls (created_at)
+    ''')
+
+    storage_codec.create_schema(cursor)
+
+def _create_user_tables(cursor):
+    """Per-user tables, created in every file that holds user rows"""
     # Demographics table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS demographics (
@@ -53,6 +330,13 @@ def init_database():
             file_type TEXT NOT NULL,
             upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             analysis_status TEXT DEFAULT 'pending',
+            quality_verdict TEXT,
+            quality_metrics TEXT,
+            modality TEXT,
+            body_part TEXT,
+            study_uid TEXT,
+            series_uid TEXT,
+            study_id INTEGER,
             FOREIGN KEY (user_email) REFERENCES users (email)
         )
     ''')
@@ -66,6 +350,8 @@ def init_database():
             report_type TEXT NOT NULL,
             report_content TEXT,
             generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            template_id TEXT,
+            template_params TEXT,
             FOREIGN KEY (user_email) REFERENCES users (email),
             FOREIGN KEY (upload_id) REFERENCES uploads (id)
         )
@@ -81,13 +367,221 @@ def init_database():
             risk_level TEXT,
             confidence_score INTEGER,
             analyzed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            model TEXT,
+            is_latest INTEGER NOT NULL DEFAULT 0,
+            prompt_version TEXT,
             FOREIGN KEY (upload_id) REFERENCES uploads (id),
             FOREIGN KEY (user_email) REFERENCES users (email)
         )
     ''')
-    
-    conn.commit()
-    conn.close()
+
+    # Health insights table (latest AI insights, reused by batch reports)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS health_insights (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_email TEXT NOT NULL,
+            insights_data TEXT NOT NULL,
+            generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_email) REFERENCES users (email)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_health_insights_user
+        ON health_insights (user_email, generated_at)
+    ''')
+
+    # Append-only activity log with per-user counters for O(1) counts
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_email TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            ref_id INTEGER,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_email) REFERENCES users (email)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_events_user
+        ON events (user_email, id)
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_events_user_type
+        ON events (user_email, event_type, id)
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS event_counts (
+            user_email TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_email, event_type)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_uploads_user_date
+        ON uploads (user_email, upload_date)
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reports_upload
+        ON reports (upload_id)
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reports_user_date
+        ON reports (user_email, generated_at)
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ai_analysis_upload
+        ON ai_analysis (upload_id, analyzed_at)
+    ''')
+
+    # Columns added after the original schema
+    _ensure_column(cursor, 'reports', 'template_id', 'TEXT')
+    _ensure_column(cursor, 'reports', 'template_params', 'TEXT')
+    _ensure_column(cursor, 'ai_analysis', 'model', 'TEXT')
+    _ensure_column(cursor, 'ai_analysis', 'prompt_version', 'TEXT')
+    _ensure_column(cursor, 'uploads', 'quality_verdict', 'TEXT')
+    _ensure_column(cursor, 'uploads', 'quality_metrics', 'TEXT')
+    for column in ('modality', 'body_part', 'study_uid', 'series_uid'):
+        _ensure_column(cursor, 'uploads', column, 'TEXT')
+
+    _ensure_column(cursor, 'uploads', 'study_id', 'INTEGER')
+
+    # Uploads grouped into one exam, analyzed together (see analyze_study)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS studies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_email TEXT NOT NULL,
+            title TEXT NOT NULL,
+            study_uid TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_email) REFERENCES users (email)
+        )
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_studies_user_uid
+        ON studies (user_email, study_uid) WHERE study_uid IS NOT NULL
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_uploads_study
+        ON uploads (study_id)
+    ''')
+
+    # Combined assessment of a study; per-image results go to ai_analysis
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS study_analyses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            study_id INTEGER NOT NULL,
+            user_email TEXT NOT NULL,
+            analysis_data TEXT NOT NULL,
+            risk_level TEXT,
+            confidence_score INTEGER,
+            model TEXT,
+            prompt_version TEXT,
+            is_latest INTEGER NOT NULL DEFAULT 1,
+            analyzed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (study_id) REFERENCES studies (id),
+            FOREIGN KEY (user_email) REFERENCES users (email)
+        )
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_study_analyses_latest
+        ON study_analyses (study_id) WHERE is_latest = 1
+    ''')
+
+    # DICOM study metadata filters
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_uploads_user_modality
+        ON uploads (user_email, modality, body_part)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_uploads_series
+        ON uploads (study_uid, series_uid)
+    ''')
+    if _ensure_column(cursor, 'ai_analysis', 'is_latest', 'INTEGER NOT NULL DEFAULT 0'):
+        cursor.execute('''
+            UPDATE ai_analysis SET is_latest = 1
+            WHERE id IN (SELECT MAX(id) FROM ai_analysis GROUP BY upload_id)
+        ''')
+
+    # At most one latest analysis per upload
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_ai_analysis_latest
+        ON ai_analysis (upload_id) WHERE is_latest = 1
+    ''')
+
+    _backfill_events(cursor)
+
+def _encode_column(text, column):
+    """Compress a large text value for storage (see storage_codec)"""
+    if not get_backend().compresses_columns:
+        return text
+    return storage_codec.compress(text, column, DB_PATH)
+
+def _decode_column(value):
+    """Decode a stored value; rows written as plain text pass through"""
+    return storage_codec.decompress(value, DB_PATH)
+
+def _ensure_column(cursor, table, column, definition):
+    """Add a column to an existing table if it is missing; returns True if added"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column in [row[1] for row in cursor.fetchall()]:
+        return False
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
+
+def _backfill_events(cursor):
+    """Populate the event log from existing history the first time it is created"""
+    cursor.execute("SELECT 1 FROM events LIMIT 1")
+    if cursor.fetchone():
+        return
+
+    cursor.execute('''
+        INSERT INTO events (user_email, event_type, ref_id, description, created_at)
+        SELECT user_email, event_type, ref_id, description, created_at FROM (
+            SELECT user_email, 'upload' AS event_type, id AS ref_id,
+                   'Uploaded ' || filename AS description, upload_date AS created_at
+            FROM uploads
+            UNION ALL
+            SELECT user_email, 'report', id, 'Generated ' || report_type, generated_at
+            FROM reports
+            UNION ALL
+            SELECT user_email, 'analysis', id,
+                   'AI analysis completed (' || COALESCE(risk_level, 'unknown') || ' risk)', analyzed_at
+            FROM ai_analysis
+            UNION ALL
+            SELECT user_email, 'demographics', id, 'Updated demographics', updated_at
+            FROM demographics
+        ) AS history
+        ORDER BY created_at
+    ''')
+
+    cursor.execute("DELETE FROM event_counts")
+    cursor.execute('''
+        INSERT INTO event_counts (user_email, event_type, count)
+        SELECT user_email, event_type, COUNT(*) FROM events
+        GROUP BY user_email, event_type
+    ''')
+
+def _record_event(cursor, user_email, event_type, ref_id, description):
+    """Append an activity event within the caller's transaction"""
+    cursor.execute('''
+        INSERT INTO events (user_email, event_type, ref_id, description)
+        VALUES (?, ?, ?, ?)
+    ''', (user_email, event_type, ref_id, description))
+
+    cursor.execute('''
+        INSERT INTO event_counts (user_email, event_type, count) VALUES (?, ?, 1)
+        ON CONFLICT (user_email, event_type) DO UPDATE SET count = event_counts.count + 1
+    ''', (user_email, event_type))
 
 def create_user(email, password, full_name):
     """Create a new user"""
@@ -112,7 +606,10 @@ def create_user(email, password, full_name):
         return False, f"Error creating user: {str(e)}"
 
 def verify_user(email, password):
-    """Verify user credentials"""
+    """
+    Verify user credentials
+    Returns None instead of False if the hashing workers were too busy to check
+    """
     try:
         conn = get_connection()
         cursor = conn.cursor()
@@ -121,10 +618,17 @@ def verify_user(email, password):
         result = cursor.fetchone()
         conn.close()
         
-        if result and verify_password(password, result[0]):
-            return True
-        return False
+        if not result:
+            return verify_unknown_account(password)
+        if not verify_password(password, result[0]):
+            return False
+        if needs_rehash(result[0]):
+            rehash_in_background(password, result[0],
+                                 lambda old, new: _replace_hash(email, 'password_hash', old, new))
+        return True
     
+    except HashingBusy:
+        return None
     except Exception as e:
         print(f"Error verifying user: {str(e)}")
         return False
@@ -132,7 +636,7 @@ def verify_user(email, password):
 def save_demographics(user_email, demographics_data):
     """Save or update user demographics"""
     try:
-        conn = get_connection()
+        conn = get_user_connection(user_email)
         cursor = conn.cursor()
         
         # Check if demographics already exist
@@ -172,17 +676,22 @@ def save_demographics(user_email, demographics_data):
                 demographics_data['medical_history']
             ))
         
+        _record_event(cursor, user_email, 'demographics', existing[0] if existing else cursor.lastrowid,
+                      "Updated demographics")
+        
         conn.commit()
         conn.close()
+        invalidate_user(user_email)
         return True, "Demographics saved successfully"
     
     except Exception as e:
         return False, f"Error saving demographics: {str(e)}"
 
-def get_user_demographics(user_email):
+@user_cached
+def get_user_demographics(user_email, fresh=False):
     """Get user demographics"""
     try:
-        conn = get_connection()
+        conn = get_dashboard_connection(user_email, fresh)
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -206,22 +715,40 @@ def get_user_demographics(user_email):
     
     except Exception as e:
         print(f"Error getting demographics: {str(e)}")
+        skip_cache()
         return None
 
-def save_upload(user_email, filename, file_path, file_type):
-    """Save upload information"""
+def save_upload(user_email, filename, file_path, file_type, quality=None, dicom_header=None):
+    """
+    Save upload information, with the image quality assessment and the DICOM
+    study metadata (see dicom_ingest.read_header) if there are any. DICOM
+    uploads join the user's study with the same StudyInstanceUID
+    """
     try:
-        conn = get_connection()
+        from image_quality import encode_quality
+        quality_verdict, quality_metrics = encode_quality(quality)
+        dicom_header = dicom_header or {}
+        
+        conn = get_user_connection(user_email)
         cursor = conn.cursor()
         
+        study_id = None
+        if dicom_header.get('study_uid'):
+            study_id = _dicom_study_id(cursor, user_email, dicom_header)
+        
         cursor.execute('''
-            INSERT INTO uploads (user_email, filename, file_path, file_type)
-            VALUES (?, ?, ?, ?)
-        ''', (user_email, filename, file_path, file_type))
+            INSERT INTO uploads (user_email, filename, file_path, file_type, quality_verdict, quality_metrics,
+                                 modality, body_part, study_uid, series_uid, study_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_email, filename, file_path, file_type, quality_verdict, quality_metrics,
+              dicom_header.get('modality'), dicom_header.get('body_part'),
+              dicom_header.get('study_uid'), dicom_header.get('series_uid'), study_id))
         
         upload_id = cursor.lastrowid
+        _record_event(cursor, user_email, 'upload', upload_id, f"Uploaded {filename}")
         conn.commit()
         conn.close()
+        invalidate_user(user_email)
         
         return upload_id
     
@@ -229,17 +756,26 @@ def save_upload(user_email, filename, file_path, file_type):
         print(f"Error saving upload: {str(e)}")
         return None
 
-def get_user_uploads(user_email):
-    """Get all uploads for a user"""
+@user_cached
+def get_user_uploads(user_email, modality=None, body_part=None):
+    """Get all uploads for a user, optionally only DICOM studies of one modality and body part"""
     try:
-        conn = get_connection()
+        conn = get_user_connection(user_email)
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT id, filename, file_type, upload_date, analysis_status
+        query = '''
+            SELECT id, filename, file_type, upload_date, analysis_status, quality_verdict, quality_metrics,
+                   modality, body_part, file_path
             FROM uploads WHERE user_email = ?
-            ORDER BY upload_date DESC
-        ''', (user_email,))
+        '''
+        params = [user_email]
+        if modality:
+            query += " AND modality = ?"
+            params.append(modality)
+        if body_part:
+            query += " AND body_part = ?"
+            params.append(body_part)
+        cursor.execute(query + " ORDER BY upload_date DESC", params)
         
         results = cursor.fetchall()
         conn.close()
@@ -251,29 +787,331 @@ def get_user_uploads(user_email):
                 'filename': row[1],
                 'file_type': row[2],
                 'upload_date': row[3],
-                'analysis_status': row[4]
+                'analysis_status': row[4],
+                'quality_verdict': row[5],
+                'quality_issues': json.loads(row[6]).get('issues', []) if row[6] else [],
+                'modality': row[7],
+                'body_part': row[8],
+                'file_path': row[9]
             })
         
         return uploads
     
     except Exception as e:
         print(f"Error getting uploads: {str(e)}")
+        skip_cache()
         return []
 
-def save_report(user_email, upload_id, report_type, report_content):
-    """Save a generated report"""
+@user_cached
+def get_user_study_types(user_email):
+    """Distinct (modality, body part) pairs of a user's DICOM uploads"""
     try:
-        conn = get_connection()
+        conn = get_user_connection(user_email)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT DISTINCT modality, body_part FROM uploads
+            WHERE user_email = ? AND modality IS NOT NULL
+            ORDER BY modality, body_part
+        ''', (user_email,))
+        
+        results = cursor.fetchall()
+        conn.close()
+        return results
+    
+    except Exception as e:
+        print(f"Error getting study types: {str(e)}")
+        skip_cache()
+        return []
+
+def _dicom_study_id(cursor, user_email, dicom_header):
+    """The user's study for a DICOM StudyInstanceUID, created on first use"""
+    row = cursor.execute('''
+        SELECT id FROM studies WHERE user_email = ? AND study_uid = ?
+    ''', (user_email, dicom_header['study_uid'])).fetchone()
+    if row:
+        return row[0]
+    
+    title = " ".join(part for part in (dicom_header.get('modality'), dicom_header.get('body_part'),
+                                       dicom_header.get('study_date')) if part) or "DICOM study"
+    cursor.execute('''
+        INSERT INTO studies (user_email, title, study_uid) VALUES (?, ?, ?)
+    ''', (user_email, title, dicom_header['study_uid']))
+    return cursor.lastrowid
+
+def create_study(user_email, title, upload_ids):
+    """Group some of a user's uploads into a study; returns the study ID"""
+    try:
+        conn = get_user_connection(user_email)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT INTO studies (user_email, title) VALUES (?, ?)
+        ''', (user_email, title))
+        study_id = cursor.lastrowid
+        
+        cursor.executemany('''
+            UPDATE uploads SET study_id = ? WHERE id = ? AND user_email = ?
+        ''', [(study_id, upload_id, user_email) for upload_id in upload_ids])
+        
+        conn.commit()
+        conn.close()
+        invalidate_user(user_email)
+        
+        return study_id
+    
+    except Exception as e:
+        print(f"Error creating study: {str(e)}")
+        return None
+
+@user_cached
+def get_user_studies(user_email):
+    """Get a user's studies with their image count and latest combined risk level"""
+    try:
+        conn = get_user_connection(user_email)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT s.id, s.title, s.created_at,
+                   (SELECT COUNT(*) FROM uploads u WHERE u.study_id = s.id),
+                   sa.risk_level, sa.analyzed_at
+            FROM studies s
+            LEFT JOIN study_analyses sa ON sa.study_id = s.id AND sa.is_latest = 1
+            WHERE s.user_email = ?
+            ORDER BY s.created_at DESC
+        ''', (user_email,))
+        
+        results = cursor.fetchall()
+        conn.close()
+        
+        return [{
+            'id': row[0],
+            'title': row[1],
+            'created_at': row[2],
+            'upload_count': row[3],
+            'risk_level': row[4],
+            'analyzed_at': row[5]
+        } for row in results]
+    
+    except Exception as e:
+        print(f"Error getting studies: {str(e)}")
+        skip_cache()
+        return []
+
+def get_study_uploads(study_id, user_email):
+    """A user's uploads in a study, oldest first (none if the study isn't theirs)"""
+    try:
+        conn = get_user_connection(user_email)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT id, filename, file_path, file_type, quality_verdict
+            FROM uploads WHERE study_id = ? AND user_email = ?
+            ORDER BY id
+        ''', (study_id, user_email))
+        
+        results = cursor.fetchall()
+        conn.close()
+        
+        return [{
+            'id': row[0],
+            'filename': row[1],
+            'file_path': row[2],
+            'file_type': row[3],
+            'quality_verdict': row[4]
+        } for row in results]
+    
+    except Exception as e:
+        print(f"Error getting study uploads: {str(e)}")
+        return []
+
+@user_cached
+def get_upload_status_page(user_email, limit=20, offset=0):
+    """Get one page of uploads with their report count and latest analysis risk"""
+    try:
+        conn = get_user_connection(user_email)
         cursor = conn.cursor()
         
+        # Only the requested page of uploads is joined and grouped
         cursor.execute('''
-            INSERT INTO reports (user_email, upload_id, report_type, report_content)
-            VALUES (?, ?, ?, ?)
-        ''', (user_email, upload_id, report_type, report_content))
+            SELECT u.id, u.filename, u.file_type, u.upload_date, u.analysis_status,
+                   u.file_path, COUNT(r.id) AS report_count,
+                   (SELECT a.risk_level FROM ai_analysis a
+                    WHERE a.upload_id = u.id AND a.is_latest = 1) AS latest_risk_level
+            FROM (
+                SELECT id, filename, file_type, upload_date, analysis_status, file_path
+                FROM uploads WHERE user_email = ?
+                ORDER BY upload_date DESC, id DESC
+                LIMIT ? OFFSET ?
+            ) u
+            LEFT JOIN reports r ON r.upload_id = u.id
+            GROUP BY u.id, u.filename, u.file_type, u.upload_date, u.analysis_status, u.file_path
+            ORDER BY u.upload_date DESC, u.id DESC
+        ''', (user_email, limit, offset))
+        
+        results = cursor.fetchall()
+        conn.close()
+        
+        return [{
+            'id': row[0],
+            'filename': row[1],
+            'file_type': row[2],
+            'upload_date': row[3],
+            'analysis_status': row[4],
+            'file_path': row[5],
+            'report_count': row[6],
+            'latest_risk_level': row[7]
+        } for row in results]
+    
+    except Exception as e:
+        print(f"Error getting upload status: {str(e)}")
+        skip_cache()
+        return []
+
+@user_cached
+def get_upload_summary(user_email):
+    """Upload counts for a user: {'by_type': {file_type: count}, 'pending': uploads awaiting analysis}"""
+    try:
+        conn = get_user_connection(user_email)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT file_type, COUNT(*),
+                   SUM(CASE WHEN analysis_status = 'pending' THEN 1 ELSE 0 END)
+            FROM uploads WHERE user_email = ?
+            GROUP BY file_type ORDER BY file_type
+        ''', (user_email,))
+        
+        results = cursor.fetchall()
+        conn.close()
+        
+        return {
+            'by_type': {row[0]: row[1] for row in results},
+            'pending': sum(row[2] or 0 for row in results)
+        }
+    
+    except Exception as e:
+        print(f"Error summarizing uploads: {str(e)}")
+        skip_cache()
+        return {'by_type': {}, 'pending': 0}
+
+@user_cached
+def get_latest_upload(user_email):
+    """Get a user's most recent upload"""
+    try:
+        conn = get_user_connection(user_email)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT id, filename, file_type, upload_date, analysis_status
+            FROM uploads WHERE user_email = ?
+            ORDER BY upload_date DESC LIMIT 1
+        ''', (user_email,))
+        
+        row = cursor.fetchone()
+        conn.close()
+        
+        if row:
+            return {
+                'id': row[0],
+                'filename': row[1],
+                'file_type': row[2],
+                'upload_date': row[3],
+                'analysis_status': row[4]
+            }
+        return None
+    
+    except Exception as e:
+        print(f"Error getting latest upload: {str(e)}")
+        skip_cache()
+        return None
+
+@user_cached
+def get_recent_events(user_email, limit=10, event_type=None):
+    """Get a user's most recent activity events, newest first"""
+    try:
+        conn = get_user_connection(user_email)
+        cursor = conn.cursor()
+        
+        if event_type:
+            cursor.execute('''
+                SELECT id, event_type, ref_id, description, created_at
+                FROM events WHERE user_email = ? AND event_type = ?
+                ORDER BY id DESC LIMIT ?
+            ''', (user_email, event_type, limit))
+        else:
+            cursor.execute('''
+                SELECT id, event_type, ref_id, description, created_at
+                FROM events WHERE user_email = ?
+                ORDER BY id DESC LIMIT ?
+            ''', (user_email, limit))
+        
+        results = cursor.fetchall()
+        conn.close()
+        
+        return [{
+            'id': row[0],
+            'event_type': row[1],
+            'ref_id': row[2],
+            'description': row[3],
+            'created_at': row[4]
+        } for row in results]
+    
+    except Exception as e:
+        print(f"Error getting events: {str(e)}")
+        skip_cache()
+        return []
+
+@user_cached
+def count_events(user_email, event_type=None):
+    """Count a user's activity events, optionally of a single type"""
+    try:
+        conn = get_user_connection(user_email)
+        cursor = conn.cursor()
+        
+        if event_type:
+            cursor.execute('''
+                SELECT count FROM event_counts WHERE user_email = ? AND event_type = ?
+            ''', (user_email, event_type))
+        else:
+            cursor.execute('''
+                SELECT SUM(count) FROM event_counts WHERE user_email = ?
+            ''', (user_email,))
+        
+        result = cursor.fetchone()
+        conn.close()
+        
+        return result[0] if result and result[0] else 0
+    
+    except Exception as e:
+        print(f"Error counting events: {str(e)}")
+        skip_cache()
+        return 0
+
+def save_report(user_email, upload_id, report_type, report_content=None, template_id=None, template_params=None):
+    """
+    Save a generated report, either as full text or as a template ID plus
+    its parameter record (see report_templates)
+    """
+    try:
+        if template_id is not None and not isinstance(template_params, str):
+            from report_templates import encode_params
+            template_params = encode_params(template_params)
+        
+        conn = get_user_connection(user_email)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT INTO reports (user_email, upload_id, report_type, report_content, template_id, template_params)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_email, upload_id, report_type, _encode_column(report_content, 'report_content'),
+              template_id, template_params))
         
         report_id = cursor.lastrowid
+        _record_event(cursor, user_email, 'report', report_id, f"Generated {report_type}")
         conn.commit()
         conn.close()
+        invalidate_user(user_email)
         
         return report_id
     
@@ -281,14 +1119,36 @@ def save_report(user_email, upload_id, report_type, report_content):
         print(f"Error saving report: {str(e)}")
         return None
 
+def _report_content(content, template_id, template_params):
+    """Stored report text, rendering template-based reports on read"""
+    if template_id is None:
+        return _decode_column(content)
+    try:
+        from report_templates import render_report
+        return render_report(template_id, template_params)
+    except Exception as e:
+        print(f"Error rendering report: {str(e)}")
+        return _decode_column(content) or ""
+
+def _report_row(row):
+    return {
+        'id': row[0],
+        'report_type': row[1],
+        'report_content': _report_content(row[2], row[5], row[6]),
+        'generated_at': row[3],
+        'filename': row[4] if row[4] else 'General Report'
+    }
+
+@user_cached
 def get_user_reports(user_email):
     """Get all reports for a user"""
     try:
-        conn = get_connection()
+        conn = get_user_connection(user_email)
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT r.id, r.report_type, r.report_content, r.generated_at, u.filename
+            SELECT r.id, r.report_type, r.report_content, r.generated_at, u.filename,
+                   r.template_id, r.template_params
             FROM reports r
             LEFT JOIN uploads u ON r.upload_id = u.id
             WHERE r.user_email = ?
@@ -298,43 +1158,117 @@ def get_user_reports(user_email):
         results = cursor.fetchall()
         conn.close()
         
-        reports = []
-        for row in results:
-            reports.append({
-                'id': row[0],
-                'report_type': row[1],
-                'report_content': row[2],
-                'generated_at': row[3],
-                'filename': row[4] if row[4] else 'General Report'
-            })
-        
-        return reports
+        return [_report_row(row) for row in results]
     
     except Exception as e:
         print(f"Error getting reports: {str(e)}")
+        skip_cache()
         return []
 
-def save_ai_analysis(upload_id, user_email, analysis_data, risk_level=None, confidence_score=None):
-    """Save AI analysis results"""
+@user_cached
+def get_report_page(user_email, limit=20, offset=0):
+    """Get one page of a user's reports, newest first; only that page is read and rendered"""
     try:
-        import json
-        conn = get_connection()
+        conn = get_user_connection(user_email)
         cursor = conn.cursor()
         
         cursor.execute('''
-            INSERT INTO ai_analysis (upload_id, user_email, analysis_data, risk_level, confidence_score)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (upload_id, user_email, json.dumps(analysis_data), risk_level, confidence_score))
+            SELECT r.id, r.report_type, r.report_content, r.generated_at, u.filename,
+                   r.template_id, r.template_params
+            FROM (
+                SELECT id, upload_id, report_type, report_content, generated_at, template_id, template_params
+                FROM reports WHERE user_email = ?
+                ORDER BY generated_at DESC, id DESC
+                LIMIT ? OFFSET ?
+            ) r
+            LEFT JOIN uploads u ON r.upload_id = u.id
+            ORDER BY r.generated_at DESC, r.id DESC
+        ''', (user_email, limit, offset))
         
-        analysis_id = cursor.lastrowid
+        results = cursor.fetchall()
+        conn.close()
+        
+        return [_report_row(row) for row in results]
+    
+    except Exception as e:
+        print(f"Error getting reports: {str(e)}")
+        skip_cache()
+        return []
+
+@user_cached
+def get_report_type_counts(user_email):
+    """Number of reports of each type for a user"""
+    try:
+        conn = get_user_connection(user_email)
+        cursor = conn.cursor()
         
-        # Update upload status to completed
         cursor.execute('''
-            UPDATE uploads SET analysis_status = 'completed' WHERE id = ?
-        ''', (upload_id,))
+            SELECT report_type, COUNT(*) FROM reports
+            WHERE user_email = ?
+            GROUP BY report_type ORDER BY report_type
+        ''', (user_email,))
+        
+        results = cursor.fetchall()
+        conn.close()
+        
+        return dict(results)
+    
+    except Exception as e:
+        print(f"Error counting reports: {str(e)}")
+        skip_cache()
+        return {}
+
+def _insert_ai_analysis(cursor, upload_id, user_email, analysis_data, risk_level=None, confidence_score=None,
+                        model=None, prompt_version=None):
+    """Validate an analysis and insert it as the upload's latest, within the caller's transaction"""
+    analysis = ScanAnalysis.from_dict(analysis_data)
+    risk_level = normalize_risk_level(risk_level) or analysis.risk_level
+    confidence = normalize_confidence(confidence_score)
+    if confidence is None:
+        confidence = analysis.confidence_score
+    
+    encoded = _encode_column(dump_json(analysis.to_dict()), 'analysis_data')
+    
+    # The new row replaces the upload's latest analysis
+    cursor.execute('''
+        UPDATE ai_analysis SET is_latest = 0 WHERE upload_id = ? AND is_latest = 1
+    ''', (upload_id,))
+    
+    cursor.execute('''
+        INSERT INTO ai_analysis (upload_id, user_email, analysis_data, risk_level, confidence_score, model,
+                                 prompt_version, is_latest)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+    ''', (upload_id, user_email, encoded, risk_level, confidence, model, prompt_version))
+    
+    analysis_id = cursor.lastrowid
+    
+    # Update upload status to completed
+    cursor.execute('''
+        UPDATE uploads SET analysis_status = 'completed' WHERE id = ?
+    ''', (upload_id,))
+    
+    _record_event(cursor, user_email, 'analysis', analysis_id,
+                  f"AI analysis completed ({risk_level or 'unknown'} risk)")
+    return analysis_id
+
+def save_ai_analysis(upload_id, user_email, analysis_data, risk_level=None, confidence_score=None, model=None,
+                     prompt_version=None):
+    """
+    Save AI analysis results
+    The model output is validated and normalized into a ScanAnalysis first;
+    risk level and confidence fall back to the values inside the analysis.
+    model and prompt_version record which cascade tier and prompt produced it
+    """
+    try:
+        conn = get_user_connection(user_email)
+        cursor = conn.cursor()
+        
+        analysis_id = _insert_ai_analysis(cursor, upload_id, user_email, analysis_data, risk_level,
+                                          confidence_score, model, prompt_version)
         
         conn.commit()
         conn.close()
+        invalidate_user(user_email)
         
         return analysis_id
     
@@ -342,18 +1276,60 @@ def save_ai_analysis(upload_id, user_email, analysis_data, risk_level=None, conf
         print(f"Error saving AI analysis: {str(e)}")
         return None
 
-def get_ai_analysis(upload_id):
-    """Get AI analysis for a specific upload"""
+def save_study_analysis(study_id, user_email, combined, per_image, model=None, prompt_version=None):
+    """
+    Save a study's combined assessment and the per-image analyses
+    (a dict of upload ID to analysis) in one transaction
+    Returns the study analysis ID
+    """
     try:
-        import json
-        conn = get_connection()
+        analysis = ScanAnalysis.from_dict(combined)
+        encoded = _encode_column(dump_json(analysis.to_dict()), 'analysis_data')
+        
+        conn = get_user_connection(user_email)
         cursor = conn.cursor()
         
+        cursor.execute("SELECT 1 FROM studies WHERE id = ? AND user_email = ?", (study_id, user_email))
+        if not cursor.fetchone():
+            conn.close()
+            print(f"Error saving study analysis: study {study_id} not found")
+            return None
+        
+        for upload_id, upload_analysis in per_image.items():
+            _insert_ai_analysis(cursor, upload_id, user_email, upload_analysis, model=model,
+                                prompt_version=prompt_version)
+        
         cursor.execute('''
-            SELECT id, analysis_data, risk_level, confidence_score, analyzed_at
-            FROM ai_analysis WHERE upload_id = ?
-            ORDER BY analyzed_at DESC LIMIT 1
-        ''', (upload_id,))
+            UPDATE study_analyses SET is_latest = 0 WHERE study_id = ? AND is_latest = 1
+        ''', (study_id,))
+        
+        cursor.execute('''
+            INSERT INTO study_analyses (study_id, user_email, analysis_data, risk_level, confidence_score,
+                                        model, prompt_version, is_latest)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+        ''', (study_id, user_email, encoded, analysis.risk_level, analysis.confidence_score, model, prompt_version))
+        
+        study_analysis_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        invalidate_user(user_email)
+        
+        return study_analysis_id
+    
+    except Exception as e:
+        print(f"Error saving study analysis: {str(e)}")
+        return None
+
+def get_study_analysis(study_id, user_email):
+    """Get the latest combined assessment of a user's study (None if the study isn't theirs)"""
+    try:
+        conn = get_user_connection(user_email)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT id, analysis_data, risk_level, confidence_score, model, analyzed_at
+            FROM study_analyses WHERE study_id = ? AND user_email = ? AND is_latest = 1
+        ''', (study_id, user_email))
         
         result = cursor.fetchone()
         conn.close()
@@ -361,53 +1337,242 @@ def get_ai_analysis(upload_id):
         if result:
             return {
                 'id': result[0],
-                'analysis_data': json.loads(result[1]),
+                'analysis': ScanAnalysis.from_stored(loads_json(_decode_column(result[1]))),
                 'risk_level': result[2],
                 'confidence_score': result[3],
-                'analyzed_at': result[4]
+                'model': result[4],
+                'analyzed_at': result[5]
             }
         return None
     
+    except Exception as e:
+        print(f"Error getting study analysis: {str(e)}")
+        return None
+
+def get_ai_analysis(upload_id):
+    """Get the latest AI analysis (an AnalysisRecord) for a specific upload"""
+    try:
+        conn = _record_connection('uploads', upload_id)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT id, analysis_data, risk_level, confidence_score, analyzed_at
+            FROM ai_analysis WHERE upload_id = ? AND is_latest = 1
+        ''', (upload_id,))
+        
+        result = cursor.fetchone()
+        conn.close()
+        
+        if result:
+            return AnalysisRecord.from_row(result[0], upload_id, _decode_column(result[1]),
+                                           result[2], result[3], result[4])
+        return None
+    
     except Exception as e:
         print(f"Error getting AI analysis: {str(e)}")
         return None
 
-def get_all_user_analyses(user_email):
-    """Get all AI analyses for a user"""
+def _analysis_record(row):
+    """
+    AnalysisRecord for an (id, upload_id, analysis_data, risk_level,
+    confidence_score, analyzed_at, filename, file_path) row, or None if its
+    stored data can't be read, so one bad row doesn't hide the rest
+    """
     try:
-        import json
-        conn = get_connection()
+        return AnalysisRecord.from_row(row[0], row[1], _decode_column(row[2]), *row[3:])
+    except Exception as e:
+        print(f"Error reading analysis {row[0]}: {str(e)}")
+        return None
+
+@user_cached
+def get_all_user_analyses(user_email, fresh=False):
+    """Get all AI analyses for a user as AnalysisRecords, newest first"""
+    try:
+        conn = get_dashboard_connection(user_email, fresh)
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT a.id, a.upload_id, a.analysis_data, a.risk_level, a.confidence_score, a.analyzed_at, u.filename
+            SELECT a.id, a.upload_id, a.analysis_data, a.risk_level, a.confidence_score, a.analyzed_at, u.filename, u.file_path
             FROM ai_analysis a
             JOIN uploads u ON a.upload_id = u.id
-            WHERE a.user_email = ?
+            WHERE a.user_email = ? AND a.is_latest = 1
             ORDER BY a.analyzed_at DESC
         ''', (user_email,))
         
         results = cursor.fetchall()
         conn.close()
         
-        analyses = []
-        for row in results:
-            analyses.append({
-                'id': row[0],
-                'upload_id': row[1],
-                'analysis_data': json.loads(row[2]),
-                'risk_level': row[3],
-                'confidence_score': row[4],
-                'analyzed_at': row[5],
-                'filename': row[6]
-            })
-        
-        return analyses
+        return [record for record in map(_analysis_record, results) if record is not None]
     
     except Exception as e:
         print(f"Error getting user analyses: {str(e)}")
+        skip_cache()
         return []
 
+def save_health_insights(user_email, insights):
+    """Save generated AI health insights so they can be reused"""
+    try:
+        conn = get_user_connection(user_email)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            INSERT INTO health_insights (user_email, insights_data)
+            VALUES (?, ?)
+        ''', (user_email, json.dumps(insights)))
+
+        insights_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        invalidate_user(user_email)
+
+        return insights_id
+
+    except Exception as e:
+        print(f"Error saving health insights: {str(e)}")
+        return None
+
+@user_cached
+def get_cached_health_insights(user_email):
+    """Get the most recently generated AI health insights for a user"""
+    try:
+        conn = get_user_connection(user_email)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT insights_data FROM health_insights
+            WHERE user_email = ?
+            ORDER BY generated_at DESC, id DESC LIMIT 1
+        ''', (user_email,))
+
+        result = cursor.fetchone()
+        conn.close()
+
+        return json.loads(result[0]) if result else None
+
+    except Exception as e:
+        print(f"Error getting cached health insights: {str(e)}")
+        skip_cache()
+        return None
+
+def _iter_rows(query, params=(), batch_size=500, db_path=None):
+    """Stream rows of a query in batches instead of fetching them all"""
+    yield from _stream_rows(get_connection(db_path), query, params, batch_size)
+
+def _stream_rows(conn, query, params, batch_size):
+    """Stream rows of a query on conn, closing it afterwards"""
+    try:
+        cursor = get_backend().stream_cursor(conn, batch_size)
+        cursor.execute(query, params)
+
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+    finally:
+        conn.close()
+
+def _iter_user_rows(user_email, query, params=(), batch_size=500, fresh=False):
+    """Stream rows of a query on a user's per-user tables, from the analytics snapshot when possible"""
+    yield from _stream_rows(get_dashboard_connection(user_email, fresh), query, params, batch_size)
+
+def _iter_shard_rows(query, params=(), batch_size=500):
+    """Stream rows of a query on per-user tables, shard after shard"""
+    for db_path in shard_paths():
+        yield from _iter_rows(query, params, batch_size, db_path)
+
+def iter_user_uploads(user_email, batch_size=500, fresh=False):
+    """Stream a user's uploads, newest first"""
+    for row in _iter_user_rows(user_email, '''
+        SELECT id, filename, file_type, upload_date, analysis_status
+        FROM uploads WHERE user_email = ?
+        ORDER BY upload_date DESC
+    ''', (user_email,), batch_size, fresh):
+        yield {
+            'id': row[0],
+            'filename': row[1],
+            'file_type': row[2],
+            'upload_date': row[3],
+            'analysis_status': row[4]
+        }
+
+def iter_user_reports(user_email, batch_size=500, fresh=False):
+    """Stream a user's reports, newest first"""
+    for row in _iter_user_rows(user_email, '''
+        SELECT r.id, r.report_type, r.report_content, r.generated_at, u.filename,
+                   r.template_id, r.template_params
+        FROM reports r
+        LEFT JOIN uploads u ON r.upload_id = u.id
+        WHERE r.user_email = ?
+        ORDER BY r.generated_at DESC
+    ''', (user_email,), batch_size, fresh):
+        yield {
+            'id': row[0],
+            'report_type': row[1],
+            'report_content': _report_content(row[2], row[5], row[6]),
+            'generated_at': row[3],
+            'filename': row[4] if row[4] else 'General Report'
+        }
+
+def iter_user_analyses(user_email, batch_size=500, fresh=False):
+    """Stream a user's AI analyses as AnalysisRecords, newest first"""
+    for row in _iter_user_rows(user_email, '''
+        SELECT a.id, a.upload_id, a.analysis_data, a.risk_level, a.confidence_score, a.analyzed_at, u.filename, u.file_path
+        FROM ai_analysis a
+        JOIN uploads u ON a.upload_id = u.id
+        WHERE a.user_email = ? AND a.is_latest = 1
+        ORDER BY a.analyzed_at DESC
+    ''', (user_email,), batch_size, fresh):
+        record = _analysis_record(row)
+        if record is not None:
+            yield record
+
+def count_user_records(user_email, table):
+    """Count a user's rows in one of the per-user history tables"""
+    if table not in ('uploads', 'reports', 'ai_analysis'):
+        raise ValueError(f"Unknown table: {table}")
+
+    try:
+        conn = get_user_connection(user_email)
+        cursor = conn.cursor()
+
+        query = f"SELECT COUNT(*) FROM {table} WHERE user_email = ?"
+        if table == 'ai_analysis':
+            # Earlier versions of re-analyzed uploads aren't part of the history
+            query += " AND is_latest = 1"
+        cursor.execute(query, (user_email,))
+        count = cursor.fetchone()[0]
+        conn.close()
+
+        return count
+
+    except Exception as e:
+        print(f"Error counting {table}: {str(e)}")
+        return 0
+
+def iter_user_emails(batch_size=500):
+    """
+    Stream all user emails without loading the whole users table
+    Pages are read after the last id seen, with a short-lived connection each,
+    so nothing stays open while the caller works through a page
+    """
+    last_id = 0
+    while True:
+        conn = get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, email FROM users WHERE id > ? ORDER BY id LIMIT ?", (last_id, batch_size))
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+
+        for row in rows:
+            yield row[1]
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1][0]
+
 def update_security_question(email, question, answer):
     """Update user's security question and answer"""
     try:
@@ -451,9 +1616,11 @@ def get_security_question(email):
         return None
 
 def verify_security_answer(email, answer):
-    """Verify user's security answer"""
+    """
+    Verify user's security answer
+    Returns None instead of False if the hashing workers were too busy to check
+    """
     try:
-        from auth import hash_password
         conn = get_connection()
         cursor = conn.cursor()
         
@@ -464,16 +1631,29 @@ def verify_security_answer(email, answer):
         result = cursor.fetchone()
         conn.close()
         
-        if result and result[0]:
-            answer_hash = hash_password(answer.lower().strip())
-            return answer_hash == result[0]
-        
-        return False
+        answer = answer.lower().strip()
+        if not result or not result[0]:
+            return verify_unknown_account(answer)
+        if not verify_password(answer, result[0]):
+            return False
+        if needs_rehash(result[0]):
+            rehash_in_background(answer, result[0],
+                                 lambda old, new: _replace_hash(email, 'security_answer_hash', old, new))
+        return True
     
+    except HashingBusy:
+        return None
     except Exception as e:
         print(f"Error verifying security answer: {str(e)}")
         return False
 
+def _replace_hash(email, column, old_hash, new_hash):
+    """Store an upgraded hash unless the secret was changed in the meantime"""
+    conn = get_connection()
+    conn.execute(f"UPDATE users SET {column} = ? WHERE email = ? AND {column} = ?", (new_hash, email, old_hash))
+    conn.commit()
+    conn.close()
+
 def reset_password(email, new_password):
     """Reset user's password"""
     try:
@@ -491,8 +1671,12 @@ def reset_password(email, new_password):
         
         conn.commit()
         conn.close()
+
+        # Sessions opened with the old password end everywhere
+        import session_store
+        session_store.end_user_sessions(email)
         return True
-    
+
     except Exception as e:
         print(f"Error resetting password: {str(e)}")
         return False
@@ -0,0 +1,236 @@
+"""
+DICOM ingestion for kidney ultrasound and CT exports.
+
+Headers are read with pixel data deferred, and uncompressed pixel data is
+memory-mapped, so only the frames that are actually used are read from disk.
+Frames are converted to model-ready 8-bit images with NumPy: rescale to
+modality units, apply the stored window/level (or a percentile window), and
+downsample by block averaging. Multi-frame series send a few representative
+frames instead of every slice. Encrypted uploads are read through
+upload_crypto, decrypting only the chunks that hold the frames used.
+
+pydicom is a declared dependency; if it isn't installed the upload page
+doesn't offer DICOM and DICOM files are refused with a message.
+"""
+import io
+import os
+
+from upload_crypto import is_decrypting, open_upload
+
+try:
+    import pydicom
+except ImportError:
+    pydicom = None
+
+PIXEL_DATA_TAG = 0x7FE00010
+# Values past this size are left on disk when the header is read
+DEFER_SIZE = 4096
+MODEL_SIZE = 1024
+MAX_FRAMES = int(os.getenv("LIFELENS_DICOM_MAX_FRAMES", "3"))
+# Frames scored when picking representative ones from a long series
+CANDIDATE_FRAMES = 12
+JPEG_QUALITY = 90
+
+UNCOMPRESSED_LITTLE_ENDIAN = ('1.2.840.10008.1.2', '1.2.840.10008.1.2.1')
+
+def dicom_supported():
+    """True when pydicom is installed"""
+    return pydicom is not None
+
+def is_dicom(file_path):
+    """True for files with the DICOM preamble (or a .dcm name)"""
+    if file_path.lower().endswith('.dcm'):
+        return True
+    try:
+        with open_upload(file_path) as f:
+            f.seek(128)
+            return f.read(4) == b'DICM'
+    except (OSError, ValueError):
+        return False
+
+def _first(value, default=None):
+    """First item of a possibly multi-valued element"""
+    if value is None or value == '':
+        return default
+    if isinstance(value, (list, tuple)) or type(value).__name__ == 'MultiValue':
+        return value[0] if len(value) else default
+    return value
+
+def _open(source):
+    """Dataset with large values deferred; source must stay open while they are read"""
+    if pydicom is None:
+        raise RuntimeError("DICOM support requires the pydicom package")
+    return pydicom.dcmread(source, defer_size=DEFER_SIZE)
+
+def _header(ds):
+    return {
+        'modality': ds.get('Modality') or None,
+        'body_part': (ds.get('BodyPartExamined') or '').upper() or None,
+        'study_uid': ds.get('StudyInstanceUID') or None,
+        'series_uid': ds.get('SeriesInstanceUID') or None,
+        'series_description': ds.get('SeriesDescription') or None,
+        'study_date': ds.get('StudyDate') or None,
+        'rows': int(ds.get('Rows', 0)),
+        'columns': int(ds.get('Columns', 0)),
+        'frames': int(ds.get('NumberOfFrames', 1) or 1),
+    }
+
+def read_header(file_path):
+    """Study metadata and image geometry, without reading pixel data"""
+    with open_upload(file_path) as f:
+        return _header(_open(f))
+
+def _pixel_layout(ds):
+    """
+    (file offset, dtype, shape (frames, rows, columns[, samples])) of the
+    pixel data, or None when it is compressed or in an unusual layout
+    """
+    import numpy as np
+
+    transfer_syntax = str(ds.file_meta.get('TransferSyntaxUID', ''))
+    bits = int(ds.get('BitsAllocated', 0))
+    if transfer_syntax not in UNCOMPRESSED_LITTLE_ENDIAN or bits not in (8, 16, 32):
+        return None
+
+    try:
+        element = ds.get_item(PIXEL_DATA_TAG, keep_deferred=True)
+    except TypeError:
+        # pydicom 2 returns the raw element by default
+        element = ds.get_item(PIXEL_DATA_TAG)
+    if element is None or not hasattr(element, 'value_tell'):
+        return None
+
+    signed = int(ds.get('PixelRepresentation', 0)) == 1
+    dtype = np.dtype(f"<{'i' if signed else 'u'}{bits // 8}")
+    frames = int(ds.get('NumberOfFrames', 1) or 1)
+    samples = int(ds.get('SamplesPerPixel', 1))
+    rows, columns = int(ds.Rows), int(ds.Columns)
+
+    if samples == 1:
+        shape = (frames, rows, columns)
+    elif int(ds.get('PlanarConfiguration', 0)) == 0:
+        shape = (frames, rows, columns, samples)
+    else:
+        return None
+    if element.length < int(np.prod(shape)) * dtype.itemsize:
+        return None
+
+    return element.value_tell, dtype, shape
+
+def _frame_source(ds, source):
+    """A function returning frame i as an array, and the frame count"""
+    import numpy as np
+
+    frames = int(ds.get('NumberOfFrames', 1) or 1)
+    layout = _pixel_layout(ds)
+    if layout is not None:
+        offset, dtype, shape = layout
+        if not is_decrypting(source):
+            # Mapped from the open handle, which is the file that was checked
+            pixels = np.memmap(source, dtype=dtype, mode='r', offset=offset, shape=shape)
+            return (lambda index: pixels[index]), frames
+
+        # Encrypted: read just the bytes of the requested frame
+        frame_bytes = int(np.prod(shape[1:])) * dtype.itemsize
+
+        def read_frame(index):
+            source.seek(offset + index * frame_bytes)
+            return np.frombuffer(source.read(frame_bytes), dtype=dtype).reshape(shape[1:])
+
+        return read_frame, frames
+
+    # Compressed data: decode single frames where pydicom supports it
+    try:
+        from pydicom.pixels import pixel_array
+
+        return (lambda index: pixel_array(source, index=index)), frames
+    except ImportError:
+        decoded = ds.pixel_array
+        if frames == 1:
+            decoded = decoded[None]
+        return (lambda index: decoded[index]), frames
+
+def _downsample(frame, size):
+    """Block-average a frame so its longest side is at most size"""
+    import numpy as np
+
+    factor = -(-max(frame.shape[:2]) // size)
+    if factor <= 1:
+        return np.asarray(frame, dtype=np.float32)
+    rows = frame.shape[0] // factor * factor
+    columns = frame.shape[1] // factor * factor
+    blocks = np.asarray(frame[:rows, :columns], dtype=np.float32)
+    blocks = blocks.reshape(rows // factor, factor, columns // factor, factor, *frame.shape[2:])
+    return blocks.mean(axis=(1, 3))
+
+def _window(frame, ds):
+    """Map modality values to 0-255 with the stored window/level, or a 1-99 percentile window"""
+    import numpy as np
+
+    slope = float(_first(ds.get('RescaleSlope'), 1) or 1)
+    intercept = float(_first(ds.get('RescaleIntercept'), 0) or 0)
+    values = frame * slope + intercept
+
+    center = _first(ds.get('WindowCenter'))
+    width = _first(ds.get('WindowWidth'))
+    if center is not None and width is not None and float(width) > 1:
+        low = float(center) - 0.5 - (float(width) - 1) / 2
+        high = low + float(width) - 1
+    else:
+        low, high = np.percentile(values, (1, 99))
+        if high <= low:
+            high = low + 1
+
+    scaled = np.clip((values - low) * (255.0 / (high - low)), 0, 255)
+    if ds.get('PhotometricInterpretation') == 'MONOCHROME1':
+        scaled = 255 - scaled
+    return scaled.astype(np.uint8)
+
+def _pick_frames(get_frame, frames, count):
+    """Indices of the count frames with the most content, in series order"""
+    import numpy as np
+
+    if frames <= count:
+        return list(range(frames))
+
+    # Skip the first and last slices, which rarely show the kidneys
+    candidates = sorted(set(np.linspace(frames * 0.1, frames * 0.9, min(CANDIDATE_FRAMES, frames)).astype(int)))
+    scores = []
+    for index in candidates:
+        coarse = np.asarray(get_frame(index)[::8, ::8], dtype=np.float32)
+        scores.append((float(coarse.std()), index))
+    return sorted(int(index) for _, index in sorted(scores, reverse=True)[:count])
+
+def render_frames(file_path, max_frames=MAX_FRAMES, size=MODEL_SIZE):
+    """Header and a list of (frame index, 8-bit array) for the representative frames"""
+    import numpy as np
+
+    with open_upload(file_path) as f:
+        ds = _open(f)
+        get_frame, frames = _frame_source(ds, f)
+        rendered = []
+        for index in _pick_frames(get_frame, frames, max_frames):
+            frame = _downsample(get_frame(index), size)
+            if frame.ndim == 3:
+                # Colour (e.g. Doppler ultrasound) is already display-ready
+                rendered.append((index, np.clip(frame, 0, 255).astype(np.uint8)))
+            else:
+                rendered.append((index, _window(frame, ds)))
+        return _header(ds), rendered
+
+def model_frames(file_path, max_frames=MAX_FRAMES, size=MODEL_SIZE):
+    """JPEG bytes of the representative frames, ready to send to the vision model"""
+    from PIL import Image
+
+    _, rendered = render_frames(file_path, max_frames, size)
+    images = []
+    for _, pixels in rendered:
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format='JPEG', quality=JPEG_QUALITY)
+        images.append(buffer.getvalue())
+    return images
+
+def preview_frame(file_path, size=MODEL_SIZE):
+    """(width, height) and the single most representative frame as an 8-bit array"""
+    header, rendered = render_frames(file_path, max_frames=1, size=size)
+    return (header['columns'], header['rows']), rendered[0][1]
@@ -14,8 +14,8 @@ def create_risk_level_timeline(analyses):
     risk_numeric = []
     
     for analysis in reversed(analyses):  # Oldest to newest
-        dates.append(analysis['analyzed_at'][:10])
-        risk_level = analysis.get('risk_level', 'unknown')
+        dates.append(analysis.analyzed_at[:10])
+        risk_level = analysis.risk_level
         risk_levels.append(risk_level.title())
         
         # Convert to numeric for plotting
@@ -66,8 +66,8 @@ def create_confidence_score_chart(analyses):
     scores = []
     
     for analysis in reversed(analyses):
-        dates.append(analysis['analyzed_at'][:10])
-        scores.append(analysis.get('confidence_score', 0))
+        dates.append(analysis.analyzed_at[:10])
+        scores.append(analysis.confidence_score)
     
     fig = go.Figure()
     
@@ -96,7 +96,7 @@ def create_risk_distribution_pie(analyses):
     risk_counts = {'Low': 0, 'Moderate': 0, 'High': 0}
     
     for analysis in analyses:
-        risk_level = analysis.get('risk_level', 'unknown')
+        risk_level = analysis.risk_level
         if risk_level in ['low', 'moderate', 'high']:
             risk_counts[risk_level.title()] += 1
     
@@ -200,7 +200,8 @@ def create_health_metrics_comparison(analyses):
         return None
     
     latest = analyses[0]
-    analysis_data = latest.get('analysis_data', {})
+    analysis_data = latest.analysis_data
+    indicators = analysis_data.kidney_indicators
     
     # Extract metrics (sample)
     categories = ['Overall Health', 'Kidney Size', 'Kidney Structure', 'Image Quality', 'Risk Assessment']
@@ -217,11 +218,11 @@ def create_health_metrics_comparison(analyses):
         return 50
     
     values = [
-        quality_to_score(analysis_data.get('image_quality', 'fair')),
-        quality_to_score(analysis_data.get('kidney_indicators', {}).get('size', 'normal')),
-        quality_to_score(analysis_data.get('kidney_indicators', {}).get('structure', 'normal')),
-        quality_to_score(analysis_data.get('image_quality', 'fair')),
-        quality_to_score(latest.get('risk_level', 'moderate'))
+        quality_to_score(analysis_data.image_quality),
+        quality_to_score(indicators.size if indicators else 'normal'),
+        quality_to_score(indicators.structure if indicators else 'normal'),
+        quality_to_score(analysis_data.image_quality),
+        quality_to_score(latest.risk_level)
     ]
     
     fig = go.Figure()
@@ -254,8 +255,7 @@ def create_findings_frequency_chart(analyses):
     findings_count = {}
     
     for analysis in analyses:
-        findings = analysis.get('analysis_data', {}).get('key_findings', [])
-        for finding in findings:
+        for finding in analysis.analysis_data.key_findings:
             # Simplify finding to first few words
             key = ' '.join(finding.split()[:4])
             findings_count[key] = findings_count.get(key, 0) + 1
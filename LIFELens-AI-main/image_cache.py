@@ -0,0 +1,51 @@
+import os
+import hashlib
+import importlib.util
+
+# Static chart renderings are written here once and reused by every
+# report that needs the same image
+IMAGE_CACHE_DIR = os.getenv("LIFELENS_IMAGE_CACHE_DIR", "image_cache")
+
+_warned_missing_kaleido = False
+
+def _cache_path(namespace, key):
+    """Get the cache file path for a key"""
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return os.path.join(IMAGE_CACHE_DIR, namespace, digest[:2], f"{digest}.png")
+
+def _write_atomic(path, data):
+    """Write a file so concurrent readers never see a partial image"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.part"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def get_chart_image(fig, width=700, height=400):
+    """
+    Get a static PNG rendering of a Plotly figure
+    Returns the cached file path, or None if the figure can't be rendered
+    """
+    global _warned_missing_kaleido
+
+    if fig is None:
+        return None
+
+    path = _cache_path("charts", f"{width}x{height}:{fig.to_json()}")
+    if os.path.exists(path):
+        return path
+
+    # Static export needs the optional kaleido package
+    if importlib.util.find_spec("kaleido") is None:
+        if not _warned_missing_kaleido:
+            _warned_missing_kaleido = True
+            print("Chart images left out of reports: install the kaleido package to render them")
+        return None
+
+    try:
+        png_bytes = fig.to_image(format="png", width=width, height=height)
+        _write_atomic(path, png_bytes)
+        return path
+    except Exception as e:
+        print(f"Error rendering chart image: {str(e)}")
+        return None
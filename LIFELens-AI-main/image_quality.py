@@ -0,0 +1,253 @@
+"""
+Local quality gate for uploaded scan images (and DICOM frames).
+
+Measures sharpness (variance of the Laplacian), contrast, exposure,
+resolution and near-blank frames with NumPy before a scan reaches the paid
+vision model. JPEGs decode only their luminance, and large images are
+reduced before the colour conversion. Sharpness is measured on the reduced
+image; contrast and exposure on a sample of the original pixels, which
+averaging would smooth. Metrics and the verdict ('ok', 'warn' or 'reject')
+are stored on the uploads row.
+
+Usage (score existing uploads):
+    python image_quality.py [--rescore] [--workers 4] [--db lifelens_ai.db]
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import database
+
+# Metrics are measured on images scaled to at most this size, so thresholds
+# don't depend on the upload's resolution
+ANALYSIS_SIZE = 1024
+
+# Below these the scan is rejected
+MIN_SIDE_REJECT = 128
+BLANK_STD = 3.0
+# Below (or above) these the user is warned
+MIN_SIDE_WARN = 384
+BLUR_WARN = float(os.getenv("LIFELENS_QUALITY_BLUR_WARN", "60"))
+CONTRAST_WARN = 20.0
+DARK_MEAN = 25
+BRIGHT_MEAN = 230
+CLIPPED_WARN = 0.4
+
+QUALITY_VERSION = 2
+BATCH_ROWS = 100
+
+def _load_gray(file_path):
+    """
+    Original (width, height), a grayscale uint8 array of at most ANALYSIS_SIZE
+    and a sample of the original pixels of the same size
+    """
+    import numpy as np
+    from PIL import Image
+
+    from upload_crypto import open_upload
+
+    with open_upload(file_path) as f, Image.open(f) as img:
+        size = img.size
+        # JPEG skips the chroma; decoding at a smaller DCT scale would average the pixels
+        img.draft('L', size)
+        if img.mode not in ('L', 'RGB', 'RGBA'):
+            img = img.convert('L')
+        factor = -(-max(size) // ANALYSIS_SIZE)
+        if factor == 1:
+            gray = np.asarray(img.convert('L'))
+            return size, gray, gray
+        sample = img.resize((max(1, size[0] // factor), max(1, size[1] // factor)), Image.NEAREST)
+        return size, np.asarray(img.reduce(factor).convert('L')), np.asarray(sample.convert('L'))
+
+def _decode(file_path):
+    """
+    Original (width, height), the 8-bit grayscale array to measure and the
+    sample for intensity statistics, for an image or DICOM file
+    """
+    import dicom_ingest
+
+    if dicom_ingest.is_dicom(file_path):
+        size, gray = dicom_ingest.preview_frame(file_path, ANALYSIS_SIZE)
+        if gray.ndim == 3:
+            gray = gray.mean(axis=2).astype(gray.dtype)
+        return size, gray, gray
+    return _load_gray(file_path)
+
+def measure(file_path):
+    """Quality metrics for an image or DICOM file"""
+    (width, height), gray, sample = _decode(file_path)
+    return measure_array(gray, width, height, sample)
+
+def measure_array(gray, width, height, sample=None):
+    """
+    Quality metrics for an 8-bit grayscale array from an image of width x height
+    Intensity statistics come from sample (default gray): unaveraged pixels of
+    the original image when gray was reduced
+    """
+    import numpy as np
+
+    # 4-neighbour Laplacian on the interior pixels
+    pixels = gray.astype(np.int16)
+    laplacian = (pixels[1:-1, :-2] + pixels[1:-1, 2:] + pixels[:-2, 1:-1] + pixels[2:, 1:-1]
+                 - 4 * pixels[1:-1, 1:-1])
+
+    # Intensity statistics from the histogram instead of sorting the pixels
+    if sample is None:
+        sample = gray
+    histogram = np.bincount(sample.ravel(), minlength=256)
+    levels = np.arange(256)
+    total = sample.size
+    mean = float(histogram @ levels) / total
+    std = (float(histogram @ (levels - mean) ** 2) / total) ** 0.5
+    cumulative = np.cumsum(histogram)
+    low = int(np.searchsorted(cumulative, 0.01 * total))
+    high = int(np.searchsorted(cumulative, 0.99 * total))
+
+    return {
+        'width': width,
+        'height': height,
+        'blur': round(float(laplacian.var(dtype=np.float64)), 1),
+        'contrast': round(std, 1),
+        'brightness': round(mean, 1),
+        'dynamic_range': high - low,
+        'clipped': round(float(histogram[:6].sum() + histogram[250:].sum()) / total, 3),
+    }
+
+def judge(metrics):
+    """(verdict, issues) for a set of metrics"""
+    rejects = []
+    warnings = []
+
+    short_side = min(metrics['width'], metrics['height'])
+    if short_side < MIN_SIDE_REJECT:
+        rejects.append(f"resolution too low ({metrics['width']}x{metrics['height']})")
+    elif short_side < MIN_SIDE_WARN:
+        warnings.append(f"low resolution ({metrics['width']}x{metrics['height']})")
+
+    if metrics['contrast'] < BLANK_STD:
+        rejects.append("image is nearly blank")
+    else:
+        if metrics['blur'] < BLUR_WARN:
+            warnings.append("image looks blurry")
+        if metrics['contrast'] < CONTRAST_WARN:
+            warnings.append("low contrast")
+        if metrics['brightness'] < DARK_MEAN:
+            warnings.append("underexposed")
+        elif metrics['brightness'] > BRIGHT_MEAN:
+            warnings.append("overexposed")
+        if metrics['clipped'] > CLIPPED_WARN:
+            warnings.append("large areas are pure black or white")
+
+    if rejects:
+        return 'reject', rejects + warnings
+    if warnings:
+        return 'warn', warnings
+    return 'ok', []
+
+def scorer_available():
+    """True when numpy and Pillow, which the quality gate needs, are installed"""
+    try:
+        import numpy
+        import PIL
+    except ImportError:
+        return False
+    return True
+
+def assess_image(file_path):
+    """
+    Measure and judge an image
+    Returns {'verdict', 'issues', 'metrics'}, or None if the file can't be
+    decoded as an image. The verdict is None if the scan couldn't be scored
+    (e.g. numpy or Pillow missing); such scans are kept, unscored
+    """
+    if not scorer_available():
+        print("Image quality gate skipped: numpy and Pillow are required")
+        return {'verdict': None, 'issues': [], 'metrics': None}
+
+    try:
+        (width, height), gray, sample = _decode(file_path)
+    except Exception as e:
+        print(f"Error reading image: {str(e)}")
+        return None
+
+    try:
+        metrics = measure_array(gray, width, height, sample)
+    except Exception as e:
+        print(f"Error measuring image quality: {str(e)}")
+        return {'verdict': None, 'issues': [], 'metrics': None}
+
+    verdict, issues = judge(metrics)
+    metrics['version'] = QUALITY_VERSION
+    return {'verdict': verdict, 'issues': issues, 'metrics': metrics}
+
+def encode_quality(quality):
+    """(quality_verdict, quality_metrics) column values for an assessment"""
+    if quality is None or quality['verdict'] is None:
+        return None, None
+    return quality['verdict'], json.dumps(dict(quality['metrics'], issues=quality['issues']), separators=(',', ':'))
+
+def _score_upload(row):
+    upload_id, file_path = row
+    if not os.path.exists(file_path):
+        return upload_id, None
+    return upload_id, assess_image(file_path)
+
+def score_backlog(rescore=False, workers=None):
+    """Score stored image uploads in parallel; returns a count per verdict"""
+    query = "SELECT id, file_path FROM uploads WHERE file_type IN ('image', 'dicom')"
+    if not rescore:
+        query += " AND quality_verdict IS NULL"
+    counts = {}
+
+    def write(batch, db_path):
+        conn = database.get_connection(db_path)
+        conn.executemany("UPDATE uploads SET quality_verdict = ?, quality_metrics = ? WHERE id = ?", batch)
+        conn.commit()
+        conn.close()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Shard by shard, so verdicts are written back to the file the rows came from
+        for db_path in database.shard_paths():
+            rows = list(database._iter_rows(query + " ORDER BY id", db_path=db_path))
+            pending = []
+            for upload_id, quality in executor.map(_score_upload, rows, chunksize=8):
+                # Missing or unreadable files are marked so they aren't retried every run
+                verdict, metrics = encode_quality(quality) if quality else ('unreadable', None)
+                if verdict is None:
+                    # Couldn't be scored this time; left for the next run
+                    counts['unscored'] = counts.get('unscored', 0) + 1
+                    continue
+                counts[verdict] = counts.get(verdict, 0) + 1
+                pending.append((verdict, metrics, upload_id))
+                if len(pending) >= BATCH_ROWS:
+                    write(pending, db_path)
+                    pending = []
+            if pending:
+                write(pending, db_path)
+
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score the image quality of stored uploads")
+    parser.add_argument("--rescore", action="store_true", help="Also re-score uploads that already have a verdict")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--db", default=database.DB_PATH, help="Path to the database file")
+    args = parser.parse_args(argv)
+
+    database.DB_PATH = args.db
+    if not scorer_available():
+        print("Image quality scoring requires numpy and Pillow")
+        return 1
+    database.init_database()
+
+    counts = score_backlog(args.rescore, args.workers)
+    if not counts:
+        print("No uploads to score")
+    for verdict, count in sorted(counts.items()):
+        print(f"{verdict}: {count}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Model cascade for the AI analyzer.
+
+Each task first runs on a fast, cheap tier (a small model, or the local rule
+engine for text-only tasks) and escalates to the large model only when the
+first pass fails schema validation, reports low confidence, or reports a
+high risk level. Per-tier latency, token counts and escalation rates are
+kept in process-wide counters, and every tier call is recorded in the
+ai_calls table (see ai_usage.py).
+"""
+import os
+import threading
+import time
+
+import ai_usage
+
+CASCADE_ENABLED = os.getenv("LIFELENS_CASCADE", "1") != "0"
+FAST_MODEL = os.getenv("LIFELENS_FAST_MODEL", "gpt-5-mini")
+LARGE_MODEL = os.getenv("LIFELENS_LARGE_MODEL", "gpt-5")
+# First-pass results below this confidence (0-100) are escalated
+ESCALATION_CONFIDENCE = int(os.getenv("LIFELENS_ESCALATION_CONFIDENCE", "70"))
+FAST_MAX_TOKENS = int(os.getenv("LIFELENS_FAST_MAX_TOKENS", "1024"))
+
+RULES_TIER = "rules"
+
+class SchemaError(ValueError):
+    """A tier returned output that doesn't match the expected structure"""
+
+_lock = threading.Lock()
+_stats = {}
+
+def _record(task, tier, elapsed, usage, outcome):
+    with _lock:
+        entry = _stats.setdefault((task, tier), {
+            'calls': 0, 'escalated': 0, 'errors': 0, 'seconds': 0.0,
+            'prompt_tokens': 0, 'completion_tokens': 0
+        })
+        entry['calls'] += 1
+        entry['seconds'] += elapsed
+        if usage:
+            entry['prompt_tokens'] += usage.get('prompt_tokens', 0)
+            entry['completion_tokens'] += usage.get('completion_tokens', 0)
+        if outcome == 'escalated':
+            entry['escalated'] += 1
+        elif outcome == 'error':
+            entry['errors'] += 1
+
+def run_cascade(task, tiers, check):
+    """
+    Run tiers in order until one is accepted
+    tiers is a list of (tier_name, call) where call() returns (result, usage);
+    check(result) returns None to accept or a reason string to escalate. The
+    last tier's result is accepted unless its call raised.
+    Returns (result, tier_name, escalation_reasons); result is None if every tier failed
+    """
+    reasons = []
+    for index, (tier, call) in enumerate(tiers):
+        is_last = index == len(tiers) - 1
+        started = time.perf_counter()
+        usage = None
+        retries = 0
+        call_outcome = 'ok'
+        try:
+            result, usage = call()
+            reason = None if is_last else check(result)
+            if reason:
+                call_outcome = 'escalated'
+        except SchemaError as e:
+            result, reason, call_outcome = None, f"schema: {str(e)}", 'schema_error'
+            retries = getattr(e, 'retries', 0)
+        except Exception as e:
+            print(f"Error in {task} ({tier}): {str(e)}")
+            result, reason, call_outcome = None, f"error: {str(e)}", 'error'
+            retries = getattr(e, 'retries', 0)
+        elapsed = time.perf_counter() - started
+
+        usage = usage or {}
+        ai_usage.record_call(task, tier, 1000 * elapsed,
+                             prompt_tokens=usage.get('prompt_tokens', 0),
+                             completion_tokens=usage.get('completion_tokens', 0),
+                             retries=usage.get('retries', retries),
+                             outcome=call_outcome,
+                             error=reason if call_outcome in ('schema_error', 'error') else None)
+
+        if reason is None:
+            _record(task, tier, elapsed, usage, 'accepted')
+            return result, tier, reasons
+
+        reasons.append(f"{tier}: {reason}")
+        _record(task, tier, elapsed, usage, 'error' if is_last else 'escalated')
+
+    return None, None, reasons
+
+def model_tiers():
+    """Model names to try in order for model-only tasks"""
+    if CASCADE_ENABLED and FAST_MODEL and FAST_MODEL != LARGE_MODEL:
+        return [FAST_MODEL, LARGE_MODEL]
+    return [LARGE_MODEL]
+
+def check_risk_result(result, confidence):
+    """Escalation reason for a result with a risk level and confidence, or None"""
+    if result.get('risk_level') == 'high':
+        return "high risk"
+    if confidence is None or confidence < ESCALATION_CONFIDENCE:
+        return f"low confidence ({confidence})"
+    return None
+
+def get_cascade_stats():
+    """Per task and tier: calls, escalation rate, mean latency and token totals"""
+    with _lock:
+        stats = {}
+        for (task, tier), entry in _stats.items():
+            row = dict(entry)
+            row['escalation_rate'] = entry['escalated'] / entry['calls'] if entry['calls'] else 0.0
+            row['mean_latency_ms'] = 1000 * entry['seconds'] / entry['calls'] if entry['calls'] else 0.0
+            stats.setdefault(task, {})[tier] = row
+        return stats
+
+def reset_cascade_stats():
+    with _lock:
+        _stats.clear()
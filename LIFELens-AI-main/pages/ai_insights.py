@@ -1,8 +1,12 @@
 import streamlit as st
-from database import get_all_user_analyses, get_user_demographics
-from ai_analyzer import generate_health_insights, assess_kidney_health_risk
+from database import get_all_user_analyses, get_user_demographics, save_health_insights
+from ai_analyzer import generate_health_insights, assess_kidney_health_risk, build_analysis_summaries
+from analysis_records import average_confidence
 import json
 
+# Individual analyses shown at first, and added per "Show more"
+ANALYSES_PAGE_SIZE = 10
+
 def show_page():
     """Display AI-powered health insights page"""
     st.title("🤖 AI Health Insights")
@@ -20,16 +24,15 @@ def show_page():
     
     with col2:
         if analyses:
-            latest_risk = analyses[0].get('risk_level', 'Unknown')
-            st.metric("Latest Risk Level", latest_risk.title() if latest_risk else "N/A")
+            st.metric("Latest Risk Level", analyses[0].risk_level.title())
     
     with col3:
         if analyses:
-            avg_confidence = sum([a.get('confidence_score', 0) for a in analyses]) / len(analyses)
+            avg_confidence = average_confidence(analyses)
             st.metric("Avg Confidence", f"{int(avg_confidence)}%")
     
     with col4:
-        high_risk_count = len([a for a in analyses if a.get('risk_level') == 'high'])
+        high_risk_count = len([a for a in analyses if a.risk_level == 'high'])
         st.metric("High Risk Alerts", high_risk_count)
     
     st.markdown("---")
@@ -100,19 +103,14 @@ def show_page():
         
         with st.spinner("Generating comprehensive insights from your scan history..."):
             # Prepare analysis data for insights generation
-            analysis_summaries = []
-            for analysis in analyses:
-                analysis_summaries.append({
-                    'date': analysis.get('analyzed_at'),
-                    'risk_level': analysis.get('risk_level'),
-                    'confidence': analysis.get('confidence_score'),
-                    'key_findings': analysis['analysis_data'].get('key_findings', []),
-                    'concerns': analysis['analysis_data'].get('potential_concerns', [])
-                })
-            
+            analysis_summaries = build_analysis_summaries(analyses)
+
             insights = generate_health_insights(demographics, analysis_summaries)
-        
+
         if insights:
+            # Keep the latest insights for reuse by reports
+            save_health_insights(st.session_state.username, insights)
+
             # Overall health status
             st.markdown("#### 🏥 Overall Health Status")
             st.info(insights.get('overall_health_status', 'Analysis in progress...'))
@@ -150,20 +148,46 @@ def show_page():
         st.markdown("---")
         st.subheader("📋 Individual Scan Analyses")
         
-        for i, analysis in enumerate(analyses):
-            analysis_data = analysis['analysis_data']
+        # Bulk export of per-analysis PDF reports
+        if st.button("📦 Export All Analyses (PDF)", use_container_width=True):
+            with st.spinner(f"Building {len(analyses)} analysis reports..."):
+                from pdf_generator import export_all_analysis_reports, spooled_pdf
+                
+                with spooled_pdf(export_all_analysis_reports, analyses, demographics) as zip_file:
+                    if zip_file is None:
+                        st.warning("⏳ Too many reports are being generated right now. Please try again shortly.")
+                    else:
+                        st.download_button(
+                            label="📥 Download Analysis Reports (ZIP)",
+                            data=zip_file,
+                            file_name=f"lifelens_analysis_reports_{analyses[0].analyzed_at[:10]}.zip",
+                            mime="application/zip",
+                            use_container_width=True
+                        )
+        
+        from thumbnails import get_thumbnail, PREVIEW
+        
+        shown = st.session_state.get('insights_analyses_shown', ANALYSES_PAGE_SIZE)
+        
+        for i, analysis in enumerate(analyses[:shown]):
+            analysis_data = analysis.analysis_data
             
-            with st.expander(f"🔬 Analysis #{i+1}: {analysis['filename']} - {analysis['analyzed_at'][:19]}"):
+            with st.expander(f"🔬 Analysis #{i+1}: {analysis.filename} - {analysis.analyzed_at[:19]}"):
+                
+                # Scan preview from the stored thumbnail, never the full-resolution scan
+                preview = get_thumbnail(analysis.file_path, PREVIEW)
+                if preview:
+                    st.image(preview, width=256)
                 
                 # Basic info
                 col1, col2, col3 = st.columns(3)
                 
                 with col1:
-                    st.write(f"**Scan Type:** {analysis_data.get('scan_type', 'Unknown')}")
-                    st.write(f"**Image Quality:** {analysis_data.get('image_quality', 'Unknown')}")
+                    st.write(f"**Scan Type:** {analysis_data.scan_type}")
+                    st.write(f"**Image Quality:** {analysis_data.image_quality}")
                 
                 with col2:
-                    risk_level = analysis.get('risk_level', 'Unknown')
+                    risk_level = analysis.risk_level
                     if risk_level == 'low':
                         st.success(f"**Risk Level:** {risk_level.upper()}")
                     elif risk_level == 'moderate':
@@ -172,44 +196,66 @@ def show_page():
                         st.error(f"**Risk Level:** {risk_level.upper()}")
                 
                 with col3:
-                    confidence = analysis.get('confidence_score', 0)
-                    st.metric("AI Confidence", f"{confidence}%")
+                    st.metric("AI Confidence", f"{analysis.confidence_score}%")
                 
                 # Key findings
                 st.markdown("##### 🔍 Key Findings")
-                for finding in analysis_data.get('key_findings', []):
+                for finding in analysis_data.key_findings:
                     st.write(f"• {finding}")
                 
                 # Potential concerns
-                if analysis_data.get('potential_concerns'):
+                if analysis_data.potential_concerns:
                     st.markdown("##### ⚠️ Potential Concerns")
-                    for concern in analysis_data['potential_concerns']:
+                    for concern in analysis_data.potential_concerns:
                         st.warning(f"⚠️ {concern}")
                 
                 # Kidney indicators
-                if analysis_data.get('kidney_indicators'):
+                if analysis_data.kidney_indicators:
                     st.markdown("##### 🫘 Kidney Indicators")
-                    indicators = analysis_data['kidney_indicators']
+                    indicators = analysis_data.kidney_indicators
                     
                     col1, col2, col3 = st.columns(3)
                     
                     with col1:
-                        st.write(f"**Size:** {indicators.get('size', 'N/A')}")
+                        st.write(f"**Size:** {indicators.size}")
                     with col2:
-                        st.write(f"**Structure:** {indicators.get('structure', 'N/A')}")
+                        st.write(f"**Structure:** {indicators.structure}")
                     with col3:
-                        st.write(f"**Abnormalities:** {indicators.get('abnormalities', 'None detected')}")
+                        st.write(f"**Abnormalities:** {indicators.abnormalities}")
                 
                 # Recommendations
-                if analysis_data.get('recommendations'):
+                if analysis_data.recommendations:
                     st.markdown("##### 💡 Recommendations")
-                    for rec in analysis_data['recommendations']:
+                    for rec in analysis_data.recommendations:
                         st.info(f"→ {rec}")
                 
                 # Disclaimer
-                if analysis_data.get('disclaimer'):
+                if analysis_data.disclaimer:
                     st.markdown("##### ⚕️ Medical Disclaimer")
-                    st.caption(analysis_data['disclaimer'])
+                    st.caption(analysis_data.disclaimer)
+                
+                # Per-analysis PDF report with scan thumbnail and charts
+                if st.button("📄 Analysis Report (PDF)", key=f"analysis_pdf_{analysis.id}"):
+                    with st.spinner("Generating analysis report..."):
+                        from pdf_generator import generate_analysis_report_pdf, analysis_report_filename, spooled_pdf
+                        
+                        with spooled_pdf(generate_analysis_report_pdf, analysis, demographics,
+                                         include_images=True, history=analyses) as pdf_file:
+                            if pdf_file is None:
+                                st.warning("⏳ Too many reports are being generated right now. Please try again shortly.")
+                            else:
+                                st.download_button(
+                                    label="📥 Download Analysis Report",
+                                    data=pdf_file,
+                                    file_name=analysis_report_filename(analysis),
+                                    mime="application/pdf",
+                                    key=f"analysis_pdf_download_{analysis.id}"
+                                )
+        
+        if len(analyses) > shown:
+            if st.button(f"Show more ({len(analyses) - shown} older)", key="insights_analyses_more"):
+                st.session_state.insights_analyses_shown = shown + ANALYSES_PAGE_SIZE
+                st.rerun()
     
     else:
         st.info("📭 No AI analyses available yet. Upload and analyze medical scans to see insights here!")
@@ -1,5 +1,6 @@
 import streamlit as st
 from database import get_all_user_analyses, get_user_demographics
+from analysis_records import average_confidence
 from health_charts import (
     create_risk_level_timeline,
     create_confidence_score_chart,
@@ -36,20 +37,20 @@ def show_page():
         st.metric("Total Scans", len(analyses))
     
     with col2:
-        latest_risk = analyses[0].get('risk_level', 'Unknown')
+        latest_risk = analyses[0].risk_level
         risk_icon = "🟢" if latest_risk == 'low' else ("🟡" if latest_risk == 'moderate' else "🔴")
         st.metric("Latest Risk", f"{risk_icon} {latest_risk.title()}")
     
     with col3:
-        avg_confidence = sum([a.get('confidence_score', 0) for a in analyses]) / len(analyses)
+        avg_confidence = average_confidence(analyses)
         st.metric("Avg Confidence", f"{int(avg_confidence)}%")
     
     with col4:
         # Calculate trend (improving, stable, declining)
         if len(analyses) >= 2:
             risk_map = {'low': 1, 'moderate': 2, 'high': 3}
-            latest_risk_val = risk_map.get(analyses[0].get('risk_level', 'moderate'), 2)
-            prev_risk_val = risk_map.get(analyses[1].get('risk_level', 'moderate'), 2)
+            latest_risk_val = risk_map.get(analyses[0].risk_level, 2)
+            prev_risk_val = risk_map.get(analyses[1].risk_level, 2)
             
             if latest_risk_val < prev_risk_val:
                 trend = "📈 Improving"
@@ -135,14 +136,14 @@ def show_page():
         comparison_data = []
         
         for i, analysis in enumerate(analyses[:5]):  # Show last 5
-            analysis_data = analysis.get('analysis_data', {})
+            analysis_data = analysis.analysis_data
             comparison_data.append({
-                'Date': analysis['analyzed_at'][:10],
-                'Risk Level': analysis.get('risk_level', 'Unknown').title(),
-                'Confidence': f"{analysis.get('confidence_score', 0)}%",
-                'Scan Type': analysis_data.get('scan_type', 'Unknown'),
-                'Image Quality': analysis_data.get('image_quality', 'Unknown').title(),
-                'Concerns': len(analysis_data.get('potential_concerns', []))
+                'Date': analysis.analyzed_at[:10],
+                'Risk Level': analysis.risk_level.title(),
+                'Confidence': f"{analysis.confidence_score}%",
+                'Scan Type': analysis_data.scan_type,
+                'Image Quality': analysis_data.image_quality.title(),
+                'Concerns': len(analysis_data.potential_concerns)
             })
         
         import pandas as pd
@@ -156,72 +157,47 @@ def show_page():
     col1, col2 = st.columns(2)
     
     with col1:
-        # Export as CSV
-        import pandas as pd
-        import datetime
-        
-        export_data = []
-        for analysis in analyses:
-            analysis_data = analysis.get('analysis_data', {})
-            export_data.append({
-                'Date': analysis['analyzed_at'][:19],
-                'Filename': analysis.get('filename', 'Unknown'),
-                'Risk Level': analysis.get('risk_level', 'Unknown'),
-                'Confidence': analysis.get('confidence_score', 0),
-                'Scan Type': analysis_data.get('scan_type', 'Unknown'),
-                'Image Quality': analysis_data.get('image_quality', 'Unknown'),
-                'Key Findings': '; '.join(analysis_data.get('key_findings', [])),
-                'Concerns': '; '.join(analysis_data.get('potential_concerns', []))
-            })
-        
-        df_export = pd.DataFrame(export_data)
-        csv = df_export.to_csv(index=False)
+        # Export analysis history on demand (CSV, NDJSON or Parquet)
+        from utils import show_data_export
         
-        st.download_button(
-            label="📊 Download Data (CSV)",
-            data=csv,
-            file_name=f"lifelens_health_data_{datetime.datetime.now().strftime('%Y%m%d')}.csv",
-            mime="text/csv",
-            use_container_width=True
-        )
+        show_data_export(st.session_state.username, ['analyses'], key="health_export")
     
     with col2:
         # Export comprehensive PDF report
+        import datetime
+        
         if st.button("📄 Generate PDF Report", use_container_width=True):
             with st.spinner("Generating comprehensive PDF report..."):
-                from pdf_generator import generate_comprehensive_health_report
-                from ai_analyzer import generate_health_insights
-                
+                from pdf_generator import generate_comprehensive_health_report, spooled_pdf
+                from ai_analyzer import generate_health_insights, build_analysis_summaries
+                from database import save_health_insights
+
                 # Generate insights for the report
-                analysis_summaries = []
-                for analysis in analyses:
-                    analysis_summaries.append({
-                        'date': analysis.get('analyzed_at'),
-                        'risk_level': analysis.get('risk_level'),
-                        'confidence': analysis.get('confidence_score'),
-                        'key_findings': analysis['analysis_data'].get('key_findings', []),
-                        'concerns': analysis['analysis_data'].get('potential_concerns', [])
-                    })
-                
+                analysis_summaries = build_analysis_summaries(analyses)
+
                 insights = generate_health_insights(demographics, analysis_summaries) if demographics else None
-                
-                # Generate PDF
-                pdf_bytes = generate_comprehensive_health_report(
+                if insights:
+                    save_health_insights(st.session_state.username, insights)
+
+                # Generate PDF into a temporary file rather than an in-memory buffer
+                with spooled_pdf(
+                    generate_comprehensive_health_report,
                     st.session_state.username,
                     demographics,
                     analyses,
                     insights
-                )
-                
-                if pdf_bytes:
-                    st.download_button(
-                        label="📥 Download PDF Report",
-                        data=pdf_bytes,
-                        file_name=f"lifelens_health_report_{datetime.datetime.now().strftime('%Y%m%d')}.pdf",
-                        mime="application/pdf",
-                        use_container_width=True
-                    )
-                    st.success("✅ PDF report generated successfully!")
+                ) as pdf_file:
+                    if pdf_file is None:
+                        st.warning("⏳ Too many reports are being generated right now. Please try again shortly.")
+                    else:
+                        st.download_button(
+                            label="📥 Download PDF Report",
+                            data=pdf_file,
+                            file_name=f"lifelens_health_report_{datetime.datetime.now().strftime('%Y%m%d')}.pdf",
+                            mime="application/pdf",
+                            use_container_width=True
+                        )
+                        st.success("✅ PDF report generated successfully!")
     
     # Health tips
     st.markdown("---")
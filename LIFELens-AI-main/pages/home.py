@@ -98,19 +98,21 @@ def show_page():
     st.subheader("📈 Recent Activity")
     
     # Import here to avoid circular imports
-    from database import get_user_uploads
+    from database import count_events, get_latest_upload
     
-    recent_uploads = get_user_uploads(st.session_state.username)
+    # Single COUNT and LIMIT 1 lookups instead of loading the full history
+    upload_count = count_events(st.session_state.username, 'upload')
     
-    if recent_uploads:
-        st.success(f"You have {len(recent_uploads)} uploaded scans. Visit the Reports page to view them.")
+    if upload_count:
+        st.success(f"You have {upload_count} uploaded scans. Visit the Reports page to view them.")
         
         # Show most recent upload
-        latest_upload = recent_uploads[0]
-        with st.expander("Latest Upload"):
-            st.write(f"**Filename:** {latest_upload['filename']}")
-            st.write(f"**Upload Date:** {latest_upload['upload_date']}")
-            st.write(f"**Status:** {latest_upload['analysis_status'].title()}")
+        latest_upload = get_latest_upload(st.session_state.username)
+        if latest_upload:
+            with st.expander("Latest Upload"):
+                st.write(f"**Filename:** {latest_upload['filename']}")
+                st.write(f"**Upload Date:** {latest_upload['upload_date']}")
+                st.write(f"**Status:** {latest_upload['analysis_status'].title()}")
     else:
         st.info("No uploads yet. Start by uploading your first medical scan!")
     
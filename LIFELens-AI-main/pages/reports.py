@@ -1,38 +1,54 @@
 import streamlit as st
-from database import get_user_reports, get_user_uploads
-import datetime
+from database import (get_report_page, get_report_type_counts, get_upload_summary, get_recent_events,
+                      get_upload_status_page, count_events)
+from data_cache import invalidate_user, get_cache_stats
+from utils import show_data_export
+
+REPORT_PAGE_SIZE = 10
+UPLOAD_STATUS_PAGE_SIZE = 20
 
 def show_page():
     """Display the reports page"""
     st.title("📊 Health Reports")
     st.subheader("View and download your health reports and analysis results")
     
-    # Get user reports and uploads
-    reports = get_user_reports(st.session_state.username)
-    uploads = get_user_uploads(st.session_state.username)
+    # Counts come from grouped queries; report and upload rows are read a page at a time
+    report_types = get_report_type_counts(st.session_state.username)
+    upload_summary = get_upload_summary(st.session_state.username)
+    report_count = sum(report_types.values())
+    upload_count = sum(upload_summary['by_type'].values())
     
     # Summary statistics
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        st.metric("Total Reports", len(reports))
+        st.metric("Total Reports", report_count)
     
     with col2:
-        st.metric("Total Uploads", len(uploads))
+        st.metric("Total Uploads", upload_count)
     
     with col3:
-        pending_analysis = len([u for u in uploads if u['analysis_status'] == 'pending'])
-        st.metric("Pending Analysis", pending_analysis)
+        st.metric("Pending Analysis", upload_summary['pending'])
     
     # Reports section
     st.markdown("---")
     st.markdown("### 📋 Generated Reports")
     
-    if reports:
-        # Sort reports by date (newest first)
-        sorted_reports = sorted(reports, key=lambda x: x['generated_at'], reverse=True)
+    if report_count:
+        total_report_pages = -(-report_count // REPORT_PAGE_SIZE)
+        report_page_number = 1
+        if total_report_pages > 1:
+            report_page_number = st.number_input("Page", min_value=1, max_value=total_report_pages, value=1,
+                                                 key="report_page")
+        
+        # Newest first; only this page's reports are read and rendered
+        report_page = get_report_page(
+            st.session_state.username,
+            limit=REPORT_PAGE_SIZE,
+            offset=(report_page_number - 1) * REPORT_PAGE_SIZE
+        )
         
-        for i, report in enumerate(sorted_reports):
+        for report in report_page:
             with st.expander(f"📄 {report['report_type']} - {report['generated_at'][:19]}"):
                 
                 # Report metadata
@@ -59,6 +75,9 @@ def show_page():
                     mime="text/markdown",
                     key=f"download_report_{report['id']}"
                 )
+        
+        if total_report_pages > 1:
+            st.caption(f"Page {report_page_number} of {total_report_pages}")
     
     else:
         st.info("📭 No reports generated yet. Upload medical scans to generate your first report!")
@@ -67,11 +86,30 @@ def show_page():
     st.markdown("---")
     st.markdown("### 📤 Upload History & Analysis Status")
     
-    if uploads:
-        # Create a table-like view
-        for i, upload in enumerate(uploads):
+    if upload_count:
+        # Paginated, with report counts joined in the database by upload_id
+        total_pages = max(1, -(-count_events(st.session_state.username, 'upload') // UPLOAD_STATUS_PAGE_SIZE))
+        page_number = 1
+        if total_pages > 1:
+            page_number = st.number_input("Page", min_value=1, max_value=total_pages, value=1,
+                                          key="upload_status_page")
+        
+        upload_page = get_upload_status_page(
+            st.session_state.username,
+            limit=UPLOAD_STATUS_PAGE_SIZE,
+            offset=(page_number - 1) * UPLOAD_STATUS_PAGE_SIZE
+        )
+        
+        from thumbnails import get_thumbnail
+        
+        for upload in upload_page:
             with st.container():
-                col1, col2, col3, col4 = st.columns([3, 2, 2, 1])
+                thumb_col, col1, col2, col3, col4 = st.columns([1, 3, 2, 2, 1])
+                
+                with thumb_col:
+                    thumbnail = get_thumbnail(upload['file_path']) if upload['file_type'] in ('image', 'dicom') else None
+                    if thumbnail:
+                        st.image(thumbnail, width=96)
                 
                 with col1:
                     st.write(f"**{upload['filename']}**")
@@ -86,21 +124,23 @@ def show_page():
                     if status == 'pending':
                         st.warning("⏳ Pending Analysis")
                     elif status == 'completed':
-                        st.success("✅ Analysis Complete")
+                        risk = upload['latest_risk_level']
+                        st.success(f"✅ Analysis Complete ({risk.title()} Risk)" if risk else "✅ Analysis Complete")
                     elif status == 'processing':
                         st.info("🔄 Processing")
                     else:
                         st.info(f"Status: {status.title()}")
                 
                 with col4:
-                    # Find related reports
-                    related_reports = [r for r in reports if r['filename'] == upload['filename']]
-                    if related_reports:
-                        st.success(f"📊 {len(related_reports)} Report(s)")
+                    if upload['report_count']:
+                        st.success(f"📊 {upload['report_count']} Report(s)")
                     else:
                         st.info("No reports")
                 
                 st.divider()
+        
+        if total_pages > 1:
+            st.caption(f"Page {page_number} of {total_pages}")
     
     else:
         st.info("📭 No uploads found. Visit the Upload & Analyze page to upload your first scan!")
@@ -109,7 +149,7 @@ def show_page():
     st.markdown("---")
     st.markdown("### 📈 Health Trends")
     
-    if uploads and reports:
+    if upload_count and report_count:
         st.info("""
         🔮 **Coming Soon: Health Trends Analysis**
         
@@ -124,37 +164,17 @@ def show_page():
         # Simple timeline visualization
         st.markdown("#### 📅 Activity Timeline")
         
-        # Combine uploads and reports for timeline
-        timeline_items = []
-        
-        for upload in uploads:
-            timeline_items.append({
-                'date': upload['upload_date'][:10],
-                'type': 'Upload',
-                'description': f"Uploaded {upload['filename']}",
-                'icon': '📤'
-            })
+        # Latest activity comes straight from the indexed event log
+        event_icons = {'upload': '📤', 'report': '📊', 'analysis': '🤖', 'demographics': '👤'}
         
-        for report in reports:
-            timeline_items.append({
-                'date': report['generated_at'][:10],
-                'type': 'Report',
-                'description': f"Generated {report['report_type']}",
-                'icon': '📊'
-            })
-        
-        # Sort by date
-        timeline_items.sort(key=lambda x: x['date'], reverse=True)
-        
-        # Display timeline
-        for item in timeline_items[:10]:  # Show last 10 activities
+        for event in get_recent_events(st.session_state.username, limit=10):
             col1, col2 = st.columns([1, 4])
             
             with col1:
-                st.write(item['date'])
+                st.write(event['created_at'][:10])
             
             with col2:
-                st.write(f"{item['icon']} {item['description']}")
+                st.write(f"{event_icons.get(event['event_type'], '📌')} {event['description']}")
     
     else:
         st.info("Upload scans and generate reports to see your health trends!")
@@ -163,61 +183,14 @@ def show_page():
     st.markdown("---")
     st.markdown("### 📦 Export All Data")
     
-    if reports or uploads:
-        # Generate comprehensive export
-        export_data = f"""
-LIFELens-AI Data Export
-User: {st.session_state.username}
-Export Date: {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-
-=== UPLOAD SUMMARY ===
-Total Uploads: {len(uploads)}
-
-"""
-        
-        for upload in uploads:
-            export_data += f"""
-Upload ID: {upload['id']}
-Filename: {upload['filename']}
-Type: {upload['file_type']}
-Date: {upload['upload_date']}
-Status: {upload['analysis_status']}
----
-"""
-        
-        export_data += f"""
-
-=== REPORTS SUMMARY ===
-Total Reports: {len(reports)}
-
-"""
-        
-        for report in reports:
-            export_data += f"""
-Report ID: {report['id']}
-Type: {report['report_type']}
-Generated: {report['generated_at']}
-Related File: {report['filename']}
-
-Content:
-{report['report_content']}
-
----
-"""
-        
-        st.download_button(
-            label="📦 Export All Data",
-            data=export_data,
-            file_name=f"lifelens_export_{st.session_state.username.split('@')[0]}_{datetime.datetime.now().strftime('%Y%m%d')}.txt",
-            mime="text/plain",
-            use_container_width=True
-        )
+    if report_count or upload_count:
+        show_data_export(st.session_state.username, ['uploads', 'reports', 'analyses'], key="reports_export")
     
     else:
         st.info("No data available for export yet.")
     
     # Analytics summary
-    if reports and uploads:
+    if report_count and upload_count:
         st.markdown("---")
         st.markdown("### 🔍 Quick Analytics")
         
@@ -228,23 +201,13 @@ Content:
             st.markdown("#### 📊 Upload Analytics")
             
             # File type distribution
-            file_types = {}
-            for upload in uploads:
-                file_type = upload['file_type']
-                file_types[file_type] = file_types.get(file_type, 0) + 1
-            
-            for file_type, count in file_types.items():
+            for file_type, count in upload_summary['by_type'].items():
                 st.write(f"• {file_type.title()}: {count} files")
         
         with col2:
             st.markdown("#### 📈 Report Analytics")
             
             # Report type distribution
-            report_types = {}
-            for report in reports:
-                report_type = report['report_type']
-                report_types[report_type] = report_types.get(report_type, 0) + 1
-            
             for report_type, count in report_types.items():
                 st.write(f"• {report_type}: {count} reports")
     
@@ -260,9 +223,17 @@ Content:
     
     with col2:
         if st.button("🧹 Clear Cache", use_container_width=True):
-            # Clear any cached data
+            # Purge this user's cached page data so the next render reloads it
+            invalidate_user(st.session_state.username)
             st.success("Cache cleared successfully!")
     
+    cache_stats = get_cache_stats(st.session_state.username)
+    st.caption(
+        f"Data cache: {cache_stats['user_entries']} entries for your account · "
+        f"{cache_stats['hits']} hits / {cache_stats['misses']} misses "
+        f"({cache_stats['hit_rate']:.0%} hit rate)"
+    )
+    
     # Footer information
     st.markdown("---")
     st.info("""
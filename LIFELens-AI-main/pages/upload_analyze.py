@@ -3,6 +3,9 @@ from utils import save_uploaded_file, get_file_type, format_file_size
 from database import save_upload, get_user_uploads
 import os
 
+# Upload history shows this many entries at first, and this many more per "Show more"
+HISTORY_PAGE_SIZE = 10
+
 def show_page():
     """Display the upload and analyze page"""
     st.title("📤 Upload & Analyze Medical Scans")
@@ -11,10 +14,18 @@ def show_page():
     # Upload section
     st.markdown("### 📁 Upload New Scan")
     
+    # DICOM is offered only when pydicom is installed
+    from dicom_ingest import dicom_supported
+    file_types = ['png', 'jpg', 'jpeg', 'pdf', 'bmp', 'gif']
+    formats = "PNG, JPG, JPEG, PDF, BMP, GIF"
+    if dicom_supported():
+        file_types.append('dcm')
+        formats += ", DICOM (.dcm)"
+    
     uploaded_file = st.file_uploader(
         "Choose a medical scan file",
-        type=['png', 'jpg', 'jpeg', 'pdf', 'bmp', 'gif'],
-        help="Supported formats: PNG, JPG, JPEG, PDF, BMP, GIF"
+        type=file_types,
+        help=f"Supported formats: {formats}"
     )
     
     if uploaded_file is not None:
@@ -37,23 +48,55 @@ def show_page():
                 # Save file to disk
                 file_path, filename = save_uploaded_file(uploaded_file, st.session_state.username)
                 
+                file_type = get_file_type(filename) if filename else None
+                quality = None
+                dicom_header = None
+                
+                # DICOM study metadata comes from the header; pixel data is read later, frame by frame
+                if file_path and file_type == 'dicom':
+                    from dicom_ingest import read_header
+                    try:
+                        dicom_header = read_header(file_path)
+                    except Exception as e:
+                        os.remove(file_path)
+                        st.error(f"❌ Couldn't read the DICOM file: {str(e)}")
+                        file_path = None
+                
+                # Check image quality locally before the scan can be sent for paid analysis
+                if file_path and file_type in ('image', 'dicom'):
+                    from image_quality import assess_image
+                    quality = assess_image(file_path)
+                    if quality is None or quality['verdict'] == 'reject':
+                        os.remove(file_path)
+                        issues = quality['issues'] if quality else ["the file could not be read as an image"]
+                        st.error(f"❌ This scan can't be analyzed: {'; '.join(issues)}. Please upload a clearer image.")
+                        file_path = None
+                
                 if file_path and filename:
                     # Save upload information to database
-                    file_type = get_file_type(filename)
                     upload_id = save_upload(
                         st.session_state.username,
                         filename,
                         file_path,
-                        file_type
+                        file_type,
+                        quality,
+                        dicom_header
                     )
                     
                     if upload_id:
+                        if file_type in ('image', 'dicom'):
+                            # Thumbnails are made once, off the request path, for the history pages
+                            from thumbnails import schedule_thumbnails
+                            schedule_thumbnails(file_path)
+                        
                         st.success(f"✅ File '{uploaded_file.name}' uploaded successfully!")
+                        if quality and quality['verdict'] == 'warn':
+                            st.warning(f"⚠️ Image quality: {'; '.join(quality['issues'])}. Analysis may be less reliable.")
                         st.info("🔄 File has been saved and is ready for analysis. AI analysis features will be available in future updates.")
                         
                         # Generate a simple report
                         from database import save_report, get_user_demographics
-                        from utils import generate_report_content
+                        from report_templates import UPLOAD_REPORT_TEMPLATE, build_upload_report_params
                         
                         demographics = get_user_demographics(st.session_state.username)
                         upload_info = {
@@ -62,12 +105,13 @@ def show_page():
                             'upload_date': 'Just now'
                         }
                         
-                        report_content = generate_report_content(demographics, upload_info)
+                        # Stored as template parameters; rendered when the report is read
                         report_id = save_report(
                             st.session_state.username,
                             upload_id,
                             "Upload Report",
-                            report_content
+                            template_id=UPLOAD_REPORT_TEMPLATE,
+                            template_params=build_upload_report_params(demographics, upload_info)
                         )
                         
                         if report_id:
@@ -89,32 +133,62 @@ def show_page():
     # Display upload history
     st.markdown("### 📚 Upload History")
     
-    uploads = get_user_uploads(st.session_state.username)
+    # DICOM studies can be filtered by modality and body part
+    from database import get_user_study_types
+    study_types = get_user_study_types(st.session_state.username)
+    study_filter = (None, None)
+    if study_types:
+        labels = {"All uploads": (None, None)}
+        for modality, body_part in study_types:
+            labels[f"{modality} {body_part or ''}".strip()] = (modality, body_part)
+        study_filter = labels[st.selectbox("Show", list(labels), key="upload_study_filter")]
+    
+    uploads = get_user_uploads(st.session_state.username, *study_filter)
     
     if uploads:
+        from thumbnails import get_thumbnail
+        
         st.write(f"You have **{len(uploads)}** uploaded files:")
         
-        for i, upload in enumerate(uploads):
+        # Only the shown entries render their thumbnails; more are loaded on request
+        shown = st.session_state.get('upload_history_shown', HISTORY_PAGE_SIZE)
+        
+        for i, upload in enumerate(uploads[:shown]):
             with st.expander(f"📄 {upload['filename']} - {upload['upload_date'][:19]}"):
-                col1, col2 = st.columns(2)
+                thumb_col, col1, col2 = st.columns([1, 2, 2])
+                
+                with thumb_col:
+                    if upload['file_type'] in ('image', 'dicom'):
+                        thumbnail = get_thumbnail(upload['file_path'])
+                        if thumbnail:
+                            st.image(thumbnail, width=128)
+                        else:
+                            st.caption("🖼️ Preview is being prepared")
                 
                 with col1:
                     st.write(f"**File ID:** {upload['id']}")
                     st.write(f"**Filename:** {upload['filename']}")
                     st.write(f"**File Type:** {upload['file_type'].title()}")
+                    if upload['modality']:
+                        st.write(f"**Study:** {upload['modality']} {upload['body_part'] or ''}")
                 
                 with col2:
                     st.write(f"**Upload Date:** {upload['upload_date'][:19]}")
                     st.write(f"**Analysis Status:** {upload['analysis_status'].title()}")
+                    if upload['quality_verdict'] in ('warn', 'reject'):
+                        st.write(f"**Image Quality:** {'; '.join(upload['quality_issues'])}")
                 
                 # Action buttons
                 button_col1, button_col2, button_col3 = st.columns(3)
                 
                 with button_col1:
-                    if st.button(f"🔍 Analyze", key=f"analyze_{upload['id']}"):
+                    if upload['quality_verdict'] == 'reject':
+                        st.button(f"🔍 Analyze", key=f"analyze_{upload['id']}", disabled=True,
+                                  help="Image quality is too low for analysis")
+                    elif st.button(f"🔍 Analyze", key=f"analyze_{upload['id']}"):
                         # Import AI analyzer
-                        from ai_analyzer import analyze_kidney_scan
-                        from database import get_ai_analysis, save_ai_analysis, get_user_demographics
+                        from ai_analyzer import analyze_upload
+                        from database import get_ai_analysis, get_user_demographics
                         
                         # Check if already analyzed
                         existing_analysis = get_ai_analysis(upload['id'])
@@ -127,38 +201,24 @@ def show_page():
                                 demographics = get_user_demographics(st.session_state.username)
                                 
                                 # Find the file path
-                                from database import get_connection
-                                conn = get_connection()
+                                from database import get_user_connection
+                                conn = get_user_connection(st.session_state.username)
                                 cursor = conn.cursor()
                                 cursor.execute("SELECT file_path FROM uploads WHERE id = ?", (upload['id'],))
                                 result = cursor.fetchone()
                                 conn.close()
                                 
                                 if result:
-                                    file_path = result[0]
-                                    
-                                    # Perform AI analysis
-                                    analysis_result = analyze_kidney_scan(file_path, demographics)
+                                    # Analyze and save; concurrent clicks or tabs share one analysis
+                                    outcome = analyze_upload(upload['id'], st.session_state.username, result[0], demographics)
                                     
-                                    if analysis_result['success']:
-                                        analysis_data = analysis_result['analysis']
-                                        
-                                        # Save analysis to database
-                                        analysis_id = save_ai_analysis(
-                                            upload['id'],
-                                            st.session_state.username,
-                                            analysis_data,
-                                            risk_level=analysis_data.get('risk_level'),
-                                            confidence_score=analysis_data.get('confidence_score')
-                                        )
-                                        
-                                        if analysis_id:
-                                            st.success("✅ AI Analysis completed successfully!")
-                                            st.rerun()
-                                        else:
-                                            st.error("Failed to save analysis results")
+                                    if outcome['existing']:
+                                        st.success("✅ Scan already analyzed! View results in the Reports section.")
+                                    elif outcome['analysis_id']:
+                                        st.success("✅ AI Analysis completed successfully!")
+                                        st.rerun()
                                     else:
-                                        st.error(f"Analysis failed: {analysis_result['error']}")
+                                        st.error(outcome['error'])
                                 else:
                                     st.error("File not found")
                 
@@ -171,9 +231,16 @@ def show_page():
                     if st.button(f"🗑️ Delete", key=f"delete_{upload['id']}", type="secondary"):
                         st.warning("Delete functionality will be implemented in future updates.")
         
+        if len(uploads) > shown:
+            if st.button(f"Show more ({len(uploads) - shown} older)", key="upload_history_more"):
+                st.session_state.upload_history_shown = shown + HISTORY_PAGE_SIZE
+                st.rerun()
+        
     else:
         st.info("📭 No files uploaded yet. Upload your first medical scan to get started!")
     
+    show_studies(uploads)
+    
     # Information about AI analysis
     st.markdown("---")
     st.markdown("### 🤖 About AI Analysis")
@@ -202,7 +269,7 @@ def show_page():
         "📏 **Size:** Maximum file size is 10MB per upload",
         "🏥 **Source:** Only upload scans from certified medical facilities",
         "🔒 **Privacy:** All uploads are securely encrypted and stored",
-        "📱 **Format:** Supported formats: PNG, JPG, JPEG, PDF, BMP, GIF",
+        "📱 **Format:** Supported formats: PNG, JPG, JPEG, PDF, BMP, GIF, DICOM",
         "⚠️ **Important:** This platform supplements, not replaces, professional medical advice"
     ]
     
@@ -216,3 +283,60 @@ def show_page():
     This platform is for monitoring and educational purposes only. 
     In case of medical emergencies, contact your healthcare provider immediately or call emergency services.
     """)
+
+def show_studies(uploads):
+    """Group uploads from one exam into a study and analyze them together"""
+    from database import get_user_studies, create_study, get_study_analysis
+    
+    st.markdown("---")
+    st.markdown("### 🗂️ Studies")
+    st.caption("Views from the same exam are analyzed together in one request, "
+               "giving a result for each image and a combined assessment.")
+    
+    studies = get_user_studies(st.session_state.username)
+    
+    image_uploads = {f"{upload['filename']} (#{upload['id']})": upload['id'] for upload in uploads
+                     if upload['file_type'] in ('image', 'dicom') and upload['quality_verdict'] != 'reject'}
+    if len(image_uploads) >= 2:
+        with st.expander("➕ New study"):
+            title = st.text_input("Study name", key="new_study_title", placeholder="e.g. Renal ultrasound, March")
+            selected = st.multiselect("Images from this exam", list(image_uploads), key="new_study_uploads")
+            if st.button("Create Study", key="create_study"):
+                if not title or len(selected) < 2:
+                    st.error("Enter a name and select at least two images")
+                elif create_study(st.session_state.username, title, [image_uploads[label] for label in selected]):
+                    st.success("✅ Study created")
+                    st.rerun()
+                else:
+                    st.error("❌ Error creating study")
+    
+    if not studies:
+        st.info("No studies yet. DICOM files from the same exam are grouped automatically.")
+        return
+    
+    for study in studies:
+        label = f"🗂️ {study['title']} - {study['upload_count']} images"
+        if study['risk_level']:
+            label += f" - {study['risk_level'].title()} risk"
+        with st.expander(label):
+            study_analysis = get_study_analysis(study['id'], st.session_state.username) if study['risk_level'] else None
+            if study_analysis:
+                analysis = study_analysis['analysis']
+                st.write(f"**Combined Risk Level:** {analysis.risk_level or 'unknown'}")
+                st.write(f"**Confidence:** {analysis.confidence_score or 0}%")
+                for finding in analysis.key_findings:
+                    st.write(f"- {finding}")
+            
+            if st.button("🔍 Analyze Study", key=f"analyze_study_{study['id']}"):
+                from ai_analyzer import analyze_study
+                from database import get_user_demographics
+                
+                with st.spinner("🔄 Analyzing all images of the study..."):
+                    demographics = get_user_demographics(st.session_state.username)
+                    outcome = analyze_study(study['id'], st.session_state.username, demographics)
+                
+                if outcome['study_analysis_id']:
+                    st.success("✅ Study analysis completed!")
+                    st.rerun()
+                else:
+                    st.error(outcome['error'])
@@ -1,23 +1,71 @@
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Table, TableStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Table, TableStyle, Image
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_JUSTIFY
 from datetime import datetime
+from contextlib import contextmanager
 import io
+import os
+import tempfile
+import threading
 
-def generate_comprehensive_health_report(user_email, demographics, analyses, insights=None):
+# Limit on reports being built at the same time across all sessions
+MAX_CONCURRENT_PDF_GENERATIONS = int(os.getenv("LIFELENS_MAX_CONCURRENT_PDFS", "2"))
+PDF_GENERATION_WAIT_SECONDS = float(os.getenv("LIFELENS_PDF_WAIT_SECONDS", "30"))
+
+_generation_slots = threading.BoundedSemaphore(MAX_CONCURRENT_PDF_GENERATIONS)
+
+def _build_document(doc, elements, buffer):
+    """Build the document and return its bytes if it was built in memory"""
+    doc.build(elements)
+
+    if buffer is None:
+        return None
+
+    # Get PDF bytes
+    pdf_bytes = buffer.getvalue()
+    buffer.close()
+
+    return pdf_bytes
+
+@contextmanager
+def spooled_pdf(build_report, *args, **kwargs):
+    """
+    Build a PDF (or PDF bundle) straight into a temporary file and yield it
+    opened for reading. Yields None if the concurrent generation limit stays
+    exhausted.
+    """
+    if not _generation_slots.acquire(timeout=PDF_GENERATION_WAIT_SECONDS):
+        yield None
+        return
+
+    fd, path = tempfile.mkstemp(prefix="lifelens_")
+    try:
+        try:
+            with os.fdopen(fd, "wb") as pdf_out:
+                build_report(*args, output=pdf_out, **kwargs)
+        finally:
+            _generation_slots.release()
+
+        with open(path, "rb") as pdf_file:
+            yield pdf_file
+    finally:
+        os.remove(path)
+
+def generate_comprehensive_health_report(user_email, demographics, analyses, insights=None, output=None):
     """
     Generate comprehensive PDF health report
-    Returns bytes buffer of the PDF
+    Returns bytes of the PDF, or writes it to output (a path or binary
+    file object) when given and returns None
     """
     
-    # Create PDF buffer
-    buffer = io.BytesIO()
+    # Create PDF buffer unless writing straight to the output
+    buffer = io.BytesIO() if output is None else None
     
     # Create PDF document
-    doc = SimpleDocTemplate(buffer, pagesize=letter,
+    doc = SimpleDocTemplate(buffer if output is None else output, pagesize=letter,
                            rightMargin=72, leftMargin=72,
                            topMargin=72, bottomMargin=18)
     
@@ -107,48 +155,48 @@ def generate_comprehensive_health_report(user_email, demographics, analyses, ins
         
         # Latest analysis
         latest = analyses[0]
-        elements.append(Paragraph(f"<b>Latest Analysis ({latest['analyzed_at'][:19]})</b>", styles['Normal']))
+        elements.append(Paragraph(f"<b>Latest Analysis ({latest.analyzed_at[:19]})</b>", styles['Normal']))
         elements.append(Spacer(1, 6))
         
-        analysis_data = latest.get('analysis_data', {})
+        analysis_data = latest.analysis_data
         
         # Risk level with color
-        risk_level = latest.get('risk_level', 'Unknown').upper()
+        risk_level = latest.risk_level.upper()
         risk_color = 'green' if risk_level == 'LOW' else ('orange' if risk_level == 'MODERATE' else 'red')
         elements.append(Paragraph(f"Risk Level: <font color='{risk_color}'><b>{risk_level}</b></font>", styles['Normal']))
-        elements.append(Paragraph(f"AI Confidence: <b>{latest.get('confidence_score', 0)}%</b>", styles['Normal']))
-        elements.append(Paragraph(f"Scan Type: <b>{analysis_data.get('scan_type', 'Unknown')}</b>", styles['Normal']))
-        elements.append(Paragraph(f"Image Quality: <b>{analysis_data.get('image_quality', 'Unknown')}</b>", styles['Normal']))
+        elements.append(Paragraph(f"AI Confidence: <b>{latest.confidence_score}%</b>", styles['Normal']))
+        elements.append(Paragraph(f"Scan Type: <b>{analysis_data.scan_type}</b>", styles['Normal']))
+        elements.append(Paragraph(f"Image Quality: <b>{analysis_data.image_quality}</b>", styles['Normal']))
         
         elements.append(Spacer(1, 12))
         
         # Key findings
-        if analysis_data.get('key_findings'):
+        if analysis_data.key_findings:
             elements.append(Paragraph("<b>Key Findings:</b>", styles['Normal']))
-            for finding in analysis_data['key_findings']:
+            for finding in analysis_data.key_findings:
                 elements.append(Paragraph(f"• {finding}", styles['Normal']))
             elements.append(Spacer(1, 12))
         
         # Potential concerns
-        if analysis_data.get('potential_concerns'):
+        if analysis_data.potential_concerns:
             elements.append(Paragraph("<b>Potential Concerns:</b>", styles['Normal']))
-            for concern in analysis_data['potential_concerns']:
+            for concern in analysis_data.potential_concerns:
                 elements.append(Paragraph(f"⚠️ {concern}", styles['Normal']))
             elements.append(Spacer(1, 12))
         
         # Kidney indicators
-        if analysis_data.get('kidney_indicators'):
+        if analysis_data.kidney_indicators:
             elements.append(Paragraph("<b>Kidney Health Indicators:</b>", styles['Normal']))
-            indicators = analysis_data['kidney_indicators']
-            elements.append(Paragraph(f"• Size: {indicators.get('size', 'N/A')}", styles['Normal']))
-            elements.append(Paragraph(f"• Structure: {indicators.get('structure', 'N/A')}", styles['Normal']))
-            elements.append(Paragraph(f"• Abnormalities: {indicators.get('abnormalities', 'None detected')}", styles['Normal']))
+            indicators = analysis_data.kidney_indicators
+            elements.append(Paragraph(f"• Size: {indicators.size}", styles['Normal']))
+            elements.append(Paragraph(f"• Structure: {indicators.structure}", styles['Normal']))
+            elements.append(Paragraph(f"• Abnormalities: {indicators.abnormalities}", styles['Normal']))
             elements.append(Spacer(1, 12))
         
         # Recommendations
-        if analysis_data.get('recommendations'):
+        if analysis_data.recommendations:
             elements.append(Paragraph("<b>Recommendations:</b>", styles['Normal']))
-            for rec in analysis_data['recommendations']:
+            for rec in analysis_data.recommendations:
                 elements.append(Paragraph(f"→ {rec}", styles['Normal']))
     else:
         elements.append(Paragraph("No AI analyses available.", styles['Normal']))
@@ -213,19 +261,41 @@ def generate_comprehensive_health_report(user_email, demographics, analyses, ins
                                           fontSize=8, textColor=colors.grey, alignment=TA_CENTER)))
     
     # Build PDF
-    doc.build(elements)
-    
-    # Get PDF bytes
-    pdf_bytes = buffer.getvalue()
-    buffer.close()
-    
-    return pdf_bytes
+    return _build_document(doc, elements, buffer)
+
+def render_history_chart_images(history):
+    """Render the history charts (risk timeline, confidence) shared by every per-analysis report"""
+    from health_charts import create_risk_level_timeline, create_confidence_score_chart
+    from image_cache import get_chart_image
+
+    if not history or len(history) < 2:
+        return []
+    figures = [create_risk_level_timeline(history), create_confidence_score_chart(history)]
+    return [os.path.abspath(path) for path in (get_chart_image(fig) for fig in figures) if path]
 
-def generate_analysis_report_pdf(analysis, demographics=None):
-    """Generate PDF report for a single analysis"""
+def render_analysis_chart_images(analysis, history=None, history_charts=None):
+    """
+    Render the chart images used by a per-analysis report
+    history_charts are the paths from render_history_chart_images when the
+    caller already has them; otherwise they are rendered from history
+    """
+    from health_charts import create_health_metrics_comparison
+    from image_cache import get_chart_image
+
+    if history_charts is None:
+        history_charts = render_history_chart_images(history)
+    path = get_chart_image(create_health_metrics_comparison([analysis]))
+    return ([path] if path else []) + list(history_charts)
+
+def generate_analysis_report_pdf(analysis, demographics=None, output=None, include_images=False, history=None,
+                                 history_charts=None):
+    """
+    Generate PDF report for a single analysis
+    With include_images, the scan thumbnail and chart renderings are embedded
+    """
     
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    buffer = io.BytesIO() if output is None else None
+    doc = SimpleDocTemplate(buffer if output is None else output, pagesize=letter)
     elements = []
     styles = getSampleStyleSheet()
     
@@ -234,27 +304,92 @@ def generate_analysis_report_pdf(analysis, demographics=None):
     elements.append(Spacer(1, 12))
     
     # Analysis details
-    analysis_data = analysis.get('analysis_data', {})
+    analysis_data = analysis.analysis_data
     
-    elements.append(Paragraph(f"Analysis Date: {analysis['analyzed_at'][:19]}", styles['Normal']))
-    elements.append(Paragraph(f"File: {analysis.get('filename', 'Unknown')}", styles['Normal']))
+    elements.append(Paragraph(f"Analysis Date: {analysis.analyzed_at[:19]}", styles['Normal']))
+    elements.append(Paragraph(f"File: {analysis.filename or 'Unknown'}", styles['Normal']))
     elements.append(Spacer(1, 12))
     
+    # Scan thumbnail
+    if include_images:
+        from thumbnails import ensure_thumbnail
+        
+        thumbnail = ensure_thumbnail(analysis.file_path)
+        if thumbnail:
+            elements.append(Image(io.BytesIO(thumbnail), width=3 * inch, height=3 * inch, kind='proportional'))
+            elements.append(Spacer(1, 12))
+    
     # Key information
-    elements.append(Paragraph(f"Risk Level: {analysis.get('risk_level', 'Unknown').upper()}", styles['Heading2']))
-    elements.append(Paragraph(f"Confidence Score: {analysis.get('confidence_score', 0)}%", styles['Normal']))
+    elements.append(Paragraph(f"Risk Level: {analysis.risk_level.upper()}", styles['Heading2']))
+    elements.append(Paragraph(f"Confidence Score: {analysis.confidence_score}%", styles['Normal']))
     elements.append(Spacer(1, 12))
     
     # Findings
-    if analysis_data.get('key_findings'):
+    if analysis_data.key_findings:
         elements.append(Paragraph("Key Findings:", styles['Heading3']))
-        for finding in analysis_data['key_findings']:
+        for finding in analysis_data.key_findings:
             elements.append(Paragraph(f"• {finding}", styles['Normal']))
         elements.append(Spacer(1, 12))
     
+    # Charts
+    if include_images:
+        chart_paths = render_analysis_chart_images(analysis, history, history_charts)
+        if chart_paths:
+            elements.append(Paragraph("Charts:", styles['Heading3']))
+            for chart_path in chart_paths:
+                elements.append(Image(chart_path, width=6 * inch, height=3.5 * inch, kind='proportional'))
+                elements.append(Spacer(1, 12))
+    
     # Build and return
-    doc.build(elements)
-    pdf_bytes = buffer.getvalue()
+    return _build_document(doc, elements, buffer)
+
+def analysis_report_filename(analysis):
+    """File name for a single analysis report"""
+    return f"lifelens_analysis_{analysis.id}_{analysis.analyzed_at[:10]}.pdf"
+
+def _write_analysis_report(analysis, demographics, history_charts, out_dir):
+    """Build one analysis report into a directory (runs in a worker process)"""
+    path = os.path.join(out_dir, analysis_report_filename(analysis))
+    generate_analysis_report_pdf(analysis, demographics, output=path, include_images=True,
+                                 history_charts=history_charts)
+    return path
+
+def export_all_analysis_reports(analyses, demographics=None, output=None, max_workers=None):
+    """
+    Build a report for every analysis in parallel and bundle them in a ZIP
+    Returns the ZIP bytes, or writes it to output when given and returns None
+    """
+    import zipfile
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    
+    # The history charts are the same in every report: rendered once here,
+    # and workers get their paths instead of the whole history
+    history_charts = render_history_chart_images(analyses)
+    
+    buffer = io.BytesIO() if output is None else None
+    # The bundle holds one generation slot, so it uses no more processes than
+    # the concurrent report limit allows
+    max_workers = max_workers or min(len(analyses), os.cpu_count() or 1, MAX_CONCURRENT_PDF_GENERATIONS) or 1
+    
+    with tempfile.TemporaryDirectory(prefix="lifelens_export_") as out_dir:
+        # Spawn rather than fork so workers don't inherit the web server's threads
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [
+                executor.submit(_write_analysis_report, analysis, demographics, history_charts, out_dir)
+                for analysis in analyses
+            ]
+            paths = [future.result() for future in futures]
+        
+        with zipfile.ZipFile(buffer if output is None else output, "w", zipfile.ZIP_DEFLATED) as archive:
+            for path in paths:
+                archive.write(path, os.path.basename(path))
+    
+    if buffer is None:
+        return None
+    
+    zip_bytes = buffer.getvalue()
     buffer.close()
     
-    return pdf_bytes
+    return zip_bytes
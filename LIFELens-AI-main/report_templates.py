@@ -0,0 +1,252 @@
+"""
+Template-based report storage.
+
+Reports are stored as a template ID plus a compact JSON parameter record and
+rendered to markdown on read. The boilerplate lives here once instead of in
+every row of the reports table.
+
+Usage (migrate existing rows):
+    python report_templates.py migrate [--db lifelens_ai.db] [--vacuum]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from functools import lru_cache
+
+UPLOAD_REPORT_TEMPLATE = "upload_report_v1"
+RENDER_CACHE_SIZE = int(os.getenv("LIFELENS_REPORT_RENDER_CACHE", "1024"))
+
+DEMOGRAPHIC_FIELDS = ('age', 'gender', 'weight', 'height', 'daily_water_intake')
+UPLOAD_FIELDS = ('filename', 'file_type', 'upload_date')
+
+RECOMMENDATIONS_BLOCK = """
+
+## Health Recommendations
+
+### Dietary Guidelines
+- Follow a kidney-friendly diet low in sodium
+- Monitor protein intake based on kidney function
+- Stay adequately hydrated
+- Limit processed foods
+
+### Lifestyle Recommendations
+- Regular exercise as tolerated
+- Monitor blood pressure regularly
+- Avoid smoking and limit alcohol
+- Get adequate sleep
+
+### Follow-up Care
+- Schedule regular check-ups with your healthcare provider
+- Monitor kidney function through lab tests
+- Keep track of symptoms and report changes
+
+---
+
+*Note: This report is for informational purposes only and should not replace professional medical advice. Always consult with your healthcare provider for personalized recommendations.*
+"""
+
+def build_upload_report_params(demographics, upload_info=None, generated_on=None):
+    """Build the parameter record for an upload report"""
+    params = {
+        'generated_on': generated_on or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'demographics': None,
+        'upload': None
+    }
+    if demographics:
+        params['demographics'] = {field: demographics.get(field, 'Not provided') for field in DEMOGRAPHIC_FIELDS}
+    if upload_info:
+        params['upload'] = {field: upload_info.get(field, 'Unknown') for field in UPLOAD_FIELDS}
+    return params
+
+def encode_params(params):
+    """Serialize a parameter record compactly and deterministically"""
+    return json.dumps(params, separators=(',', ':'), sort_keys=True)
+
+def _render_upload_report(params):
+    content = f"""
+# Health Report
+
+**Generated on:** {params['generated_on']}
+
+## Patient Information
+"""
+
+    demographics = params.get('demographics')
+    if demographics:
+        content += f"""
+- **Age:** {demographics.get('age')}
+- **Gender:** {demographics.get('gender')}
+- **Weight:** {demographics.get('weight')} kg
+- **Height:** {demographics.get('height')} cm
+- **Daily Water Intake:** {demographics.get('daily_water_intake')} glasses
+"""
+
+        from diet_generator import calculate_bmi, get_bmi_category
+        weight = demographics.get('weight')
+        height = demographics.get('height')
+        if weight and height:
+            bmi = calculate_bmi(weight, height)
+            if bmi:
+                content += f"- **BMI:** {bmi} ({get_bmi_category(bmi)})\n"
+
+    upload = params.get('upload')
+    if upload:
+        content += f"""
+
+## Uploaded Scan Information
+- **Filename:** {upload.get('filename')}
+- **File Type:** {upload.get('file_type')}
+- **Upload Date:** {upload.get('upload_date')}
+"""
+
+    return content + RECOMMENDATIONS_BLOCK
+
+TEMPLATES = {
+    UPLOAD_REPORT_TEMPLATE: _render_upload_report,
+}
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render_report(template_id, template_params):
+    """Render a stored report; template_params is the stored JSON string"""
+    return TEMPLATES[template_id](json.loads(template_params))
+
+def _parse_value(text):
+    """Recover a stored demographic value from its rendered text"""
+    if text == 'None':
+        return None
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+def _between(content, start, end):
+    begin = content.index(start) + len(start)
+    return content[begin:content.index(end, begin)]
+
+def parse_upload_report(content):
+    """
+    Recover parameters from a legacy upload report
+    Returns None unless the parameters re-render to exactly the same text
+    """
+    try:
+        params = {
+            'generated_on': _between(content, "**Generated on:** ", "\n"),
+            'demographics': None,
+            'upload': None
+        }
+
+        if "- **Age:** " in content:
+            params['demographics'] = {
+                'age': _parse_value(_between(content, "- **Age:** ", "\n")),
+                'gender': _parse_value(_between(content, "- **Gender:** ", "\n")),
+                'weight': _parse_value(_between(content, "- **Weight:** ", " kg\n")),
+                'height': _parse_value(_between(content, "- **Height:** ", " cm\n")),
+                'daily_water_intake': _parse_value(_between(content, "- **Daily Water Intake:** ", " glasses\n"))
+            }
+
+        if "## Uploaded Scan Information" in content:
+            params['upload'] = {
+                'filename': _between(content, "- **Filename:** ", "\n"),
+                'file_type': _between(content, "- **File Type:** ", "\n"),
+                'upload_date': _between(content, "- **Upload Date:** ", "\n")
+            }
+    except ValueError:
+        return None
+
+    if _render_upload_report(params) != content:
+        return None
+    return params
+
+def migrate_report_rows(batch_size=500):
+    """
+    Convert stored report bodies to template references
+    Rows whose text cannot be reproduced exactly are left untouched
+    """
+    import database
+
+    stats = {'migrated': 0, 'skipped': 0, 'bytes_before': 0, 'bytes_after': 0}
+
+    for db_path in database.shard_paths():
+        conn = database.get_connection(db_path)
+        cursor = conn.cursor()
+        last_id = 0
+
+        while True:
+            cursor.execute('''
+                SELECT id, user_email, report_content FROM reports
+                WHERE id > ? AND template_id IS NULL AND report_content IS NOT NULL
+                ORDER BY id LIMIT ?
+            ''', (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for report_id, user_email, content in rows:
+                last_id = report_id
+                content = database._decode_column(content)
+                params = parse_upload_report(content)
+                if params is None:
+                    stats['skipped'] += 1
+                    continue
+                encoded = encode_params(params)
+                updates.append((UPLOAD_REPORT_TEMPLATE, encoded, report_id))
+                stats['migrated'] += 1
+                stats['bytes_before'] += len(content.encode('utf-8'))
+                stats['bytes_after'] += len(encoded.encode('utf-8'))
+
+            cursor.executemany('''
+                UPDATE reports SET template_id = ?, template_params = ?, report_content = NULL
+                WHERE id = ?
+            ''', updates)
+            conn.commit()
+
+        conn.close()
+
+    from data_cache import clear_cache
+    clear_cache()
+    return stats
+
+def vacuum_database():
+    """Rebuild the database files so freed pages are returned to the filesystem"""
+    import database
+
+    for db_path in database.database_files():
+        conn = database.get_connection(db_path)
+        conn.execute("VACUUM")
+        conn.close()
+
+def main(argv=None):
+    import database
+
+    parser = argparse.ArgumentParser(description="Report template storage maintenance")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--db", default=database.DB_PATH, help="Path to the database file")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM afterwards to shrink the file")
+    args = parser.parse_args(argv)
+
+    database.DB_PATH = args.db
+    database.init_database()
+
+    size_before = database.get_backend().storage_size()
+    started = time.perf_counter()
+    stats = migrate_report_rows()
+    if args.vacuum:
+        vacuum_database()
+    elapsed = time.perf_counter() - started
+    size_after = database.get_backend().storage_size()
+
+    print(f"Migrated: {stats['migrated']}  Left as stored text: {stats['skipped']}  ({elapsed:.1f}s)")
+    print(f"Report bodies: {stats['bytes_before'] / 1024:.1f} KB -> {stats['bytes_after'] / 1024:.1f} KB")
+    print(f"Database file: {size_before / 1024:.1f} KB -> {size_after / 1024:.1f} KB")
+    if not args.vacuum:
+        print("Run with --vacuum to return freed pages to the filesystem")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Move per-user data to a new set of shard files.
+
+Works from a single database file (the first split) or from the current
+shards. Rows of the per-user tables are copied to N new shard files by a
+hash of user_email, keeping their IDs; each new shard allocates new IDs from
+its own range above every existing ID. The users table and other shared
+tables stay in the main file.
+
+Writers are held off with a write lock on the source files while rows are
+copied; the new shard map is then swapped in atomically, and running
+processes switch over on their next query. Writes to the old per-user
+tables are refused from then on, so a write that was waiting on the lock
+fails instead of landing in a file that is no longer read. Stopping the app
+for the move is still the simplest option.
+
+Usage:
+    python reshard.py --shards 8 [--keep-old] [--db lifelens_ai.db]
+    python reshard.py --status [--db lifelens_ai.db]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import database
+import snapshot
+
+BATCH_ROWS = 1000
+
+def _shard_file_names(shard_count, generation):
+    stem = os.path.splitext(os.path.basename(database.DB_PATH))[0]
+    return [f"{stem}.g{generation}.s{index}.db" for index in range(shard_count)]
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+def _max_id(sources):
+    highest = 0
+    for conn in sources:
+        for table in database.USER_TABLES:
+            if 'id' in _columns(conn, table):
+                highest = max(highest, conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0])
+    return highest
+
+def _write_map(shard_map):
+    path = database.shard_map_path()
+    with open(path + '.tmp', 'w') as f:
+        json.dump(shard_map, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def _refuse_writes(conn):
+    """Make writes to the per-user tables of a replaced file fail"""
+    for table in database.USER_TABLES:
+        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_moved_{operation.lower()}
+                BEFORE {operation} ON {table}
+                BEGIN SELECT RAISE(ABORT, 'per-user data has moved to shards'); END
+            ''')
+
+def reshard(shard_count, keep_old=False):
+    """Copy per-user rows to shard_count new shards and switch to them; returns rows copied per table"""
+    backend = database.get_backend()
+    source_paths = backend.shard_paths()
+    generation = backend.generation + 1 if backend.sharded else 1
+    directory = os.path.dirname(os.path.abspath(database.DB_PATH))
+    names = _shard_file_names(shard_count, generation)
+    target_paths = [os.path.join(directory, name) for name in names]
+
+    # Left over from an interrupted run, never referenced by a shard map
+    for path in target_paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+    sources = [database.get_connection(path) for path in source_paths]
+    targets = []
+    try:
+        # Hold off writers so no row is written to a source after it's copied
+        for conn in sources:
+            conn.execute("BEGIN IMMEDIATE")
+
+        id_base = (_max_id(sources) // database.SHARD_ID_RANGE + 1) * database.SHARD_ID_RANGE
+        for index, path in enumerate(target_paths):
+            database._create_schema(path, shared=False)
+            database.seed_id_range(path, id_base + index * database.SHARD_ID_RANGE)
+            targets.append(database.get_connection(path))
+
+        copied = {}
+        for table in database.USER_TABLES:
+            expected = 0
+            for conn in sources:
+                columns = _columns(conn, table)
+                user_column = columns.index('user_email')
+                insert = (f"INSERT INTO {table} ({', '.join(columns)}) "
+                          f"VALUES ({', '.join('?' for _ in columns)})")
+                expected += conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+                cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table}")
+                while True:
+                    rows = cursor.fetchmany(BATCH_ROWS)
+                    if not rows:
+                        break
+                    batches = {}
+                    for row in rows:
+                        batches.setdefault(database.shard_index(row[user_column], shard_count), []).append(row)
+                    for index, batch in batches.items():
+                        targets[index].executemany(insert, batch)
+
+            for target in targets:
+                target.commit()
+            copied[table] = sum(target.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for target in targets)
+            if copied[table] != expected:
+                raise RuntimeError(f"{table}: copied {copied[table]} of {expected} rows")
+
+        _write_map({'generation': generation, 'id_base': id_base, 'shards': names})
+
+        for conn in sources:
+            # Per-user rows left in the main file are no longer read
+            if not keep_old and not backend.sharded:
+                for table in database.USER_TABLES:
+                    conn.execute(f"DELETE FROM {table}")
+            _refuse_writes(conn)
+            conn.commit()
+    finally:
+        for conn in sources + targets:
+            conn.close()
+
+    if not keep_old and backend.sharded:
+        for path in source_paths:
+            os.remove(path)
+    # Dashboard snapshots of the old layout are no longer read
+    for path in source_paths:
+        if os.path.exists(snapshot.snapshot_path(path)):
+            os.remove(snapshot.snapshot_path(path))
+
+    from data_cache import clear_cache
+    clear_cache()
+    return copied
+
+def shard_status():
+    """(file, rows per per-user table) for each database file holding per-user data"""
+    status = []
+    for path in database.shard_paths():
+        conn = database.get_connection(path)
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ('demographics', 'uploads', 'ai_analysis', 'reports')}
+        conn.close()
+        status.append((os.path.basename(path), counts))
+    return status
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split per-user data across shard files")
+    parser.add_argument("--shards", type=int, help="Number of shards to move to")
+    parser.add_argument("--keep-old", action="store_true",
+                        help="Keep the previous shards (or the per-user rows in the main file) afterwards")
+    parser.add_argument("--status", action="store_true", help="Show the current layout")
+    parser.add_argument("--db", default=database.DB_PATH, help="Path to the main database file")
+    args = parser.parse_args(argv)
+
+    database.DB_PATH = args.db
+    if database.DATABASE_URL:
+        print("Sharding applies to SQLite storage; LIFELENS_DATABASE_URL points at PostgreSQL")
+        return 1
+    database.init_database()
+
+    if args.shards:
+        if args.shards < 1:
+            print("--shards must be at least 1")
+            return 1
+        started = time.perf_counter()
+        copied = reshard(args.shards, args.keep_old)
+        print(f"Moved to {args.shards} shards in {time.perf_counter() - started:.1f}s")
+        for table, count in copied.items():
+            print(f"  {table}: {count} rows")
+    elif not args.status:
+        parser.print_usage()
+        return 1
+
+    backend = database.get_backend()
+    print(f"Layout: {'generation ' + str(backend.generation) + ' shards' if backend.sharded else 'single file'}")
+    for name, counts in shard_status():
+        print(f"  {name}: " + ", ".join(f"{table} {count}" for table, count in counts.items()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Local rule engine for the demographics-only kidney risk assessment.
+
+Produces the same JSON structure as the model-based assessment, plus a
+confidence score that drops when demographics are missing, so the model
+cascade knows when to escalate.
+"""
+from diet_generator import calculate_bmi
+
+# Medical history keywords and the risk points they add
+HISTORY_RISK_FACTORS = {
+    'diabetes': (3, "Diabetes is a leading cause of chronic kidney disease"),
+    'hypertension': (3, "High blood pressure damages kidney blood vessels"),
+    'high blood pressure': (3, "High blood pressure damages kidney blood vessels"),
+    'kidney': (3, "Previous kidney problems"),
+    'renal': (3, "Previous kidney problems"),
+    'heart': (2, "Heart disease is associated with reduced kidney function"),
+    'family history': (2, "Family history of kidney disease"),
+    'smok': (1, "Smoking reduces blood flow to the kidneys"),
+    'stone': (1, "History of kidney stones"),
+    'nsaid': (1, "Regular NSAID use can strain the kidneys"),
+}
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def assess_risk_with_rules(demographics):
+    """Rule-based risk assessment; returns the assessment dict with a 'confidence' (0-100)"""
+    points = 0
+    risk_factors = []
+    protective_factors = []
+    missing = 0
+
+    age = _number(demographics.get('age'))
+    if age is None:
+        missing += 1
+    elif age >= 60:
+        points += 2
+        risk_factors.append("Age over 60 (kidney function naturally declines with age)")
+    elif age < 40:
+        protective_factors.append("Younger age")
+
+    weight = _number(demographics.get('weight'))
+    height = _number(demographics.get('height'))
+    bmi = calculate_bmi(weight, height) if weight and height else None
+    if bmi is None:
+        missing += 1
+    elif bmi >= 30:
+        points += 2
+        risk_factors.append(f"BMI of {bmi} (obesity increases kidney disease risk)")
+    elif bmi >= 25:
+        points += 1
+        risk_factors.append(f"BMI of {bmi} (overweight)")
+    elif bmi >= 18.5:
+        protective_factors.append(f"Healthy BMI of {bmi}")
+
+    water = _number(demographics.get('daily_water_intake'))
+    if water is None:
+        missing += 1
+    elif water < 6:
+        points += 1
+        risk_factors.append("Low daily water intake")
+    else:
+        protective_factors.append("Adequate daily hydration")
+
+    history = (demographics.get('medical_history') or '').lower()
+    seen = set()
+    for keyword, (weight_points, description) in HISTORY_RISK_FACTORS.items():
+        if keyword in history and description not in seen:
+            seen.add(description)
+            points += weight_points
+            risk_factors.append(description)
+
+    if points >= 5:
+        risk_level = 'high'
+    elif points >= 2:
+        risk_level = 'moderate'
+    else:
+        risk_level = 'low'
+
+    # Free-text history the keywords don't cover is where rules are weakest
+    confidence = 90 - 15 * missing
+    if history.strip() and not seen:
+        confidence -= 20
+
+    recommendations = ["Drink water regularly throughout the day",
+                       "Keep sodium intake low and limit processed foods"]
+    if bmi and bmi >= 25:
+        recommendations.append("Work towards a healthy weight with regular activity")
+    if seen:
+        recommendations.append("Have kidney function (eGFR, urine albumin) checked at least yearly")
+
+    return {
+        'risk_level': risk_level,
+        'risk_factors': risk_factors,
+        'protective_factors': protective_factors,
+        'personalized_recommendations': recommendations,
+        'warning_signs_to_watch': ["Swelling in legs, ankles or face", "Changes in urination",
+                                   "Persistent fatigue", "Foamy urine"],
+        'preventive_measures': ["Monitor blood pressure regularly", "Avoid overuse of painkillers",
+                                "Don't smoke"],
+        'confidence': max(confidence, 0)
+    }
@@ -0,0 +1,342 @@
+"""
+Server-side login sessions shared by every app replica.
+
+A login creates a session record in the store and hands the browser a
+signed token in the lifelens_session cookie (SameSite=Strict, never in the
+URL, so it doesn't leak through history, bookmarks, shared links or Referer
+headers). When a browser connects, any replica checks the signature,
+looks the session up and logs the browser in, so a load balancer doesn't
+need sticky sessions and a restart doesn't log anyone out.
+
+Streamlit can't set HttpOnly cookies, so page scripts can read the cookie.
+Its token is therefore single-use: each time a browser connects with it, it
+is exchanged for a new one (exchange_session) and stops working
+ROTATION_GRACE_SECONDS later. A copied token lets someone in only until the
+owner's next visit, and the owner is logged out if someone else used it
+first. Sessions expire after LIFELENS_SESSION_IDLE_TTL seconds without use
+(sliding; the expiry is pushed back at most once a minute) and
+LIFELENS_SESSION_MAX_AGE seconds after login, whichever comes first.
+
+Only a hash of the session ID is stored, so a copy of the database doesn't
+yield usable tokens. Tokens are signed with a key derived from
+LIFELENS_SESSION_SECRET (or SESSION_SECRET); all replicas need the same one.
+
+Stores: 'database' (the sessions table) and 'memory' (in-process, for a
+single process or tests). LIFELENS_SESSION_STORE also accepts
+'module:ClassName' for another key-value store implementing SessionStore.
+Without it the database store is used when a secret is set, else the memory
+store with a per-process key (a single local process, e.g. development).
+"""
+import base64
+import hashlib
+import hmac
+import importlib
+import os
+import secrets
+import threading
+import time
+
+IDLE_TTL_SECONDS = float(os.getenv("LIFELENS_SESSION_IDLE_TTL", "1800"))
+MAX_AGE_SECONDS = float(os.getenv("LIFELENS_SESSION_MAX_AGE", str(7 * 24 * 3600)))
+STORE = os.getenv("LIFELENS_SESSION_STORE")
+# Sliding expiry is written at most this often per session
+TOUCH_INTERVAL_SECONDS = 60
+PURGE_INTERVAL_SECONDS = 600
+# How long an exchanged cookie token keeps working, for tabs opened together;
+# shorter than TOUCH_INTERVAL_SECONDS, so using it doesn't extend it
+ROTATION_GRACE_SECONDS = 30
+COOKIE_NAME = "lifelens_session"
+
+_lock = threading.Lock()
+_store = None
+_signing_key = None
+_last_purge = 0.0
+
+class SessionStore:
+    """
+    Key-value storage for session records: {'user_email', 'created_at',
+    'last_seen', 'expires_at'} keyed by the hash of the session ID
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def put(self, key, record):
+        raise NotImplementedError
+
+    def touch(self, key, last_seen, expires_at):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def delete_user(self, user_email):
+        raise NotImplementedError
+
+    def purge(self, now):
+        """Remove expired records"""
+        raise NotImplementedError
+
+class DatabaseSessionStore(SessionStore):
+    """Sessions in the sessions table of the main database (SQLite or PostgreSQL)"""
+
+    def get(self, key):
+        import database
+
+        conn = database.get_connection()
+        row = conn.execute('''
+            SELECT user_email, created_at, last_seen, expires_at FROM sessions WHERE token_hash = ?
+        ''', (key,)).fetchone()
+        conn.close()
+        if not row:
+            return None
+        return {'user_email': row[0], 'created_at': row[1], 'last_seen': row[2], 'expires_at': row[3]}
+
+    def put(self, key, record):
+        import database
+
+        conn = database.get_connection()
+        conn.execute('''
+            INSERT INTO sessions (token_hash, user_email, created_at, last_seen, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (key, record['user_email'], record['created_at'], record['last_seen'], record['expires_at']))
+        conn.commit()
+        conn.close()
+
+    def touch(self, key, last_seen, expires_at):
+        import database
+
+        conn = database.get_connection()
+        conn.execute("UPDATE sessions SET last_seen = ?, expires_at = ? WHERE token_hash = ?",
+                     (last_seen, expires_at, key))
+        conn.commit()
+        conn.close()
+
+    def delete(self, key):
+        import database
+
+        conn = database.get_connection()
+        conn.execute("DELETE FROM sessions WHERE token_hash = ?", (key,))
+        conn.commit()
+        conn.close()
+
+    def delete_user(self, user_email):
+        import database
+
+        conn = database.get_connection()
+        conn.execute("DELETE FROM sessions WHERE user_email = ?", (user_email,))
+        conn.commit()
+        conn.close()
+
+    def purge(self, now):
+        import database
+
+        conn = database.get_connection()
+        conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+        conn.commit()
+        conn.close()
+
+class MemorySessionStore(SessionStore):
+    """Sessions in this process only; other replicas and restarts don't see them"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = {}
+
+    def get(self, key):
+        with self._lock:
+            record = self._records.get(key)
+            return dict(record) if record else None
+
+    def put(self, key, record):
+        with self._lock:
+            self._records[key] = dict(record)
+
+    def touch(self, key, last_seen, expires_at):
+        with self._lock:
+            if key in self._records:
+                self._records[key].update(last_seen=last_seen, expires_at=expires_at)
+
+    def delete(self, key):
+        with self._lock:
+            self._records.pop(key, None)
+
+    def delete_user(self, user_email):
+        with self._lock:
+            for key in [key for key, record in self._records.items() if record['user_email'] == user_email]:
+                del self._records[key]
+
+    def purge(self, now):
+        with self._lock:
+            for key in [key for key, record in self._records.items() if record['expires_at'] <= now]:
+                del self._records[key]
+
+def get_store():
+    """The configured session store (created on first use)"""
+    global _store
+
+    with _lock:
+        if _store is None:
+            name = STORE
+            if not name:
+                name = 'database' if _secret() else 'memory'
+                if name == 'memory':
+                    print("Warning: no LIFELENS_SESSION_SECRET set; logins are kept by this process only")
+            if name == 'database':
+                _store = DatabaseSessionStore()
+            elif name == 'memory':
+                _store = MemorySessionStore()
+            else:
+                module_name, _, class_name = name.partition(':')
+                _store = getattr(importlib.import_module(module_name), class_name)()
+        return _store
+
+def set_store(store):
+    """Use a specific store instance (e.g. an in-process one in tests)"""
+    global _store
+    with _lock:
+        _store = store
+
+def _secret():
+    return os.getenv("LIFELENS_SESSION_SECRET") or os.getenv("SESSION_SECRET")
+
+def _key():
+    global _signing_key
+
+    if _signing_key is None:
+        secret = _secret()
+        if not secret:
+            # A per-process key would make every other replica reject the tokens
+            if not isinstance(get_store(), MemorySessionStore):
+                raise RuntimeError("LIFELENS_SESSION_SECRET must be set for a session store other than 'memory'")
+            secret = secrets.token_hex(32)
+        # A separate key, so the secret isn't used directly for two purposes
+        key = hmac.new(secret.encode('utf-8'), b"lifelens-session-token", hashlib.sha256).digest()
+        with _lock:
+            if _signing_key is None:
+                _signing_key = key
+    return _signing_key
+
+def check_config():
+    """
+    Raise RuntimeError at startup, rather than at the first login, if tokens
+    can't be signed (a shared store was configured without a secret)
+    """
+    _key()
+
+def _sign(session_id):
+    digest = hmac.new(_key(), session_id.encode('ascii'), hashlib.sha256).digest()[:16]
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+def _store_key(session_id):
+    return hashlib.sha256(session_id.encode('ascii')).hexdigest()
+
+def _session_id(token):
+    """The session ID of a correctly signed token, else None"""
+    if not token or token.count('.') != 1:
+        return None
+    session_id, signature = token.split('.')
+    try:
+        if hmac.compare_digest(signature, _sign(session_id)):
+            return session_id
+    except (UnicodeEncodeError, TypeError):
+        pass
+    return None
+
+def create_session(user_email):
+    """Start a session for a user who just authenticated; returns its token"""
+    global _last_purge
+
+    now = time.time()
+    session_id = secrets.token_urlsafe(24)
+    store = get_store()
+    store.put(_store_key(session_id), {
+        'user_email': user_email,
+        'created_at': now,
+        'last_seen': now,
+        'expires_at': min(now + IDLE_TTL_SECONDS, now + MAX_AGE_SECONDS),
+    })
+
+    if now - _last_purge > PURGE_INTERVAL_SECONDS:
+        _last_purge = now
+        try:
+            store.purge(now)
+        except Exception as e:
+            print(f"Error purging expired sessions: {str(e)}")
+
+    return f"{session_id}.{_sign(session_id)}"
+
+def resume_session(token):
+    """The user email of a live session, extending its idle expiry; None if invalid, expired or ended"""
+    session_id = _session_id(token)
+    if session_id is None:
+        return None
+
+    try:
+        store = get_store()
+        key = _store_key(session_id)
+        record = store.get(key)
+        if record is None:
+            return None
+
+        now = time.time()
+        if record['expires_at'] <= now:
+            store.delete(key)
+            return None
+
+        if now - record['last_seen'] >= TOUCH_INTERVAL_SECONDS:
+            store.touch(key, now, min(now + IDLE_TTL_SECONDS, record['created_at'] + MAX_AGE_SECONDS))
+        return record['user_email']
+
+    except Exception as e:
+        print(f"Error resuming session: {str(e)}")
+        return None
+
+def exchange_session(token):
+    """
+    Resume a session from the token a browser brought when it connected
+    Returns (user_email, new_token), or (None, None) if invalid, expired or
+    ended. The old token stops working ROTATION_GRACE_SECONDS from now
+    """
+    user_email = resume_session(token)
+    if user_email is None:
+        return None, None
+
+    try:
+        store = get_store()
+        old_key = _store_key(_session_id(token))
+        record = store.get(old_key)
+        if record is None:
+            return None, None
+
+        now = time.time()
+        session_id = secrets.token_urlsafe(24)
+        store.put(_store_key(session_id), {
+            'user_email': user_email,
+            'created_at': record['created_at'],
+            'last_seen': now,
+            'expires_at': min(now + IDLE_TTL_SECONDS, record['created_at'] + MAX_AGE_SECONDS),
+        })
+        store.touch(old_key, now, min(record['expires_at'], now + ROTATION_GRACE_SECONDS))
+        return user_email, f"{session_id}.{_sign(session_id)}"
+
+    except Exception as e:
+        print(f"Error exchanging session token: {str(e)}")
+        return None, None
+
+def end_session(token):
+    """Log out one session"""
+    session_id = _session_id(token)
+    if session_id is None:
+        return
+    try:
+        get_store().delete(_store_key(session_id))
+    except Exception as e:
+        print(f"Error ending session: {str(e)}")
+
+def end_user_sessions(user_email):
+    """Log a user out everywhere (e.g. after a password reset)"""
+    try:
+        get_store().delete_user(user_email)
+    except Exception as e:
+        print(f"Error ending sessions: {str(e)}")
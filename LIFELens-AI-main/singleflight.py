@@ -0,0 +1,227 @@
+"""
+In-flight coalescing of identical AI calls.
+
+Callers with the same key share one execution. Within a process, later
+callers wait on the first caller's thread. Across processes, a lease row in
+the ai_flights table marks the call as running; the running process renews
+the lease until the call returns. Other processes poll the row and pick up
+the outcome, or take the call over if the lease expires.
+
+Outcomes are stored encrypted with the upload master key (see upload_crypto)
+and only for RESULT_TTL_SECONDS. Without a key only the completion is
+recorded: processes that were waiting then run the call themselves, and a
+failure is passed on as an error without its details.
+"""
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import database
+import upload_crypto
+
+# How long a running call holds its lease before others may take over
+LEASE_SECONDS = float(os.getenv("LIFELENS_FLIGHT_LEASE_SECONDS", "180"))
+# How long a finished result is handed to late duplicates
+RESULT_TTL_SECONDS = float(os.getenv("LIFELENS_FLIGHT_RESULT_TTL", "60"))
+# How long a caller waits for a call running in another process
+MAX_WAIT_SECONDS = float(os.getenv("LIFELENS_FLIGHT_MAX_WAIT", "600"))
+POLL_SECONDS = 0.5
+
+_lock = threading.Lock()
+_inflight = {}
+_stats = {'executed': 0, 'joined_thread': 0, 'joined_process': 0, 'takeovers': 0}
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+def flight_key(task, *parts):
+    """Stable key for a task and its JSON-serializable inputs"""
+    payload = json.dumps([task, parts], sort_keys=True, default=str)
+    return f"{task}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+def _seal(key, text):
+    sealed = upload_crypto.seal(text.encode('utf-8'), key.encode('utf-8'))
+    return base64.b64encode(sealed).decode('ascii') if sealed else None
+
+def _unseal(key, stored):
+    if not stored:
+        return None
+    try:
+        text = upload_crypto.unseal(base64.b64decode(stored), key.encode('utf-8'))
+    except Exception as e:
+        print(f"Error reading the stored result of {key}: {str(e)}")
+        return None
+    return text.decode('utf-8') if text is not None else None
+
+def _acquire(key, owner, started):
+    """
+    Try to take the lease for key
+    Returns ('owner', None), ('wait', None), ('done', result), ('failed', result)
+    or ('error', message). Failures only go to callers that started before
+    they were recorded; later callers try again
+    """
+    now = time.time()
+    conn = database.get_connection()
+    try:
+        conn.isolation_level = None
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT status, lease_expires_at, completed_at, result FROM ai_flights WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row:
+            status, lease_expires_at, completed_at, stored = row
+            if status == 'running' and lease_expires_at > now:
+                conn.execute("COMMIT")
+                return 'wait', None
+            if status == 'running':
+                with _lock:
+                    _stats['takeovers'] += 1
+            elif status == 'error' and completed_at >= started:
+                conn.execute("COMMIT")
+                return 'error', _unseal(key, stored)
+            elif status in ('done', 'failed') and completed_at > now - RESULT_TTL_SECONDS:
+                result = _unseal(key, stored)
+                if result is not None and (status == 'done' or completed_at >= started):
+                    conn.execute("COMMIT")
+                    return status, result
+
+        conn.execute('''
+            INSERT INTO ai_flights (key, owner, status, lease_expires_at, result, completed_at)
+            VALUES (?, ?, 'running', ?, NULL, NULL)
+            ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, status = 'running',
+                lease_expires_at = excluded.lease_expires_at, result = NULL, completed_at = NULL
+        ''', (key, owner, now + LEASE_SECONDS))
+        # Finished entries are only useful for RESULT_TTL_SECONDS
+        conn.execute("DELETE FROM ai_flights WHERE status != 'running' AND completed_at < ?", (now - RESULT_TTL_SECONDS,))
+        conn.execute("COMMIT")
+        return 'owner', None
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+def _renew_lease(key, owner, stop):
+    """Extend the lease every third of LEASE_SECONDS until stop is set"""
+    while not stop.wait(LEASE_SECONDS / 3):
+        try:
+            conn = database.get_connection()
+            conn.execute('''
+                UPDATE ai_flights SET lease_expires_at = ?
+                WHERE key = ? AND owner = ? AND status = 'running'
+            ''', (time.time() + LEASE_SECONDS, key, owner))
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            print(f"Error renewing the lease of {key}: {str(e)}")
+
+def _complete(key, owner, status, text):
+    conn = database.get_connection()
+    conn.execute('''
+        UPDATE ai_flights SET status = ?, result = ?, completed_at = ?
+        WHERE key = ? AND owner = ?
+    ''', (status, _seal(key, text), time.time(), key, owner))
+    conn.commit()
+    conn.close()
+
+def _release(key, owner):
+    conn = database.get_connection()
+    conn.execute("DELETE FROM ai_flights WHERE key = ? AND owner = ?", (key, owner))
+    conn.commit()
+    conn.close()
+
+def _run_across_processes(key, fn, encode, decode, share, on_join):
+    owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+    started = time.time()
+
+    while True:
+        state, stored = _acquire(key, owner, started)
+        if state == 'owner':
+            break
+        if state == 'error':
+            raise RuntimeError(f"In-flight call {key} failed in another process: {stored or 'no details stored'}")
+        if state in ('done', 'failed'):
+            with _lock:
+                _stats['joined_process'] += 1
+            result = decode(stored)
+            if on_join:
+                on_join(key, time.time() - started)
+            return result
+        if time.time() > started + MAX_WAIT_SECONDS:
+            raise TimeoutError(f"Timed out waiting for in-flight call {key}")
+        time.sleep(POLL_SECONDS)
+
+    stop = threading.Event()
+    renewal = threading.Thread(target=_renew_lease, args=(key, owner, stop), name="lifelens-flight-lease", daemon=True)
+    renewal.start()
+    try:
+        result = fn()
+    except Exception as e:
+        _complete(key, owner, 'error', str(e))
+        raise
+    except BaseException:
+        # Interrupted rather than failed: let waiters take the call over
+        _release(key, owner)
+        raise
+    finally:
+        stop.set()
+        renewal.join()
+
+    with _lock:
+        _stats['executed'] += 1
+    _complete(key, owner, 'done' if share(result) else 'failed', encode(result))
+    return result
+
+def run_once(key, fn, encode=json.dumps, decode=json.loads, share=lambda result: True, on_join=None):
+    """
+    Run fn() once for all concurrent callers with the same key
+    encode/decode convert the result to and from the text stored for other
+    processes; results for which share(result) is false (failures) are only
+    given to callers already waiting, not reused. on_join(key, seconds)
+    is called when a caller gets another caller's result instead of running fn
+    """
+    with _lock:
+        call = _inflight.get(key)
+        if call:
+            _stats['joined_thread'] += 1
+            leader = False
+        else:
+            call = _inflight[key] = _Call()
+            leader = True
+
+    if not leader:
+        started = time.time()
+        call.done.wait()
+        if call.error:
+            raise call.error
+        if on_join:
+            on_join(key, time.time() - started)
+        return call.result
+
+    try:
+        call.result = _run_across_processes(key, fn, encode, decode, share, on_join)
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+        call.done.set()
+
+def get_flight_stats():
+    """Counts of executed calls, callers that joined one, and expired-lease takeovers"""
+    with _lock:
+        stats = dict(_stats)
+        stats['in_flight'] = len(_inflight)
+        return stats
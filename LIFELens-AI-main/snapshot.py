@@ -0,0 +1,218 @@
+"""
+Read-only analytics snapshots of the SQLite database files.
+
+Dashboard reads (health tracking, AI insights, exports) go to a copy of each
+database file taken with the SQLite online backup API, so they don't hold
+read locks on the file uploads and analyses are being written to. A copy is
+used only while it is younger than the staleness bound and holds the user's
+latest event (every upload, analysis, report and demographics change logs
+one, in whichever process made it); otherwise the read goes to the live
+file. Copies are refreshed in the background ahead of the bound and swapped
+in atomically, so a dashboard read never waits for one. The database files
+are in WAL mode, so taking a copy doesn't block writers, and a lock file
+makes sure only one process copies a given file at a time.
+
+Usage (refresh now, e.g. from cron when the app isn't running):
+    python snapshot.py [--db lifelens_ai.db]
+"""
+import argparse
+import fcntl
+import os
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import quote
+
+# Oldest snapshot (seconds) dashboard reads may use; 0 sends every read to the live file
+MAX_AGE_SECONDS = float(os.getenv("LIFELENS_SNAPSHOT_MAX_AGE", "60"))
+# Snapshots are refreshed once this share of the bound has passed
+REFRESH_AT = 0.5
+
+_lock = threading.Lock()
+_refreshing = set()
+_refresher = None
+_stats = {'snapshot_reads': 0, 'live_reads': 0, 'refreshes': 0, 'refresh_skips': 0, 'refresh_errors': 0, 'last_refresh_ms': 0.0}
+
+def snapshot_path(db_path):
+    return f"{db_path}.snapshot"
+
+def _taken_at(db_path):
+    try:
+        # The file's mtime is set to the moment the copy started
+        return os.stat(snapshot_path(db_path)).st_mtime
+    except FileNotFoundError:
+        return None
+
+def snapshot_age(db_path):
+    """Seconds since the snapshot of a database file was taken, or None if there isn't one"""
+    taken_at = _taken_at(db_path)
+    return None if taken_at is None else time.time() - taken_at
+
+def refresh(db_path, if_older_than=None):
+    """
+    Copy a database file to its snapshot; returns the seconds it took
+    With if_older_than, returns None instead of copying when another process
+    is taking the copy, or has taken one within that many seconds
+    """
+    target = snapshot_path(db_path)
+    with open(f"{target}.lock", "a") as lock_file:
+        if if_older_than is None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                age = snapshot_age(db_path)
+                skip = age is not None and age <= if_older_than
+            except BlockingIOError:
+                skip = True
+            if skip:
+                with _lock:
+                    _stats['refresh_skips'] += 1
+                return None
+        return _copy(db_path, target)
+
+def _copy(db_path, target):
+    tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    started = time.time()
+
+    source = sqlite3.connect(db_path)
+    dest = sqlite3.connect(tmp_path)
+    try:
+        # One step: a consistent copy of one WAL read transaction, which
+        # writers carry on past (in steps, every write would restart it)
+        source.backup(dest)
+        # The copy is opened read-only, which a WAL-mode file can't always be
+        dest.execute("PRAGMA journal_mode=DELETE")
+        dest.close()
+        os.utime(tmp_path, (started, started))
+        # Readers with the old snapshot open keep reading it until they close
+        os.replace(tmp_path, target)
+    except Exception:
+        dest.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        source.close()
+    elapsed = time.time() - started
+
+    with _lock:
+        _stats['refreshes'] += 1
+        _stats['last_refresh_ms'] = round(elapsed * 1000, 1)
+    return elapsed
+
+def _refresh_in_background(db_path):
+    with _lock:
+        if db_path in _refreshing:
+            return
+        _refreshing.add(db_path)
+
+    def run():
+        try:
+            refresh(db_path, if_older_than=MAX_AGE_SECONDS * REFRESH_AT)
+        except Exception as e:
+            print(f"Error refreshing snapshot of {db_path}: {str(e)}")
+            with _lock:
+                _stats['refresh_errors'] += 1
+        finally:
+            with _lock:
+                _refreshing.discard(db_path)
+
+    threading.Thread(target=run, name="snapshot-refresh", daemon=True).start()
+
+def _last_event_id(path, user_email):
+    """ID of the user's newest event in a database file (0 if none)"""
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True)
+    try:
+        row = conn.execute("SELECT MAX(id) FROM events WHERE user_email = ?", (user_email,)).fetchone()
+    finally:
+        conn.close()
+    return row[0] or 0
+
+def read_path(db_path, user_email=None, fresh=False):
+    """The file a dashboard read of db_path should use: its snapshot, or db_path itself"""
+    if fresh or MAX_AGE_SECONDS <= 0:
+        return db_path
+
+    taken_at = _taken_at(db_path)
+    age = None if taken_at is None else time.time() - taken_at
+    if age is None or age > MAX_AGE_SECONDS * REFRESH_AT:
+        _refresh_in_background(db_path)
+    if age is None or age > MAX_AGE_SECONDS:
+        return db_path
+
+    # The user's writes since the snapshot was taken, from any process, must be visible
+    if user_email is not None:
+        try:
+            if _last_event_id(snapshot_path(db_path), user_email) != _last_event_id(db_path, user_email):
+                return db_path
+        except sqlite3.Error as e:
+            print(f"Error checking snapshot of {db_path}: {str(e)}")
+            return db_path
+    return snapshot_path(db_path)
+
+def connect(db_path, user_email=None, fresh=False):
+    """Connection for dashboard reads of db_path (read-only when it's the snapshot)"""
+    path = read_path(db_path, user_email, fresh)
+    with _lock:
+        _stats['snapshot_reads' if path != db_path else 'live_reads'] += 1
+    if path == db_path:
+        return sqlite3.connect(db_path)
+    return sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True)
+
+def start_background_refresh():
+    """Keep the snapshots of the current database files fresh from a daemon thread (once per process)"""
+    global _refresher
+
+    if MAX_AGE_SECONDS <= 0:
+        return None
+    with _lock:
+        if _refresher is not None:
+            return _refresher
+
+        def run():
+            import database
+
+            while True:
+                backend = database.get_backend()
+                db_paths = backend.shard_paths() if isinstance(backend, database.SQLiteBackend) else []
+                for db_path in db_paths:
+                    age = snapshot_age(db_path)
+                    if age is None or age > MAX_AGE_SECONDS * REFRESH_AT:
+                        _refresh_in_background(db_path)
+                time.sleep(max(MAX_AGE_SECONDS * REFRESH_AT / 2, 1))
+
+        _refresher = threading.Thread(target=run, name="snapshot-refresher", daemon=True)
+        _refresher.start()
+        return _refresher
+
+def get_snapshot_stats():
+    """Reads served from snapshots and live files, and refresh counts"""
+    with _lock:
+        stats = dict(_stats)
+    reads = stats['snapshot_reads'] + stats['live_reads']
+    stats['snapshot_share'] = stats['snapshot_reads'] / reads if reads else 0.0
+    return stats
+
+def main(argv=None):
+    import database
+
+    parser = argparse.ArgumentParser(description="Refresh the analytics snapshots of the database files")
+    parser.add_argument("--db", default=database.DB_PATH, help="Path to the database file")
+    args = parser.parse_args(argv)
+
+    database.DB_PATH = args.db
+    if not isinstance(database.get_backend(), database.SQLiteBackend):
+        print("Snapshots apply to SQLite storage; use a PostgreSQL read replica instead")
+        return 1
+    database.init_database()
+
+    for db_path in database.shard_paths():
+        elapsed = refresh(db_path)
+        size = os.path.getsize(snapshot_path(db_path))
+        print(f"{os.path.basename(db_path)}: {size / 1024:.1f} KB in {elapsed * 1000:.0f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
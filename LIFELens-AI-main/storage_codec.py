@@ -0,0 +1,343 @@
+"""
+Compressed storage for large text columns.
+
+ai_analysis.analysis_data and reports.report_content are stored as BLOBs
+with a small header, compressed with zstd against a dictionary trained from
+existing rows. If the zstandard package is missing, new values fall back to
+zlib with a preset dictionary of recent sample rows (zlib can't train one),
+and zstd values written elsewhere can't be read.
+Plain TEXT values written by older versions are returned unchanged, so old
+and new rows can live side by side.
+
+Header layout:
+    byte 0      format version (FORMAT_VERSION)
+    byte 1      codec (CODEC_ZLIB or CODEC_ZSTD)
+    bytes 2-5   dictionary ID, big-endian (0 = no dictionary)
+
+Usage:
+    python storage_codec.py train [--db lifelens_ai.db]
+    python storage_codec.py recompress [--db lifelens_ai.db] [--vacuum]
+    python storage_codec.py stats [--db lifelens_ai.db]
+"""
+import argparse
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMAT_VERSION = 1
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_NAMES = {CODEC_ZLIB: 'zlib', CODEC_ZSTD: 'zstd'}
+
+_HEADER = struct.Struct(">BBI")
+
+# LIFELENS_STORAGE_CODEC: zstd, zlib or none (store plain text)
+STORAGE_CODEC = os.getenv("LIFELENS_STORAGE_CODEC", "zstd" if zstandard else "zlib")
+COMPRESSION_LEVEL = int(os.getenv("LIFELENS_STORAGE_LEVEL", "6"))
+# Values shorter than this aren't worth a header
+MIN_COMPRESS_BYTES = 64
+DICT_SIZE = 16 * 1024
+# zlib only uses the last 32 KB of a preset dictionary
+ZLIB_DICT_SIZE = 32 * 1024
+# How long the newest dictionary ID is cached before checking for a new one
+ACTIVE_DICT_TTL_SECONDS = 60
+
+COMPRESSED_COLUMNS = {
+    'analysis_data': ('ai_analysis', 'analysis_data'),
+    'report_content': ('reports', 'report_content'),
+}
+
+_lock = threading.Lock()
+_dictionaries = {}
+_active = {}
+
+def _codec_id():
+    if STORAGE_CODEC == 'zstd' and zstandard:
+        return CODEC_ZSTD
+    if STORAGE_CODEC in ('zstd', 'zlib'):
+        return CODEC_ZLIB
+    return None
+
+def create_schema(cursor):
+    """Create the dictionary table"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS compression_dicts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            column_name TEXT NOT NULL,
+            codec INTEGER NOT NULL,
+            dict_data BLOB NOT NULL,
+            sample_count INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _load_dictionary(db_path, dict_id):
+    key = (db_path, dict_id)
+    with _lock:
+        if key in _dictionaries:
+            return _dictionaries[key]
+
+    conn = sqlite3.connect(db_path)
+    row = conn.execute("SELECT codec, dict_data FROM compression_dicts WHERE id = ?", (dict_id,)).fetchone()
+    conn.close()
+    if not row:
+        raise ValueError(f"Compression dictionary {dict_id} not found")
+
+    codec, data = row
+    if codec == CODEC_ZSTD:
+        if not zstandard:
+            raise RuntimeError("Reading zstd-compressed data requires the zstandard package")
+        data = zstandard.ZstdCompressionDict(data)
+
+    # Dictionaries are immutable once written
+    with _lock:
+        _dictionaries[key] = data
+    return data
+
+def _active_dictionary(db_path, column, codec):
+    """Newest dictionary ID for a column and codec, or 0"""
+    key = (db_path, column, codec)
+    now = time.monotonic()
+    with _lock:
+        entry = _active.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+
+    try:
+        conn = sqlite3.connect(db_path)
+        row = conn.execute('''
+            SELECT id FROM compression_dicts WHERE column_name = ? AND codec = ?
+            ORDER BY id DESC LIMIT 1
+        ''', (column, codec)).fetchone()
+        conn.close()
+        dict_id = row[0] if row else 0
+    except sqlite3.OperationalError:
+        dict_id = 0
+
+    with _lock:
+        _active[key] = (now + ACTIVE_DICT_TTL_SECONDS, dict_id)
+    return dict_id
+
+def compress(text, column, db_path):
+    """Encode a column value for storage; short or incompressible values stay text"""
+    codec = _codec_id()
+    if text is None or codec is None:
+        return text
+
+    raw = text.encode('utf-8')
+    if len(raw) < MIN_COMPRESS_BYTES:
+        return text
+
+    dict_id = _active_dictionary(db_path, column, codec)
+    dictionary = _load_dictionary(db_path, dict_id) if dict_id else None
+
+    if codec == CODEC_ZSTD:
+        compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, dict_data=dictionary)
+        payload = compressor.compress(raw)
+    else:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zdict=dictionary) if dictionary else zlib.compressobj(COMPRESSION_LEVEL)
+        payload = compressor.compress(raw) + compressor.flush()
+
+    encoded = _HEADER.pack(FORMAT_VERSION, codec, dict_id) + payload
+    if len(encoded) >= len(raw):
+        return text
+    return encoded
+
+def decompress(value, db_path):
+    """Decode a stored column value; plain text is returned as is"""
+    if value is None or isinstance(value, str):
+        return value
+
+    value = bytes(value)
+    version, codec, dict_id = _HEADER.unpack_from(value)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported storage format version {version}")
+
+    payload = value[_HEADER.size:]
+    dictionary = _load_dictionary(db_path, dict_id) if dict_id else None
+
+    if codec == CODEC_ZSTD:
+        if not zstandard:
+            raise RuntimeError("Reading zstd-compressed data requires the zstandard package")
+        raw = zstandard.ZstdDecompressor(dict_data=dictionary).decompress(payload)
+    elif codec == CODEC_ZLIB:
+        decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+        raw = decompressor.decompress(payload) + decompressor.flush()
+    else:
+        raise ValueError(f"Unknown storage codec {codec}")
+
+    return raw.decode('utf-8')
+
+def _sample_values(conn, db_path, column, limit):
+    table, field = COMPRESSED_COLUMNS[column]
+    rows = conn.execute(f'''
+        SELECT {field} FROM {table} WHERE {field} IS NOT NULL
+        ORDER BY id DESC LIMIT ?
+    ''', (limit,)).fetchall()
+    return [decompress(row[0], db_path).encode('utf-8') for row in rows]
+
+def _build_zlib_dictionary(samples):
+    """
+    zlib has no trainer; a preset dictionary of recent values still lets
+    short rows reference the shared keys and boilerplate
+    """
+    dictionary = b""
+    for sample in samples:
+        if len(dictionary) >= ZLIB_DICT_SIZE:
+            break
+        dictionary += sample
+    # zlib favours the end of the dictionary
+    return dictionary[-ZLIB_DICT_SIZE:]
+
+def train_dictionaries(db_path, sample_limit=2000, sample_paths=None):
+    """
+    Train and store a new dictionary for each compressed column
+    Rows are sampled from sample_paths (the database shards) when given
+    """
+    codec = _codec_id()
+    if codec is None:
+        raise RuntimeError("Storage compression is disabled (LIFELENS_STORAGE_CODEC=none)")
+
+    conn = sqlite3.connect(db_path)
+    create_schema(conn.cursor())
+    trained = {}
+    sample_paths = sample_paths or [db_path]
+
+    for column in COMPRESSED_COLUMNS:
+        samples = []
+        for sample_path in sample_paths:
+            sample_conn = sqlite3.connect(sample_path)
+            samples += _sample_values(sample_conn, db_path, column, -(-sample_limit // len(sample_paths)))
+            sample_conn.close()
+        if len(samples) < 10:
+            continue
+
+        if codec == CODEC_ZSTD:
+            try:
+                dict_data = zstandard.train_dictionary(DICT_SIZE, samples).as_bytes()
+            except zstandard.ZstdError as e:
+                print(f"Skipping {column}: {str(e)}")
+                continue
+        else:
+            dict_data = _build_zlib_dictionary(samples)
+
+        cursor = conn.execute('''
+            INSERT INTO compression_dicts (column_name, codec, dict_data, sample_count)
+            VALUES (?, ?, ?, ?)
+        ''', (column, codec, dict_data, len(samples)))
+        trained[column] = cursor.lastrowid
+
+    conn.commit()
+    conn.close()
+
+    with _lock:
+        _active.clear()
+    return trained
+
+def recompress(db_path, batch_size=500, dict_path=None):
+    """
+    Re-encode every stored value with the current codec and newest dictionary
+    (from dict_path, the main database, when db_path is a shard)
+    """
+    conn = sqlite3.connect(db_path)
+    dict_path = dict_path or db_path
+    stats = {}
+
+    for column, (table, field) in COMPRESSED_COLUMNS.items():
+        column_stats = {'rows': 0, 'bytes_before': 0, 'bytes_after': 0}
+        last_id = 0
+        while True:
+            rows = conn.execute(f'''
+                SELECT id, {field} FROM {table}
+                WHERE id > ? AND {field} IS NOT NULL
+                ORDER BY id LIMIT ?
+            ''', (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for row_id, value in rows:
+                last_id = row_id
+                encoded = compress(decompress(value, dict_path), column, dict_path)
+                column_stats['rows'] += 1
+                column_stats['bytes_before'] += len(value.encode('utf-8') if isinstance(value, str) else value)
+                column_stats['bytes_after'] += len(encoded.encode('utf-8') if isinstance(encoded, str) else encoded)
+                updates.append((encoded, row_id))
+
+            conn.executemany(f"UPDATE {table} SET {field} = ? WHERE id = ?", updates)
+            conn.commit()
+
+        stats[column] = column_stats
+
+    conn.close()
+    return stats
+
+def storage_stats(db_path):
+    """Stored bytes per column and how many rows are compressed"""
+    conn = sqlite3.connect(db_path)
+    stats = {}
+    for column, (table, field) in COMPRESSED_COLUMNS.items():
+        row = conn.execute(f'''
+            SELECT COUNT(*), SUM(typeof({field}) = 'blob'), SUM(length(CAST({field} AS BLOB)))
+            FROM {table} WHERE {field} IS NOT NULL
+        ''').fetchone()
+        stats[column] = {'rows': row[0], 'compressed': row[1] or 0, 'bytes': row[2] or 0}
+    conn.close()
+    return stats
+
+def main(argv=None):
+    import database
+
+    parser = argparse.ArgumentParser(description="Compressed column storage maintenance")
+    parser.add_argument("command", choices=["train", "recompress", "stats"])
+    parser.add_argument("--db", default=database.DB_PATH, help="Path to the database file")
+    parser.add_argument("--samples", type=int, default=2000, help="Rows sampled per column when training")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM after recompressing to shrink the file")
+    args = parser.parse_args(argv)
+
+    database.DB_PATH = args.db
+    database.init_database()
+    if not database.get_backend().compresses_columns:
+        print("Column compression only applies to SQLite storage; PostgreSQL compresses large values itself")
+        return 1
+
+    if args.command == "train":
+        trained = train_dictionaries(args.db, args.samples, database.shard_paths())
+        for column, dict_id in trained.items():
+            print(f"{column}: dictionary {dict_id} ({CODEC_NAMES[_codec_id()]})")
+        if not trained:
+            print("Not enough rows to train a dictionary")
+
+    elif args.command == "recompress":
+        size_before = database.get_backend().storage_size()
+        for db_path in database.shard_paths():
+            for column, column_stats in recompress(db_path, dict_path=args.db).items():
+                print(f"{os.path.basename(db_path)} {column}: {column_stats['rows']} rows, "
+                      f"{column_stats['bytes_before'] / 1024:.1f} KB -> {column_stats['bytes_after'] / 1024:.1f} KB")
+        if args.vacuum:
+            for db_path in database.database_files():
+                conn = database.get_connection(db_path)
+                conn.execute("VACUUM")
+                conn.close()
+        size_after = database.get_backend().storage_size()
+        print(f"Database files: {size_before / 1024:.1f} KB -> {size_after / 1024:.1f} KB")
+
+    else:
+        for db_path in database.shard_paths():
+            for column, column_stats in storage_stats(db_path).items():
+                print(f"{os.path.basename(db_path)} {column}: {column_stats['compressed']}/{column_stats['rows']} "
+                      f"rows compressed, {column_stats['bytes'] / 1024:.1f} KB stored")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
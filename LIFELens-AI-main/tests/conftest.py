@@ -0,0 +1,92 @@
+"""
+Shared fixtures.
+
+The `db` fixture points database.py at a fresh SQLite file and, when
+LIFELENS_TEST_DATABASE_URL is set to a postgresql:// URL, at a throwaway
+schema in that database, so the same tests run against both backends.
+"""
+import os
+import sys
+import uuid
+
+import pytest
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import auth
+import data_cache
+import database
+import snapshot
+
+TEST_DATABASE_URL = os.getenv("LIFELENS_TEST_DATABASE_URL")
+
+def schema_url(url, schema):
+    """The URL with every connection's search_path set to schema"""
+    separator = "&" if "?" in url else "?"
+    return f"{url}{separator}options=-csearch_path%3D{schema}"
+
+def _scratch_schema(url, schema, create):
+    import psycopg2
+
+    conn = psycopg2.connect(url)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA {schema}" if create else f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    conn.close()
+
+def _close_pool():
+    backend = database._backend
+    for raw in getattr(backend, '_idle', []):
+        raw.close()
+
+@pytest.fixture(autouse=True)
+def fast_hashing(monkeypatch):
+    """Hash at the minimum cost instead of calibrating to this machine"""
+    monkeypatch.setattr(auth, '_cost', auth.MIN_COST)
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """database.py on a fresh SQLite file; returns its path"""
+    db_path = str(tmp_path / "test.db")
+    monkeypatch.setattr(database, 'DB_PATH', db_path)
+    monkeypatch.setattr(database, 'DATABASE_URL', None)
+    monkeypatch.setattr(database, '_backend', None)
+    monkeypatch.setattr(database, '_initialized_databases', set())
+    # Reads go to the live file unless a test is about snapshots
+    monkeypatch.setattr(snapshot, 'MAX_AGE_SECONDS', 0)
+    data_cache.clear_cache()
+    database.init_database()
+    return db_path
+
+@pytest.fixture
+def pg_url(monkeypatch):
+    """A scratch PostgreSQL schema (dropped afterwards); skipped without LIFELENS_TEST_DATABASE_URL"""
+    if not TEST_DATABASE_URL:
+        pytest.skip("set LIFELENS_TEST_DATABASE_URL to run against PostgreSQL")
+    pytest.importorskip("psycopg2")
+
+    schema = f"lifelens_test_{uuid.uuid4().hex[:12]}"
+    _scratch_schema(TEST_DATABASE_URL, schema, create=True)
+    monkeypatch.setattr(database, '_backend', None)
+    monkeypatch.setattr(database, '_initialized_databases', set())
+    data_cache.clear_cache()
+    try:
+        yield schema_url(TEST_DATABASE_URL, schema)
+    finally:
+        _close_pool()
+        database._backend = None
+        _scratch_schema(TEST_DATABASE_URL, schema, create=False)
+
+@pytest.fixture
+def pg_db(pg_url, tmp_path, monkeypatch):
+    """database.py on a scratch PostgreSQL schema; returns its URL"""
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / "unused.db"))
+    monkeypatch.setattr(database, 'DATABASE_URL', pg_url)
+    database.init_database()
+    return pg_url
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def db(request):
+    """database.py on each available backend"""
+    return request.getfixturevalue("sqlite_db" if request.param == "sqlite" else "pg_db")
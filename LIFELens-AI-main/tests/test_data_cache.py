@@ -0,0 +1,65 @@
+"""Per-user read cache bounds and invalidation"""
+import data_cache
+from data_cache import user_cached
+
+def _reset(monkeypatch, max_users):
+    monkeypatch.setattr(data_cache, 'MAX_USERS', max_users)
+    data_cache.clear_cache()
+
+@user_cached
+def lookup(user_email, page=0):
+    return (user_email, page)
+
+def test_least_recently_used_users_are_evicted(monkeypatch):
+    _reset(monkeypatch, 2)
+    lookup("a")
+    lookup("b")
+    lookup("a")
+    lookup("c")
+    assert list(data_cache._entries) == ["a", "c"]
+    assert data_cache.get_cache_stats()['evictions'] >= 1
+
+def test_expired_entries_are_swept(monkeypatch):
+    _reset(monkeypatch, 10)
+    monkeypatch.setattr(data_cache, 'CACHE_TTL_SECONDS', -1)
+    for page in range(5):
+        lookup("a", page)
+    assert data_cache.get_cache_stats("a")['user_entries'] == 1
+
+def test_generations_stay_bounded(monkeypatch):
+    _reset(monkeypatch, 3)
+    for i in range(50):
+        data_cache.invalidate_user(f"user{i}")
+    assert len(data_cache._generations) <= 6
+
+def test_a_read_racing_a_forgotten_write_is_not_stored(monkeypatch):
+    _reset(monkeypatch, 1)
+
+    @user_cached
+    def racing_read(user_email):
+        # Written to and then forgotten while this read runs
+        data_cache.invalidate_user(user_email)
+        for i in range(5):
+            data_cache.invalidate_user(f"other{i}")
+        assert user_email not in data_cache._generations
+        return "stale"
+
+    racing_read("a")
+    assert data_cache.get_cache_stats("a")['user_entries'] == 0
+
+def test_failed_reads_are_not_stored(monkeypatch):
+    _reset(monkeypatch, 10)
+    calls = []
+
+    @user_cached
+    def flaky_read(user_email):
+        calls.append(user_email)
+        if len(calls) == 1:
+            data_cache.skip_cache()
+            return []
+        return ["row"]
+
+    assert flaky_read("a") == []
+    assert flaky_read("a") == ["row"]
+    assert flaky_read("a") == ["row"]
+    assert len(calls) == 2
@@ -0,0 +1,29 @@
+"""Background export jobs"""
+import os
+import time
+
+import data_export
+
+def test_expired_jobs_are_forgotten_with_their_files(sqlite_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(data_export, 'EXPORT_DIR', str(tmp_path / "exports"))
+    job_id = data_export.start_export_job("user@example.com", "uploads", "csv")
+    for _ in range(100):
+        job = data_export.get_export_job(job_id)
+        if job['status'] == 'completed':
+            break
+        time.sleep(0.05)
+    assert job['status'] == 'completed'
+    assert os.path.exists(job['path'])
+
+    # A day later, the next export sweeps it out
+    later = time.time() + data_export.EXPORT_MAX_AGE_SECONDS + 1
+    monkeypatch.setattr(data_export.time, 'time', lambda: later)
+    data_export._cleanup_old_exports()
+    assert data_export.get_export_job(job_id) is None
+    assert not os.path.exists(job['path'])
+
+def test_parquet_is_offered_only_with_pyarrow(monkeypatch):
+    monkeypatch.setattr(data_export.importlib.util, 'find_spec', lambda name: None)
+    assert data_export.available_formats() == ['csv', 'ndjson']
+    monkeypatch.setattr(data_export.importlib.util, 'find_spec', lambda name: object())
+    assert data_export.available_formats() == ['csv', 'ndjson', 'parquet']
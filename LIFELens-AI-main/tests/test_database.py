@@ -0,0 +1,199 @@
+"""The database.py API on each storage backend (see conftest.db)."""
+import pytest
+
+import database
+
+ANALYSIS = {'scan_type': 'Ultrasound', 'image_quality': 'Good', 'risk_level': 'low', 'confidence_score': 82,
+            'key_findings': ['Both kidneys appear normal in size and shape'],
+            'recommendations': ['Maintain adequate hydration']}
+
+USER = "user@example.com"
+
+@pytest.fixture
+def user(db):
+    ok, message = database.create_user(USER, "password123", "Test User")
+    assert ok, message
+    return USER
+
+def _upload(user_email, name="scan.jpg"):
+    upload_id = database.save_upload(user_email, name, f"uploads/{name}", "image")
+    assert upload_id
+    return upload_id
+
+def test_create_and_verify_user(user):
+    assert database.verify_user(user, "password123") is True
+    assert database.verify_user(user, "wrong-password") is False
+    assert database.verify_user("nobody@example.com", "password123") is False
+
+def test_duplicate_email_is_an_integrity_error(user):
+    assert database.create_user(user, "other-password", "Someone Else") == (False, "Email already exists")
+
+def test_inserts_return_their_ids(user):
+    first = _upload(user, "first.jpg")
+    second = _upload(user, "second.jpg")
+    assert second > first
+    report_id = database.save_report(user, second, "Upload Report", report_content="Report text")
+    assert report_id
+    assert [report['id'] for report in database.get_user_reports(user)] == [report_id]
+
+def test_demographics_insert_then_update(user):
+    demographics = {'age': 40, 'gender': 'Female', 'weight': 62.5, 'height': 168.0,
+                    'daily_water_intake': 2.0, 'medical_history': 'None'}
+    assert database.save_demographics(user, demographics)[0]
+    assert database.save_demographics(user, dict(demographics, age=41))[0]
+    assert database.get_user_demographics(user) == dict(demographics, age=41)
+    assert database.count_events(user, 'demographics') == 2
+
+def test_latest_analysis_replaces_the_previous_one(user):
+    upload_id = _upload(user)
+    database.save_ai_analysis(upload_id, user, ANALYSIS)
+    database.save_ai_analysis(upload_id, user, dict(ANALYSIS, risk_level='high', confidence_score=90))
+
+    latest = database.get_ai_analysis(upload_id)
+    assert latest.risk_level == 'high'
+    assert latest.confidence_score == 90
+    # Only the latest version is part of the history
+    assert [record.risk_level for record in database.get_all_user_analyses(user)] == ['high']
+    assert database.get_latest_upload(user)['analysis_status'] == 'completed'
+
+def test_event_log_and_counters(user):
+    upload_id = _upload(user)
+    database.save_ai_analysis(upload_id, user, ANALYSIS)
+    database.save_report(user, upload_id, "Upload Report", report_content="Report text")
+
+    assert database.count_events(user) == 3
+    assert database.count_events(user, 'upload') == 1
+    events = database.get_recent_events(user, limit=10)
+    assert [event['event_type'] for event in events] == ['report', 'analysis', 'upload']
+    assert events[-1]['description'] == "Uploaded scan.jpg"
+
+def test_like_patterns_and_question_marks_in_values(user):
+    # % and ? in parameters and literals must survive placeholder translation
+    upload_id = _upload(user, "100%_sure?.jpg")
+    conn = database.get_connection()
+    rows = conn.execute("SELECT id FROM uploads WHERE filename LIKE '%\\_sure?%' ESCAPE '\\' AND user_email = ?",
+                        (user,)).fetchall()
+    conn.close()
+    assert rows == [(upload_id,)]
+
+def test_streamed_history_matches_the_full_read(user):
+    for i in range(12):
+        database.save_ai_analysis(_upload(user, f"scan_{i}.jpg"), user, dict(ANALYSIS, confidence_score=50 + i))
+
+    streamed = list(database.iter_user_analyses(user, batch_size=5))
+    loaded = database.get_all_user_analyses(user)
+    assert len(streamed) == 12
+    assert sorted(record.id for record in streamed) == sorted(record.id for record in loaded)
+    assert {record.confidence_score for record in streamed} == set(range(50, 62))
+
+def test_aggregates_come_back_as_python_numbers(user):
+    for i in range(3):
+        database.save_ai_analysis(_upload(user, f"scan_{i}.jpg"), user, dict(ANALYSIS, confidence_score=80 + i))
+    conn = database.get_connection()
+    total, average = conn.execute("SELECT SUM(confidence_score), AVG(confidence_score) FROM ai_analysis").fetchone()
+    conn.close()
+    assert (total, average) == (243, 81)
+    assert isinstance(total, int)
+
+def test_rollback_discards_uncommitted_writes(user):
+    conn = database.get_connection()
+    conn.execute("UPDATE users SET full_name = ? WHERE email = ?", ("Changed", user))
+    conn.rollback()
+    assert conn.execute("SELECT full_name FROM users WHERE email = ?", (user,)).fetchone() == ("Test User",)
+    conn.close()
+
+def test_schema_creation_is_idempotent(db):
+    database.init_database(force=True)
+    conn = database.get_connection()
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(uploads)").fetchall()]
+    conn.close()
+    assert columns.count('study_id') == 1
+    assert {'quality_verdict', 'modality', 'series_uid'} <= set(columns)
+
+def test_studies_are_only_visible_to_their_owner(user):
+    assert database.create_user("other@example.com", "password123", "Other User")[0]
+    upload_ids = [_upload(user, f"view_{i}.jpg") for i in range(2)]
+    study_id = database.create_study(user, "Renal ultrasound", upload_ids)
+    assert database.save_study_analysis(study_id, user, ANALYSIS, {})
+
+    assert [upload['id'] for upload in database.get_study_uploads(study_id, user)] == upload_ids
+    assert database.get_study_analysis(study_id, user)['risk_level'] == 'low'
+    assert database.get_study_uploads(study_id, "other@example.com") == []
+    assert database.get_study_analysis(study_id, "other@example.com") is None
+    assert database.save_study_analysis(study_id, "other@example.com", ANALYSIS, {}) is None
+
+def test_unreadable_analyses_are_skipped(user):
+    good = _upload(user, "good.jpg")
+    database.save_ai_analysis(good, user, ANALYSIS)
+    for name, stored in (("list.jpg", "[1, 2]"), ("broken.jpg", "{not json")):
+        upload_id = _upload(user, name)
+        database.save_ai_analysis(upload_id, user, ANALYSIS)
+        conn = database.get_user_connection(user)
+        conn.execute("UPDATE ai_analysis SET analysis_data = ? WHERE upload_id = ?", (stored, upload_id))
+        conn.commit()
+        conn.close()
+    database.invalidate_user(user)
+
+    assert [record.upload_id for record in database.get_all_user_analyses(user)] == [good]
+    assert [record.upload_id for record in database.iter_user_analyses(user)] == [good]
+
+def test_reanalysis_keeps_the_history_count(user):
+    upload_ids = [_upload(user, f"scan_{i}.jpg") for i in range(3)]
+    for upload_id in upload_ids:
+        database.save_ai_analysis(upload_id, user, ANALYSIS)
+    database.save_ai_analysis(upload_ids[0], user, dict(ANALYSIS, risk_level='high'))
+
+    assert len(database.get_all_user_analyses(user)) == 3
+    assert len(list(database.iter_user_analyses(user))) == 3
+    assert database.count_user_records(user, 'ai_analysis') == 3
+    risk_levels = {record.upload_id: record.risk_level for record in database.iter_user_analyses(user)}
+    assert risk_levels[upload_ids[0]] == 'high'
+
+def test_reports_are_read_a_page_at_a_time(user):
+    upload_id = _upload(user)
+    database.save_upload(user, "labs.pdf", "uploads/labs.pdf", "document")
+    report_ids = [database.save_report(user, upload_id, "Upload Report", report_content=f"Report {i}")
+                  for i in range(5)]
+    report_ids.append(database.save_report(user, None, "Summary", report_content="Summary"))
+
+    first = database.get_report_page(user, limit=4, offset=0)
+    second = database.get_report_page(user, limit=4, offset=4)
+    # Reports from the same second come newest id first
+    assert [report['id'] for report in first + second] == report_ids[::-1]
+    assert [report['filename'] for report in first[:2]] == ["General Report", "scan.jpg"]
+
+    assert database.get_report_type_counts(user) == {'Summary': 1, 'Upload Report': 5}
+    assert database.get_upload_summary(user) == {'by_type': {'document': 1, 'image': 1}, 'pending': 2}
+
+def test_user_emails_are_read_in_keyset_pages(db):
+    for i in range(5):
+        assert database.create_user(f"user{i}@example.com", "password123", f"User {i}")[0]
+
+    emails = []
+    for email in database.iter_user_emails(batch_size=2):
+        emails.append(email)
+        if email == "user0@example.com":
+            # Pages are separate queries, so later pages see users created meanwhile
+            database.create_user("late@example.com", "password123", "Late")
+    assert emails == [f"user{i}@example.com" for i in range(5)] + ["late@example.com"]
+
+def _tables(path):
+    conn = database.sqlite3.connect(path)
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.close()
+    return names - {'sqlite_sequence'}
+
+def test_shards_hold_only_per_user_tables(sqlite_db, monkeypatch):
+    import reshard
+
+    database.create_user(USER, "password123", "Test User")
+    upload_id = _upload(USER)
+    reshard.reshard(2)
+    # A process starting on the sharded layout
+    monkeypatch.setattr(database, '_initialized_databases', set())
+    database.init_database()
+
+    for path in database.shard_paths():
+        assert _tables(path) == set(database.USER_TABLES)
+    assert {'users', 'sessions', 'ai_calls', 'ai_flights', 'compression_dicts'} <= _tables(sqlite_db)
+    assert database.get_user_uploads(USER)[0]['id'] == upload_id
@@ -0,0 +1,27 @@
+"""Scoring scans at reduced size"""
+import numpy as np
+import pytest
+from PIL import Image
+
+import image_quality
+
+@pytest.mark.parametrize("fmt", ["JPEG", "PNG"])
+def test_noise_keeps_its_contrast_when_reduced(tmp_path, fmt):
+    rng = np.random.default_rng(0)
+    path = str(tmp_path / f"noise.{fmt.lower()}")
+    Image.fromarray(rng.integers(0, 256, (2048, 3072), dtype=np.uint8)).convert('RGB').save(path, fmt)
+
+    quality = image_quality.assess_image(path)
+    assert quality['metrics']['width'] == 3072
+    assert quality['metrics']['contrast'] > 60
+    assert "low contrast" not in quality['issues']
+
+def test_small_images_are_measured_as_they_are(tmp_path):
+    path = str(tmp_path / "scan.png")
+    pixels = np.zeros((400, 600), dtype=np.uint8)
+    pixels[:, 300:] = 200
+    Image.fromarray(pixels).save(path)
+
+    metrics = image_quality.measure(path)
+    assert metrics['brightness'] == 100.0
+    assert metrics['contrast'] == 100.0
@@ -0,0 +1,113 @@
+"""
+PostgreSQL backend behaviour that SQLite callers rely on: sqlite3 exception
+types, BEGIN IMMEDIATE as a write lock, batched inserts, and migration.
+Skipped unless LIFELENS_TEST_DATABASE_URL is set.
+"""
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import database
+import pg_backend
+from test_database import ANALYSIS
+
+def test_integrity_errors_are_sqlite_errors(pg_db):
+    conn = database.get_connection()
+    conn.execute("INSERT INTO users (email, password_hash, full_name) VALUES (?, ?, ?)", ("a@example.com", "x", "A"))
+    conn.commit()
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO users (email, password_hash, full_name) VALUES (?, ?, ?)",
+                     ("a@example.com", "y", "B"))
+    conn.rollback()
+    conn.close()
+
+def test_other_errors_are_operational_errors(pg_db):
+    conn = database.get_connection()
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute("SELECT missing_column FROM users WHERE id = ?", (1,))
+    conn.rollback()
+    conn.close()
+
+def test_lastrowid_comes_from_returning_id(pg_db):
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO users (email, password_hash, full_name) VALUES (?, ?, ?)", ("a@example.com", "x", "A"))
+    first = cursor.lastrowid
+    cursor.execute("INSERT INTO users (email, password_hash, full_name) VALUES (?, ?, ?)", ("b@example.com", "x", "B"))
+    assert cursor.lastrowid == first + 1
+    # Tables without a generated id column get no RETURNING clause
+    cursor.execute("INSERT INTO event_counts (user_email, event_type, count) VALUES (?, ?, ?)",
+                   ("a@example.com", "upload", 1))
+    assert cursor.lastrowid is None
+    conn.commit()
+    conn.close()
+
+def test_begin_immediate_serializes_writers(pg_db):
+    first = database.get_connection()
+    first.execute("BEGIN IMMEDIATE")
+    acquired = []
+
+    def second_writer():
+        conn = database.get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        acquired.append(time.perf_counter())
+        conn.commit()
+        conn.close()
+
+    thread = threading.Thread(target=second_writer)
+    thread.start()
+    time.sleep(0.3)
+    assert not acquired
+    released = time.perf_counter()
+    first.commit()
+    thread.join(timeout=5)
+    first.close()
+    assert acquired and acquired[0] >= released
+
+def test_executemany_single_row_and_batched_statements(pg_db, monkeypatch):
+    monkeypatch.setattr(pg_backend, 'BATCH_ROWS', 7)
+    rows = [("analyze_scan", "gpt-5-mini", i, 5, 120, 0, "miss", "ok", None, "2025-01-01 00:00:00")
+            for i in range(20)]
+    conn = database.get_connection()
+    conn.executemany('''
+        INSERT INTO ai_calls (function, model, prompt_tokens, completion_tokens, latency_ms,
+                              retries, cache, outcome, error, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    # Not a plain single-row INSERT: goes through execute_batch
+    conn.executemany("UPDATE ai_calls SET outcome = ? WHERE prompt_tokens = ?",
+                     [("retried", i) for i in range(0, 20, 2)])
+    conn.commit()
+    assert conn.execute("SELECT COUNT(*), SUM(prompt_tokens) FROM ai_calls").fetchone() == (20, sum(range(20)))
+    assert conn.execute("SELECT COUNT(*) FROM ai_calls WHERE outcome = ?", ("retried",)).fetchone() == (10,)
+    conn.close()
+
+def test_migrate_copies_sqlite_data(sqlite_db, pg_url, monkeypatch):
+    user = "user@example.com"
+    assert database.create_user(user, "password123", "Test User")[0]
+    upload_ids = [database.save_upload(user, f"scan_{i}.jpg", f"uploads/scan_{i}.jpg", "image") for i in range(3)]
+    for upload_id in upload_ids:
+        database.save_ai_analysis(upload_id, user, ANALYSIS)
+    database.save_report(user, upload_ids[0], "Upload Report", report_content="Report text " * 200)
+    before = {record.id: record.analysis_data for record in database.get_all_user_analyses(user)}
+
+    monkeypatch.setattr(database, 'DATABASE_URL', pg_url)
+    copied = pg_backend.migrate(sqlite_db)
+    assert copied['users'] == 1
+    assert copied['uploads'] == 3
+    assert copied['ai_analysis'] == 3
+    assert copied['events'] == 7
+
+    # Compressed SQLite columns arrive as text
+    after = {record.id: record.analysis_data for record in database.get_all_user_analyses(user)}
+    assert after == before
+    assert database.get_user_reports(user)[0]['report_content'] == "Report text " * 200
+    assert database.verify_user(user, "password123") is True
+
+    # New rows continue after the copied IDs
+    assert database.save_upload(user, "new.jpg", "uploads/new.jpg", "image") == max(upload_ids) + 1
+
+    with pytest.raises(RuntimeError, match="already has rows"):
+        pg_backend.migrate(sqlite_db)
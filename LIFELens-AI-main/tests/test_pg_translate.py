@@ -0,0 +1,73 @@
+"""SQLite-to-PostgreSQL statement translation (pure; no database needed)."""
+import pg_backend
+from pg_backend import _placeholders, translate
+
+def test_placeholders_become_format_markers():
+    assert _placeholders("SELECT * FROM users WHERE email = ? AND id > ?") == \
+        "SELECT * FROM users WHERE email = %s AND id > %s"
+
+def test_question_marks_inside_string_literals_are_kept():
+    sql = "SELECT 'why?' AS q, description FROM events WHERE description = ? OR description LIKE '%?'"
+    assert _placeholders(sql) == \
+        "SELECT 'why?' AS q, description FROM events WHERE description = %s OR description LIKE '%?'"
+
+def test_escaped_quotes_inside_literals():
+    sql = "SELECT 'it''s ?' WHERE x = ?"
+    assert _placeholders(sql) == "SELECT 'it''s ?' WHERE x = %s"
+
+def test_percent_is_escaped_only_with_parameters():
+    sql = "SELECT email FROM users WHERE email LIKE '%@example.com' AND id = ?"
+    assert translate(sql, True) == ("SELECT email FROM users WHERE email LIKE '%%@example.com' AND id = %s", None)
+    # psycopg2 doesn't interpolate without parameters, so % stays as is
+    plain = "SELECT email FROM users WHERE email LIKE '%@example.com'"
+    assert translate(plain, False) == (plain, None)
+
+def test_single_row_insert_reports_its_table():
+    sql, table = translate("INSERT INTO Uploads (user_email, filename) VALUES (?, ?)", True)
+    assert sql == "INSERT INTO Uploads (user_email, filename) VALUES (%s, %s)"
+    assert table == "uploads"
+
+def test_other_statements_have_no_insert_table():
+    assert translate("UPDATE uploads SET analysis_status = ? WHERE id = ?", True)[1] is None
+    assert translate("INSERT INTO event_counts SELECT * FROM events", False)[1] is None
+
+def test_create_table_types_are_rewritten():
+    sql, _ = translate('''
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            upload_id INTEGER,
+            score REAL,
+            payload BLOB,
+            generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (upload_id) REFERENCES uploads (id)
+        )
+    ''', False)
+    assert "id BIGSERIAL PRIMARY KEY" in sql
+    assert "upload_id BIGINT" in sql
+    assert "score DOUBLE PRECISION" in sql
+    assert "payload BYTEA" in sql
+    assert "generated_at TEXT DEFAULT (to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'))" in sql
+    assert "FOREIGN KEY" not in sql
+    assert "INTEGER" not in sql
+
+def test_alter_table_types_are_rewritten():
+    sql, _ = translate("ALTER TABLE uploads ADD COLUMN study_id INTEGER", False)
+    assert sql == "ALTER TABLE uploads ADD COLUMN study_id BIGINT"
+
+def test_dml_keeps_sqlite_type_names_in_data():
+    # Only DDL is rewritten; the same words in queries are data
+    sql = "SELECT 'INTEGER REAL BLOB' FROM users"
+    assert translate(sql, False) == (sql, None)
+
+def test_pragma_table_info_reads_information_schema():
+    sql, table = translate("PRAGMA table_info(Uploads)", False)
+    assert "information_schema.columns" in sql
+    assert "table_name = 'uploads'" in sql
+    assert sql.startswith("SELECT ordinal_position - 1, column_name, data_type")
+    assert table is None
+
+def test_translation_is_cached():
+    pg_backend.translate.cache_clear()
+    translate("SELECT 1 WHERE 1 = ?", True)
+    translate("SELECT 1 WHERE 1 = ?", True)
+    assert pg_backend.translate.cache_info().hits == 1
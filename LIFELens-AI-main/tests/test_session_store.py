@@ -0,0 +1,90 @@
+"""Signed session tokens and their expiry"""
+import pytest
+
+import session_store
+
+@pytest.fixture
+def memory_store(monkeypatch):
+    monkeypatch.setattr(session_store, '_signing_key', None)
+    monkeypatch.setattr(session_store, '_store', session_store.MemorySessionStore())
+    monkeypatch.setenv("LIFELENS_SESSION_SECRET", "test-secret")
+    return session_store.get_store()
+
+def test_tokens_resume_until_ended(memory_store):
+    token = session_store.create_session("user@example.com")
+    assert session_store.resume_session(token) == "user@example.com"
+    session_store.end_session(token)
+    assert session_store.resume_session(token) is None
+
+def test_tampered_tokens_are_rejected(memory_store):
+    token = session_store.create_session("user@example.com")
+    session_id, signature = token.split('.')
+    assert session_store.resume_session(f"{session_id}x.{signature}") is None
+    assert session_store.resume_session(session_id) is None
+    assert session_store.resume_session("") is None
+
+def test_idle_sessions_expire(memory_store, monkeypatch):
+    token = session_store.create_session("user@example.com")
+    now = session_store.time.time()
+    monkeypatch.setattr(session_store.time, 'time', lambda: now + session_store.IDLE_TTL_SECONDS + 1)
+    assert session_store.resume_session(token) is None
+
+def test_password_reset_ends_every_session(memory_store):
+    tokens = [session_store.create_session("user@example.com") for _ in range(3)]
+    other = session_store.create_session("other@example.com")
+    session_store.end_user_sessions("user@example.com")
+    assert [session_store.resume_session(token) for token in tokens] == [None, None, None]
+    assert session_store.resume_session(other) == "other@example.com"
+
+def test_shared_store_requires_a_secret(sqlite_db, monkeypatch):
+    monkeypatch.setattr(session_store, '_signing_key', None)
+    monkeypatch.setattr(session_store, '_store', session_store.DatabaseSessionStore())
+    monkeypatch.delenv("LIFELENS_SESSION_SECRET", raising=False)
+    monkeypatch.delenv("SESSION_SECRET", raising=False)
+    with pytest.raises(RuntimeError, match="LIFELENS_SESSION_SECRET"):
+        session_store.check_config()
+
+def test_memory_store_works_without_a_secret(memory_store, monkeypatch):
+    monkeypatch.delenv("LIFELENS_SESSION_SECRET", raising=False)
+    monkeypatch.delenv("SESSION_SECRET", raising=False)
+    session_store.check_config()
+    assert session_store.resume_session(session_store.create_session("user@example.com")) == "user@example.com"
+
+def test_sessions_are_shared_through_the_database(db, monkeypatch):
+    monkeypatch.setattr(session_store, '_signing_key', None)
+    monkeypatch.setattr(session_store, '_store', session_store.DatabaseSessionStore())
+    monkeypatch.setenv("LIFELENS_SESSION_SECRET", "test-secret")
+    token = session_store.create_session("user@example.com")
+    # Another replica: its own store object and key, the same database and secret
+    monkeypatch.setattr(session_store, '_signing_key', None)
+    monkeypatch.setattr(session_store, '_store', session_store.DatabaseSessionStore())
+    assert session_store.resume_session(token) == "user@example.com"
+
+def test_without_a_secret_the_default_store_is_in_process(monkeypatch):
+    monkeypatch.setattr(session_store, '_signing_key', None)
+    monkeypatch.setattr(session_store, '_store', None)
+    monkeypatch.setattr(session_store, 'STORE', None)
+    monkeypatch.delenv("LIFELENS_SESSION_SECRET", raising=False)
+    monkeypatch.delenv("SESSION_SECRET", raising=False)
+    session_store.check_config()
+    assert isinstance(session_store.get_store(), session_store.MemorySessionStore)
+
+def test_with_a_secret_the_default_store_is_the_database(monkeypatch):
+    monkeypatch.setattr(session_store, '_store', None)
+    monkeypatch.setattr(session_store, 'STORE', None)
+    monkeypatch.setenv("LIFELENS_SESSION_SECRET", "test-secret")
+    assert isinstance(session_store.get_store(), session_store.DatabaseSessionStore)
+
+def test_cookie_tokens_are_single_use(memory_store, monkeypatch):
+    token = session_store.create_session("user@example.com")
+    user_email, new_token = session_store.exchange_session(token)
+    assert user_email == "user@example.com"
+    assert new_token != token
+    # Tabs opened together can still use the old token for a moment
+    assert session_store.resume_session(token) == "user@example.com"
+
+    now = session_store.time.time()
+    monkeypatch.setattr(session_store.time, 'time', lambda: now + session_store.ROTATION_GRACE_SECONDS + 1)
+    assert session_store.resume_session(token) is None
+    assert session_store.exchange_session(token) == (None, None)
+    assert session_store.resume_session(new_token) == "user@example.com"
@@ -0,0 +1,85 @@
+"""Sharing AI call outcomes between processes through ai_flights"""
+import base64
+import threading
+import time
+
+import pytest
+
+import database
+import singleflight
+
+@pytest.fixture
+def flights(sqlite_db, monkeypatch):
+    monkeypatch.setattr(singleflight, 'POLL_SECONDS', 0.01)
+    monkeypatch.setenv("LIFELENS_UPLOAD_KEY", base64.urlsafe_b64encode(b"k" * 32).decode("ascii"))
+    return sqlite_db
+
+def _stored(key):
+    conn = database.get_connection()
+    row = conn.execute("SELECT status, result FROM ai_flights WHERE key = ?", (key,)).fetchone()
+    conn.close()
+    return row
+
+def _in_other_process(key, fn, outcome):
+    """Run as if from another process: no coalescing through this process's threads"""
+    try:
+        outcome['result'] = singleflight._run_across_processes(key, fn, str, str, lambda result: True, None)
+    except Exception as e:
+        outcome['error'] = e
+
+def test_stored_results_are_encrypted(flights):
+    assert singleflight.run_once("scan", lambda: {'risk_level': 'high'}) == {'risk_level': 'high'}
+    status, stored = _stored("scan")
+    assert status == 'done' and 'high' not in stored
+    assert singleflight.run_once("scan", lambda: pytest.fail("ran twice")) == {'risk_level': 'high'}
+
+def test_without_a_key_only_completion_is_stored(flights, monkeypatch):
+    monkeypatch.delenv("LIFELENS_UPLOAD_KEY")
+    singleflight.run_once("scan", lambda: {'risk_level': 'high'})
+    assert _stored("scan") == ('done', None)
+
+def test_waiters_in_other_processes_get_the_failure(flights):
+    release = threading.Event()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        release.wait(5)
+        raise ValueError("model unavailable")
+
+    leader, waiter = {}, {}
+    threads = [threading.Thread(target=_in_other_process, args=("scan", fail, leader))]
+    threads[0].start()
+    while _stored("scan") is None:
+        time.sleep(0.01)
+    threads.append(threading.Thread(target=_in_other_process, args=("scan", fail, waiter)))
+    threads[1].start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert "model unavailable" in str(waiter['error'])
+
+def test_the_lease_is_renewed_while_the_call_runs(flights, monkeypatch):
+    monkeypatch.setattr(singleflight, 'LEASE_SECONDS', 0.3)
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(1)
+        return "result"
+
+    leader, waiter = {}, {}
+    threads = [threading.Thread(target=_in_other_process, args=("scan", slow, leader))]
+    threads[0].start()
+    while _stored("scan") is None:
+        time.sleep(0.01)
+    threads.append(threading.Thread(target=_in_other_process, args=("scan", slow, waiter)))
+    threads[1].start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert waiter['result'] == "result"
@@ -0,0 +1,61 @@
+"""Dashboard reads from analytics snapshots (SQLite storage)"""
+import fcntl
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+import database
+import snapshot
+from conftest import PROJECT_ROOT
+
+USER = "user@example.com"
+
+def _snapshot_fixture(sqlite_db, monkeypatch):
+    monkeypatch.setattr(snapshot, 'MAX_AGE_SECONDS', 60)
+    # Keep reads from starting background refreshes mid-test
+    monkeypatch.setattr(snapshot, '_refresh_in_background', lambda db_path: None)
+    assert database.create_user(USER, "password123", "Test User")[0]
+    database.save_upload(USER, "scan.jpg", "uploads/scan.jpg", "image")
+    snapshot.refresh(sqlite_db)
+
+def test_reads_use_a_current_snapshot(sqlite_db, monkeypatch):
+    _snapshot_fixture(sqlite_db, monkeypatch)
+    assert snapshot.read_path(sqlite_db, USER) == snapshot.snapshot_path(sqlite_db)
+    assert snapshot.read_path(sqlite_db, USER, fresh=True) == sqlite_db
+
+def test_writes_from_another_process_send_reads_to_the_live_file(sqlite_db, monkeypatch):
+    _snapshot_fixture(sqlite_db, monkeypatch)
+    script = ("import database, sys; database.DB_PATH = sys.argv[1]; "
+              "database.save_upload(sys.argv[2], 'other.jpg', 'uploads/other.jpg', 'image')")
+    subprocess.run([sys.executable, "-c", script, sqlite_db, USER], cwd=PROJECT_ROOT, check=True)
+
+    assert snapshot.read_path(sqlite_db, USER) == sqlite_db
+    assert sorted(upload['filename'] for upload in database.iter_user_uploads(USER)) == ['other.jpg', 'scan.jpg']
+    # Other users' reads can still use the snapshot
+    assert snapshot.read_path(sqlite_db, "other@example.com") == snapshot.snapshot_path(sqlite_db)
+
+    snapshot.refresh(sqlite_db)
+    assert snapshot.read_path(sqlite_db, USER) == snapshot.snapshot_path(sqlite_db)
+
+def test_database_is_wal_and_the_snapshot_is_not(sqlite_db, monkeypatch):
+    _snapshot_fixture(sqlite_db, monkeypatch)
+    live = sqlite3.connect(sqlite_db)
+    copy = sqlite3.connect(snapshot.snapshot_path(sqlite_db))
+    assert live.execute("PRAGMA journal_mode").fetchone() == ('wal',)
+    assert copy.execute("PRAGMA journal_mode").fetchone() == ('delete',)
+    live.close()
+    copy.close()
+
+def test_background_refreshes_are_skipped_when_another_process_has_one(sqlite_db, monkeypatch):
+    _snapshot_fixture(sqlite_db, monkeypatch)
+    # Taken just now
+    assert snapshot.refresh(sqlite_db, if_older_than=30) is None
+
+    os.utime(snapshot.snapshot_path(sqlite_db), (time.time() - 45, time.time() - 45))
+    with open(snapshot.snapshot_path(sqlite_db) + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        assert snapshot.refresh(sqlite_db, if_older_than=30) is None
+    assert snapshot.refresh(sqlite_db, if_older_than=30) is not None
+    assert snapshot.snapshot_age(sqlite_db) < 30
@@ -0,0 +1,29 @@
+"""Compressed analysis and report columns"""
+import pytest
+
+import database
+import storage_codec
+from test_database import ANALYSIS
+
+USER = "user@example.com"
+
+@pytest.mark.parametrize("codec", ["zstd", "zlib"])
+def test_trained_dictionaries_round_trip(sqlite_db, monkeypatch, codec):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    monkeypatch.setattr(storage_codec, 'STORAGE_CODEC', codec)
+    assert database.create_user(USER, "password123", "Test User")[0]
+    for i in range(40):
+        upload_id = database.save_upload(USER, f"scan_{i}.jpg", f"uploads/scan_{i}.jpg", "image")
+        database.save_ai_analysis(upload_id, USER, dict(ANALYSIS, confidence_score=50 + i))
+
+    trained = storage_codec.train_dictionaries(sqlite_db)
+    assert 'analysis_data' in trained
+    storage_codec.recompress(sqlite_db)
+
+    conn = database.get_connection()
+    stored = conn.execute("SELECT analysis_data FROM ai_analysis ORDER BY id").fetchall()
+    conn.close()
+    codec_id = storage_codec.CODEC_ZSTD if codec == "zstd" else storage_codec.CODEC_ZLIB
+    assert all(bytes(row[0])[1] == codec_id for row in stored)
+    assert {record.confidence_score for record in database.get_all_user_analyses(USER)} == set(range(50, 90))
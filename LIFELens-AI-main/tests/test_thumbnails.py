@@ -0,0 +1,17 @@
+"""Reading stored thumbnails"""
+import thumbnails
+
+def _fail(path):
+    raise ValueError("authentication tag mismatch")
+
+def test_unreadable_thumbnails_are_none(tmp_path, monkeypatch, capsys):
+    scan = tmp_path / "scan.jpg"
+    scan.write_bytes(b"scan")
+    for size in thumbnails.SIZES:
+        (tmp_path / f"scan.jpg.thumb{size}.jpg").write_bytes(b"thumbnail")
+    assert thumbnails.get_thumbnail(str(scan)) == b"thumbnail"
+
+    monkeypatch.setattr(thumbnails, 'read_upload', _fail)
+    assert thumbnails.get_thumbnail(str(scan)) is None
+    assert thumbnails.ensure_thumbnail(str(scan)) is None
+    assert "Error reading thumbnail" in capsys.readouterr().out
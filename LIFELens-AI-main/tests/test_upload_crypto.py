@@ -0,0 +1,45 @@
+"""Reading uploads across encryption and master key rotation"""
+import base64
+
+import pytest
+
+import upload_crypto
+
+pytest.importorskip("cryptography")
+
+OLD_KEY = base64.urlsafe_b64encode(b"o" * 32).decode("ascii")
+NEW_KEY = base64.urlsafe_b64encode(b"n" * 32).decode("ascii")
+DATA = b"scan bytes " * 50000
+
+@pytest.fixture
+def upload(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_crypto, 'CHUNK_SIZE', 64 * 1024)
+    monkeypatch.setenv("LIFELENS_UPLOAD_KEY", OLD_KEY)
+    path = str(tmp_path / "scan.dcm")
+    with open(path, "wb") as f:
+        f.write(DATA)
+    return path
+
+def test_an_open_upload_is_read_as_it_was_opened(upload):
+    with upload_crypto.open_upload(upload) as f:
+        assert upload_crypto.encrypt_in_place(upload)
+        assert not upload_crypto.is_decrypting(f)
+        assert f.read() == DATA
+
+    with upload_crypto.open_upload(upload) as f:
+        assert upload_crypto.is_decrypting(f)
+        assert f.read() == DATA
+
+def test_retired_keys_decrypt_until_migrated(upload, monkeypatch):
+    upload_crypto.encrypt_in_place(upload)
+    monkeypatch.setenv("LIFELENS_UPLOAD_KEY", NEW_KEY)
+    with pytest.raises(ValueError):
+        upload_crypto.read_upload(upload)
+
+    monkeypatch.setenv("LIFELENS_UPLOAD_OLD_KEYS", f" {OLD_KEY} ")
+    assert upload_crypto.read_upload(upload) == DATA
+    assert upload_crypto.encrypt_in_place(upload)
+    assert not upload_crypto.encrypt_in_place(upload)
+
+    monkeypatch.delenv("LIFELENS_UPLOAD_OLD_KEYS")
+    assert upload_crypto.read_upload(upload) == DATA
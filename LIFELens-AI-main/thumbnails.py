@@ -0,0 +1,171 @@
+"""
+Thumbnail pyramid for uploaded scans.
+
+Each image or DICOM upload gets small (128px) and preview (512px) JPEG
+thumbnails written next to the upload, e.g. scan.jpg.thumb128.jpg. They are
+generated once, in a background worker right after the upload is saved: the
+512px level is decoded from the scan (JPEG DCT scaling, or the representative
+DICOM frame) and the 128px level is reduced from it. Pages showing upload
+history only ever read the thumbnail files; a missing thumbnail (e.g. an
+upload from before this feature) is queued for generation instead of
+decoding the scan while the page renders.
+
+Usage (generate thumbnails for existing uploads):
+    python thumbnails.py [--workers 4] [--db lifelens_ai.db]
+"""
+import argparse
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import database
+from upload_crypto import open_upload, read_upload, write_upload
+
+SMALL = 128
+PREVIEW = 512
+SIZES = (SMALL, PREVIEW)
+JPEG_QUALITY = 85
+WORKERS = int(os.getenv("LIFELENS_THUMBNAIL_WORKERS", "2"))
+
+_executor = None
+_in_flight = set()
+_lock = threading.Lock()
+
+def thumbnail_path(file_path, size):
+    """Where the thumbnail of an upload is stored"""
+    return f"{file_path}.thumb{size}.jpg"
+
+def _jpeg(img):
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=JPEG_QUALITY)
+    return buffer.getvalue()
+
+def _load_preview(file_path):
+    """The scan as an RGB image of at most PREVIEW pixels"""
+    from PIL import Image
+
+    import dicom_ingest
+
+    if dicom_ingest.is_dicom(file_path):
+        # The windowed representative frame, already downsampled
+        _, pixels = dicom_ingest.preview_frame(file_path, PREVIEW)
+        return Image.fromarray(pixels).convert("RGB")
+
+    with open_upload(file_path) as f, Image.open(f) as img:
+        # JPEG decodes straight to a reduced scale instead of full size
+        img.draft("RGB", (PREVIEW, PREVIEW))
+        img.thumbnail((PREVIEW, PREVIEW))
+        return img.convert("RGB")
+
+def generate_thumbnails(file_path):
+    """
+    Write every level of the pyramid for a scan
+    Returns True on success, False if the file can't be read as an image
+    """
+    try:
+        img = _load_preview(file_path)
+        for size in sorted(SIZES, reverse=True):
+            # Each level is reduced from the one above it
+            img.thumbnail((size, size))
+            # Thumbnails are stored like the scan itself, encrypted when uploads are
+            write_upload(thumbnail_path(file_path, size), _jpeg(img))
+        return True
+    except Exception as e:
+        print(f"Error creating thumbnails: {str(e)}")
+        return False
+
+def _generate_in_background(file_path):
+    try:
+        generate_thumbnails(file_path)
+    finally:
+        with _lock:
+            _in_flight.discard(file_path)
+
+def schedule_thumbnails(file_path):
+    """Queue thumbnail generation for a scan; repeated calls while it's queued are ignored"""
+    global _executor
+
+    with _lock:
+        if file_path in _in_flight:
+            return
+        _in_flight.add(file_path)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="thumbnails")
+    _executor.submit(_generate_in_background, file_path)
+
+def _read_thumbnail(path):
+    """A stored thumbnail's JPEG bytes, or None if it can't be read (e.g. removed or not decryptable)"""
+    try:
+        return read_upload(path)
+    except Exception as e:
+        print(f"Error reading thumbnail {path}: {str(e)}")
+        return None
+
+def get_thumbnail(file_path, size=SMALL):
+    """
+    Get the stored thumbnail of a scan without decoding the scan
+    Returns the JPEG bytes, or None while it is being generated or if it
+    can't be read
+    """
+    if not file_path:
+        return None
+
+    path = thumbnail_path(file_path, size)
+    if os.path.exists(path):
+        return _read_thumbnail(path)
+    if os.path.exists(file_path):
+        schedule_thumbnails(file_path)
+    return None
+
+def ensure_thumbnail(file_path, size=PREVIEW):
+    """
+    Get the thumbnail of a scan, generating the pyramid now if it's missing
+    Returns the JPEG bytes, or None for files that aren't images or DICOM
+    and thumbnails that can't be read
+    """
+    if not file_path or not os.path.exists(file_path):
+        return None
+
+    path = thumbnail_path(file_path, size)
+    if os.path.exists(path) or generate_thumbnails(file_path):
+        return _read_thumbnail(path)
+    return None
+
+def _backfill_upload(file_path):
+    if not os.path.exists(file_path):
+        return False
+    if all(os.path.exists(thumbnail_path(file_path, size)) for size in SIZES):
+        return True
+    return generate_thumbnails(file_path)
+
+def backfill(workers=None):
+    """Generate missing thumbnails for stored uploads in parallel; returns (created or present, failed)"""
+    file_paths = [row[0] for row in database._iter_shard_rows(
+        "SELECT file_path FROM uploads WHERE file_type IN ('image', 'dicom') ORDER BY id")]
+
+    ok = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for done in executor.map(_backfill_upload, file_paths, chunksize=8):
+            if done:
+                ok += 1
+            else:
+                failed += 1
+    return ok, failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate thumbnails for stored uploads")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--db", default=database.DB_PATH, help="Path to the database file")
+    args = parser.parse_args(argv)
+
+    database.DB_PATH = args.db
+    database.init_database()
+
+    ok, failed = backfill(args.workers)
+    print(f"Thumbnails ready: {ok}, failed or missing files: {failed}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,464 @@
+"""
+Encryption at rest for uploaded scans and their thumbnails.
+
+Files are encrypted with AES-256-GCM in fixed-size chunks, so encryption and
+decryption stream with constant memory, any byte range can be read by
+decrypting only the chunks that cover it, and large files can be decrypted
+in parallel. Each file has its own random data key, stored in the file
+header wrapped (AES-GCM) by the master key from LIFELENS_UPLOAD_KEY.
+Retired master keys listed in LIFELENS_UPLOAD_OLD_KEYS are still used to
+decrypt, and migrate re-encrypts their files under the current key.
+
+File layout:
+    header  magic, version, chunk size, master key id, wrap nonce,
+            wrapped data key, nonce prefix
+    chunks  ciphertext + 16-byte tag; every chunk but the last holds
+            chunk-size bytes of plaintext
+
+A chunk's nonce is the file's nonce prefix plus the chunk index, and its
+associated data is the header, the index and a last-chunk flag, so chunks
+can't be reordered, swapped between files or truncated unnoticed.
+
+Without LIFELENS_UPLOAD_KEY uploads are stored in plain; readers handle
+both, so existing files keep working while they are migrated.
+
+To rotate the master key, move the current one to LIFELENS_UPLOAD_OLD_KEYS,
+set a new LIFELENS_UPLOAD_KEY and run migrate.
+
+Usage:
+    python upload_crypto.py genkey
+    python upload_crypto.py migrate [--workers 2] [--db lifelens_ai.db]
+"""
+import argparse
+import base64
+import fcntl
+import hashlib
+import io
+import os
+import struct
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import database
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
+
+MAGIC = b"LLUE"
+VERSION = 1
+HEADER = struct.Struct(">4sBI8s12s48s8s")
+TAG_SIZE = 16
+CHUNK_SIZE = int(os.getenv("LIFELENS_UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+# Files with fewer chunks are decrypted in one stream
+PARALLEL_MIN_CHUNKS = 16
+
+_master_key = None
+_old_keys = None
+_migration_thread = None
+_migration_lock = threading.Lock()
+
+def master_key():
+    """The 32-byte master key from LIFELENS_UPLOAD_KEY, or None when encryption is off"""
+    global _master_key
+
+    encoded = os.getenv("LIFELENS_UPLOAD_KEY")
+    if not encoded:
+        return None
+    if _master_key is None or _master_key[0] != encoded:
+        key = base64.urlsafe_b64decode(encoded)
+        if len(key) != 32:
+            raise ValueError("LIFELENS_UPLOAD_KEY must be 32 bytes, base64 encoded")
+        _master_key = (encoded, key)
+    return _master_key[1]
+
+def old_master_keys():
+    """Retired master keys from LIFELENS_UPLOAD_OLD_KEYS (comma-separated), used only to decrypt"""
+    global _old_keys
+
+    encoded = os.getenv("LIFELENS_UPLOAD_OLD_KEYS", "")
+    if _old_keys is None or _old_keys[0] != encoded:
+        keys = [base64.urlsafe_b64decode(part.strip()) for part in encoded.split(",") if part.strip()]
+        if any(len(key) != 32 for key in keys):
+            raise ValueError("LIFELENS_UPLOAD_OLD_KEYS must list 32-byte keys, base64 encoded")
+        _old_keys = (encoded, keys)
+    return _old_keys[1]
+
+def encryption_enabled():
+    return master_key() is not None
+
+def _key_id(key):
+    return hashlib.sha256(key).digest()[:8]
+
+def _key_for(key_id):
+    """The current or a retired master key with this ID, or None"""
+    for key in [master_key()] + old_master_keys():
+        if key is not None and _key_id(key) == key_id:
+            return key
+    return None
+
+def _require_crypto():
+    if AESGCM is None:
+        raise RuntimeError("Upload encryption requires the cryptography package")
+
+class _Header:
+    """Parsed file header with the unwrapped data key"""
+
+    def __init__(self, raw, dek):
+        _, _, self.chunk_size, _, _, _, self.prefix = HEADER.unpack(raw)
+        self.raw = raw
+        self.dek = dek
+        self.cipher = AESGCM(dek)
+
+    @classmethod
+    def new(cls, chunk_size=CHUNK_SIZE):
+        _require_crypto()
+        key = master_key()
+        if key is None:
+            raise RuntimeError("LIFELENS_UPLOAD_KEY is not set")
+
+        dek = AESGCM.generate_key(bit_length=256)
+        wrap_nonce = os.urandom(12)
+        prefix = os.urandom(8)
+        key_id = _key_id(key)
+        wrapped = AESGCM(key).encrypt(wrap_nonce, dek, MAGIC + key_id + prefix)
+        raw = HEADER.pack(MAGIC, VERSION, chunk_size, key_id, wrap_nonce, wrapped, prefix)
+        return cls(raw, dek)
+
+    @classmethod
+    def parse(cls, raw):
+        _require_crypto()
+        magic, version, _, key_id, wrap_nonce, wrapped, prefix = HEADER.unpack(raw)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not an encrypted upload")
+
+        key = _key_for(key_id)
+        if key is None:
+            raise ValueError("Upload was encrypted with a master key that is not configured")
+        dek = AESGCM(key).decrypt(wrap_nonce, wrapped, MAGIC + key_id + prefix)
+        return cls(raw, dek)
+
+    def _nonce_and_aad(self, index, last):
+        return self.prefix + struct.pack(">I", index), self.raw + struct.pack(">IB", index, last)
+
+    def encrypt_chunk(self, index, data, last):
+        nonce, aad = self._nonce_and_aad(index, last)
+        return self.cipher.encrypt(nonce, data, aad)
+
+    def decrypt_chunk(self, index, data, last):
+        nonce, aad = self._nonce_and_aad(index, last)
+        return self.cipher.decrypt(nonce, data, aad)
+
+    def layout(self, file_size):
+        """(chunk count, plaintext size) of an encrypted file of file_size bytes"""
+        body = file_size - HEADER.size
+        stride = self.chunk_size + TAG_SIZE
+        chunks = max(1, -(-body // stride))
+        return chunks, body - chunks * TAG_SIZE
+
+def seal(data, context):
+    """
+    Encrypt a small value with the master key, bound to context (bytes)
+    Returns None when encryption is off
+    """
+    key = master_key()
+    if key is None or AESGCM is None:
+        return None
+    nonce = os.urandom(12)
+    return _key_id(key) + nonce + AESGCM(key).encrypt(nonce, data, MAGIC + context)
+
+def unseal(sealed, context):
+    """A value encrypted by seal(), or None if it was sealed with an unknown master key"""
+    key = _key_for(sealed[:8])
+    if key is None or AESGCM is None:
+        return None
+    return AESGCM(key).decrypt(sealed[8:20], sealed[20:], MAGIC + context)
+
+def is_encrypted(file_path):
+    """True for files written by this module"""
+    try:
+        with open(file_path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+def encrypt_stream(source, dest, chunk_size=CHUNK_SIZE):
+    """Encrypt a readable binary stream into a writable one, one chunk in memory at a time"""
+    header = _Header.new(chunk_size)
+    dest.write(header.raw)
+
+    # Read one chunk ahead to know which chunk is the last
+    index = 0
+    chunk = source.read(chunk_size)
+    while True:
+        following = source.read(chunk_size) if len(chunk) == chunk_size else b""
+        last = not following
+        dest.write(header.encrypt_chunk(index, chunk, last))
+        if last:
+            return
+        chunk = following
+        index += 1
+
+def decrypt_stream(source, dest):
+    """Decrypt a stream written by encrypt_stream, one chunk in memory at a time"""
+    header = _Header.parse(source.read(HEADER.size))
+    stride = header.chunk_size + TAG_SIZE
+
+    index = 0
+    chunk = source.read(stride)
+    while True:
+        following = source.read(stride) if len(chunk) == stride else b""
+        dest.write(header.decrypt_chunk(index, chunk, not following))
+        if not following:
+            return
+        chunk = following
+        index += 1
+
+def _decrypt_range(src_path, dst_path, raw_header, dek, start, stop, chunks):
+    """Decrypt chunks start..stop of a file into their place in the output file"""
+    header = _Header(raw_header, dek)
+    stride = header.chunk_size + TAG_SIZE
+    src = os.open(src_path, os.O_RDONLY)
+    dst = os.open(dst_path, os.O_WRONLY)
+    try:
+        for index in range(start, stop):
+            data = os.pread(src, stride, HEADER.size + index * stride)
+            os.pwrite(dst, header.decrypt_chunk(index, data, index == chunks - 1), index * header.chunk_size)
+    finally:
+        os.close(src)
+        os.close(dst)
+
+def decrypt_file(src_path, dst_path, workers=None):
+    """Decrypt a file to dst_path, splitting large files across worker processes"""
+    with open(src_path, "rb") as f:
+        raw = f.read(HEADER.size)
+    header = _Header.parse(raw)
+    chunks, plain_size = header.layout(os.path.getsize(src_path))
+
+    with open(dst_path, "wb") as out:
+        out.truncate(plain_size)
+
+    workers = min(workers or os.cpu_count() or 1, chunks // PARALLEL_MIN_CHUNKS or 1)
+    if workers <= 1:
+        _decrypt_range(src_path, dst_path, raw, header.dek, 0, chunks, chunks)
+        return
+
+    step = -(-chunks // workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_decrypt_range, src_path, dst_path, raw, header.dek,
+                                   start, min(start + step, chunks), chunks)
+                   for start in range(0, chunks, step)]
+        for future in futures:
+            future.result()
+
+class EncryptedReader(io.RawIOBase):
+    """
+    Seekable read-only view of the plaintext of an encrypted file (a path, or
+    a binary file it takes over); only the chunks covering each read are
+    decrypted, and the last one is kept
+    """
+
+    def __init__(self, source):
+        self._file = open(source, "rb") if isinstance(source, (str, bytes, os.PathLike)) else source
+        try:
+            self._file.seek(0)
+            self._header = _Header.parse(self._file.read(HEADER.size))
+        except BaseException:
+            self._file.close()
+            raise
+        self._chunks, self._size = self._header.layout(os.fstat(self._file.fileno()).st_size)
+        self._position = 0
+        self._cached = (None, b"")
+        self.name = getattr(self._file, "name", None)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._position = offset
+        return offset
+
+    def tell(self):
+        return self._position
+
+    def _chunk(self, index):
+        if self._cached[0] != index:
+            stride = self._header.chunk_size + TAG_SIZE
+            self._file.seek(HEADER.size + index * stride)
+            data = self._header.decrypt_chunk(index, self._file.read(stride), index == self._chunks - 1)
+            self._cached = (index, data)
+        return self._cached[1]
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast("B")
+        written = 0
+        while written < len(view) and self._position < self._size:
+            index, offset = divmod(self._position, self._header.chunk_size)
+            data = self._chunk(index)[offset:offset + len(view) - written]
+            view[written:written + len(data)] = data
+            written += len(data)
+            self._position += len(data)
+        return written
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+def open_upload(file_path):
+    """
+    Open a stored upload for reading, decrypting it transparently if it's encrypted
+    The header is checked on the opened file, so a file the migration
+    replaces meanwhile is read in whichever form was opened
+    """
+    f = open(file_path, "rb")
+    try:
+        encrypted = f.read(len(MAGIC)) == MAGIC
+        f.seek(0)
+        if encrypted:
+            return io.BufferedReader(EncryptedReader(f), buffer_size=64 * 1024)
+        return f
+    except BaseException:
+        f.close()
+        raise
+
+def is_decrypting(f):
+    """True for a file from open_upload that decrypts an encrypted upload"""
+    return isinstance(getattr(f, "raw", None), EncryptedReader)
+
+def read_upload(file_path):
+    """The plaintext bytes of a stored upload"""
+    with open_upload(file_path) as f:
+        return f.read()
+
+def write_upload(file_path, source):
+    """
+    Store an upload from bytes or a readable binary stream, encrypted when a
+    master key is configured; readers never see a partial file
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        with open(tmp_path, "wb") as out:
+            if encryption_enabled():
+                encrypt_stream(source, out)
+            else:
+                while True:
+                    chunk = source.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def encrypt_in_place(file_path):
+    """
+    Encrypt a plaintext upload in place, or re-encrypt one under a retired
+    master key; returns False if it was already encrypted with the current key
+    Safe to run from several processes at once: the file is locked while it is
+    checked and encrypted, from the same handle
+    """
+    while True:
+        with open(file_path, "rb") as source:
+            fcntl.flock(source.fileno(), fcntl.LOCK_EX)
+            # Another process may have replaced the file while this one waited
+            if os.fstat(source.fileno()).st_ino != os.stat(file_path).st_ino:
+                continue
+            raw = source.read(HEADER.size)
+            source.seek(0)
+            if raw[:len(MAGIC)] != MAGIC:
+                write_upload(file_path, source)
+                return True
+            if HEADER.unpack(raw)[3] == _key_id(master_key()):
+                return False
+            with io.BufferedReader(EncryptedReader(source), buffer_size=CHUNK_SIZE) as plaintext:
+                write_upload(file_path, plaintext)
+            return True
+
+def _stored_files():
+    """Upload files and their thumbnails"""
+    from thumbnails import SIZES, thumbnail_path
+
+    for (file_path,) in database._iter_shard_rows("SELECT file_path FROM uploads ORDER BY id"):
+        yield file_path
+        for size in SIZES:
+            if os.path.exists(thumbnail_path(file_path, size)):
+                yield thumbnail_path(file_path, size)
+
+def _migrate_file(file_path):
+    try:
+        if not os.path.exists(file_path):
+            return 'missing'
+        return 'encrypted' if encrypt_in_place(file_path) else 'already encrypted'
+    except Exception as e:
+        print(f"Error encrypting {file_path}: {str(e)}")
+        return 'failed'
+
+def migrate(workers=1):
+    """
+    Encrypt every plaintext upload and thumbnail in place, and re-encrypt those
+    under retired master keys; returns a count per outcome
+    """
+    if not encryption_enabled():
+        raise RuntimeError("LIFELENS_UPLOAD_KEY is not set")
+    _require_crypto()
+
+    counts = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for outcome in executor.map(_migrate_file, _stored_files()):
+            counts[outcome] = counts.get(outcome, 0) + 1
+    return counts
+
+def start_background_migration():
+    """Encrypt plaintext uploads in a background thread, once per process, when a key is set"""
+    global _migration_thread
+
+    with _migration_lock:
+        if _migration_thread is not None or not encryption_enabled():
+            return
+        _migration_thread = threading.Thread(target=migrate, name="lifelens-upload-encryption", daemon=True)
+        _migration_thread.start()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upload encryption at rest")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("genkey", help="Print a new master key for LIFELENS_UPLOAD_KEY")
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="Encrypt existing uploads in place, re-encrypting those under retired keys")
+    migrate_parser.add_argument("--workers", type=int, default=2)
+    migrate_parser.add_argument("--db", default=database.DB_PATH, help="Path to the database file")
+    args = parser.parse_args(argv)
+
+    if args.command == "genkey":
+        print(base64.urlsafe_b64encode(os.urandom(32)).decode("ascii"))
+        return 0
+
+    database.DB_PATH = args.db
+    database.init_database()
+    try:
+        counts = migrate(args.workers)
+    except RuntimeError as e:
+        print(str(e))
+        return 1
+    for outcome, count in sorted(counts.items()):
+        print(f"{outcome}: {count}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -24,9 +24,9 @@ def save_uploaded_file(uploaded_file, user_email):
         filename = f"{timestamp}_{uploaded_file.name}"
         file_path = os.path.join(user_dir, filename)
         
-        # Save file
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
+        # Save file, encrypted at rest when a master key is configured
+        from upload_crypto import write_upload
+        write_upload(file_path, uploaded_file.getbuffer())
         
         return file_path, filename
     
@@ -41,6 +41,8 @@ def get_file_type(filename):
         return 'image'
     elif extension == 'pdf':
         return 'pdf'
+    elif extension == 'dcm':
+        return 'dicom'
     else:
         return 'other'
 
@@ -59,65 +61,78 @@ def format_file_size(size_bytes):
 
 def generate_report_content(demographics, upload_info=None):
     """Generate sample report content"""
-    content = f"""
-# Health Report
-
-**Generated on:** {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    from report_templates import UPLOAD_REPORT_TEMPLATE, build_upload_report_params, encode_params, render_report
+    
+    params = build_upload_report_params(demographics, upload_info)
+    return render_report(UPLOAD_REPORT_TEMPLATE, encode_params(params))
 
-## Patient Information
-"""
+def show_data_export(user_email, datasets, key):
+    """Display on-demand export controls; nothing is generated until requested"""
+    from data_export import (
+        EXPORT_DATASETS, EXPORT_FORMATS, BACKGROUND_EXPORT_ROWS, available_formats,
+        count_export_rows, export_filename, spooled_export, start_export_job, get_export_job
+    )
     
-    if demographics:
-        content += f"""
-- **Age:** {demographics.get('age', 'Not provided')}
-- **Gender:** {demographics.get('gender', 'Not provided')}
-- **Weight:** {demographics.get('weight', 'Not provided')} kg
-- **Height:** {demographics.get('height', 'Not provided')} cm
-- **Daily Water Intake:** {demographics.get('daily_water_intake', 'Not provided')} glasses
-"""
-        
-        # Calculate BMI if possible
-        from diet_generator import calculate_bmi, get_bmi_category
-        weight = demographics.get('weight')
-        height = demographics.get('height')
-        if weight and height:
-            bmi = calculate_bmi(weight, height)
-            if bmi:
-                content += f"- **BMI:** {bmi} ({get_bmi_category(bmi)})\n"
+    col1, col2 = st.columns(2)
     
-    if upload_info:
-        content += f"""
-
-## Uploaded Scan Information
-- **Filename:** {upload_info.get('filename', 'Unknown')}
-- **File Type:** {upload_info.get('file_type', 'Unknown')}
-- **Upload Date:** {upload_info.get('upload_date', 'Unknown')}
-"""
+    with col1:
+        dataset = st.selectbox(
+            "Data to export",
+            datasets,
+            format_func=lambda d: EXPORT_DATASETS[d]['label'],
+            key=f"{key}_dataset"
+        )
     
-    content += """
-
-## Health Recommendations
-
-### Dietary Guidelines
-- Follow a kidney-friendly diet low in sodium
-- Monitor protein intake based on kidney function
-- Stay adequately hydrated
-- Limit processed foods
-
-### Lifestyle Recommendations
-- Regular exercise as tolerated
-- Monitor blood pressure regularly
-- Avoid smoking and limit alcohol
-- Get adequate sleep
-
-### Follow-up Care
-- Schedule regular check-ups with your healthcare provider
-- Monitor kidney function through lab tests
-- Keep track of symptoms and report changes
-
----
-
-*Note: This report is for informational purposes only and should not replace professional medical advice. Always consult with your healthcare provider for personalized recommendations.*
-"""
+    with col2:
+        fmt = st.selectbox(
+            "Format",
+            available_formats(),
+            format_func=lambda f: EXPORT_FORMATS[f]['label'],
+            key=f"{key}_format"
+        )
     
-    return content
+    job_key = f"{key}_job"
+    
+    if st.button("📦 Prepare Export", key=f"{key}_prepare", use_container_width=True):
+        if count_export_rows(user_email, dataset) > BACKGROUND_EXPORT_ROWS:
+            # Large histories are exported in the background
+            st.session_state[job_key] = start_export_job(user_email, dataset, fmt)
+        else:
+            try:
+                with spooled_export(user_email, dataset, fmt) as export_file:
+                    st.download_button(
+                        label=f"📥 Download {EXPORT_DATASETS[dataset]['label']} ({EXPORT_FORMATS[fmt]['label']})",
+                        data=export_file,
+                        file_name=export_filename(user_email, dataset, fmt),
+                        mime=EXPORT_FORMATS[fmt]['mime'],
+                        key=f"{key}_download",
+                        use_container_width=True
+                    )
+            except Exception as e:
+                st.error(f"Export failed: {str(e)}")
+    
+    job_id = st.session_state.get(job_key)
+    if job_id:
+        job = get_export_job(job_id)
+        
+        if job is None or job['user_email'] != user_email:
+            del st.session_state[job_key]
+        elif job['status'] == 'completed' and not os.path.exists(job['path']):
+            # Old exports are cleaned up; ask for a fresh one
+            del st.session_state[job_key]
+        elif job['status'] in ('queued', 'running'):
+            st.info("⏳ Your export is being prepared in the background.")
+            st.button("🔄 Check Export Status", key=f"{key}_refresh")
+        elif job['status'] == 'completed':
+            with open(job['path'], "rb") as export_file:
+                st.download_button(
+                    label=f"📥 Download Export ({job['rows']} rows)",
+                    data=export_file,
+                    file_name=job['file_name'],
+                    mime=EXPORT_FORMATS[job['format']]['mime'],
+                    key=f"{key}_job_download",
+                    use_container_width=True
+                )
+        else:
+            st.error(f"Export failed: {job['error']}")
+            del st.session_state[job_key]